@@ -0,0 +1,90 @@
+import random
+from ..lib.kaonavi.connector import (
+    BIRTH_PLACE_FIELD_ID, JOB_DESCRIPTION_FIELD_ID, CAREER_FIELD_ID, HOBBY_FIELD_ID,
+    SPECIALTY_FIELD_ID, STRENGTHS_FIELD_ID, MESSAGE_FIELD_ID,
+)
+from ..lib.profile_image_index import PROFILE_IMAGE_PREFIX
+from ..models import User
+
+LAST_NAMES = ['佐藤', '鈴木', '高橋', '田中', '伊藤', '渡辺', '山本', '中村', '小林', '加藤']
+LAST_NAMES_KANA = ['サトウ', 'スズキ', 'タカハシ', 'タナカ', 'イトウ', 'ワタナベ', 'ヤマモト', 'ナカムラ', 'コバヤシ', 'カトウ']
+FIRST_NAMES = ['太郎', '花子', '一郎', '美咲', '健太', '陽菜', '翔', '結衣', '大輔', '彩']
+FIRST_NAMES_KANA = ['タロウ', 'ハナコ', 'イチロウ', 'ミサキ', 'ケンタ', 'ヒナ', 'ショウ', 'ユイ', 'ダイスケ', 'アヤ']
+HEADQUARTERS = ['営業本部', '開発本部', '管理本部', 'マーケティング本部']
+DEPARTMENTS = ['第一部', '第二部', '第三部', '企画部', '推進部']
+GROUPS = ['Aグループ', 'Bグループ', 'Cグループ', 'Dグループ']
+ROLES = ['', '', '', '主任', '課長', '部長']
+RECRUIT_CATEGORIES = ['新卒', '中途']
+
+
+def synthetic_members(size, seed=0):
+    '''
+    カオナビの社員情報一覧(/membersのmember_data)と同じ形の架空の社員情報をsize件返す
+    '''
+    rng = random.Random(seed)
+    members = []
+    for i in range(size):
+        last, first = rng.randrange(len(LAST_NAMES)), rng.randrange(len(FIRST_NAMES))
+        names = [rng.choice(HEADQUARTERS), rng.choice(DEPARTMENTS), rng.choice(GROUPS)]
+        members.append(dict(
+            code=f'B{i:06d}',
+            name=f'{LAST_NAMES[last]} {FIRST_NAMES[first]}{i}',
+            name_kana=f'{LAST_NAMES_KANA[last]} {FIRST_NAMES_KANA[first]}',
+            mail=f'benchmark{i}@example.com',
+            entered_date='2015-04-01',
+            gender=rng.choice(['男性', '女性']),
+            years_of_service=f'{rng.randrange(0, 30)}年{rng.randrange(0, 12)}ヶ月',
+            department=dict(code=f'D{i % 60:03d}', name=' '.join(names), names=names),
+            custom_fields=[
+                dict(id=1, name='役職', values=[rng.choice(ROLES)]),
+                dict(id=2, name='採用区分', values=[rng.choice(RECRUIT_CATEGORIES)]),
+            ],
+        ))
+    return members
+
+
+def synthetic_sheets(members, ratio=0.6, seed=0):
+    '''
+    自己紹介シート(/sheets/:sheet_id)と同じ形の架空のシートを、社員のratioの割合の分だけ返す
+    '''
+    rng = random.Random(seed)
+    field_ids = [
+        BIRTH_PLACE_FIELD_ID, JOB_DESCRIPTION_FIELD_ID, CAREER_FIELD_ID, HOBBY_FIELD_ID,
+        SPECIALTY_FIELD_ID, STRENGTHS_FIELD_ID, MESSAGE_FIELD_ID,
+    ]
+    return dict(member_data=[
+        dict(code=member['code'], records=[dict(custom_fields=[
+            dict(id=field_id, values=[f"{member['name']}の項目{field_id}" * rng.randrange(1, 4)])
+            for field_id in field_ids
+        ])])
+        for member in members if rng.random() < ratio
+    ])
+
+
+def synthetic_users(members, quit_ratio=0.1, seed=0):
+    '''
+    社員情報に対応するUserをまとめて作成する(パスワードは設定しない)
+    '''
+    rng = random.Random(seed)
+    users = [
+        User(
+            email=member['mail'],
+            username=f"benchmark{i}",
+            kaonavi_code=member['code'],
+            chatwork_id=f"cw{i}",
+            is_quit=rng.random() < quit_ratio,
+        )
+        for i, member in enumerate(members)
+    ]
+    for user in users:
+        user.set_unusable_password()
+    return User.objects.bulk_create(users, batch_size=1000)
+
+
+def synthetic_image_keys(members, ratio=0.5, seed=0):
+    '''
+    S3にプロフィール画像がある社員のキーを返す(no-image画像を含む)
+    '''
+    rng = random.Random(seed)
+    keys = {f"{PROFILE_IMAGE_PREFIX}benchmark{i}.jpg" for i in range(len(members)) if rng.random() < ratio}
+    return keys | {f"{PROFILE_IMAGE_PREFIX}no-image.jpg"}
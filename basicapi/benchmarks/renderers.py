@@ -0,0 +1,91 @@
+import json
+import statistics
+import time
+import uuid
+from unittest import mock
+from rest_framework.renderers import JSONRenderer
+from ..lib import renderers
+from ..lib.renderers import FastJSONRenderer, iter_json
+from .fixtures import synthetic_members
+
+DEFAULT_SIZES = (30, 300, 3000)
+DEFAULT_ITERATIONS = 20
+
+
+def synthetic_users_response(size):
+    '''
+    社員一覧(/api/users/)のレスポンスと同じ形・同じくらいの大きさのdictを返す
+    プロフィール画像は長い署名付きURL、自己紹介シートの値は日本語の文章にする
+    '''
+    records = []
+    for i, member in enumerate(synthetic_members(size)):
+        departments = member['department']['names']
+        records.append(dict(
+            image=(
+                f"https://benchmark.s3.amazonaws.com/all-profile-images/benchmark{i}.jpg"
+                f"?X-Amz-Algorithm=AWS4-HMAC-SHA256&X-Amz-Credential=AKIA{'X' * 16}%2F20261018%2Fap-northeast-1%2Fs3%2Faws4_request"
+                f"&X-Amz-Date=20261018T000000Z&X-Amz-Expires=3600&X-Amz-SignedHeaders=host&X-Amz-Signature={'f' * 64}"
+            ),
+            user_id=uuid.UUID(int=i),
+            chatwork_id=f"cw{i}",
+            email=member['mail'],
+            name=member['name'],
+            name_kana=member['name_kana'],
+            headquarters=departments[0],
+            department=departments[1],
+            group=departments[2],
+            role=member['custom_fields'][0]['values'][0],
+            job_description=f"{departments[0]}で{departments[1]}の業務改善とメンバーの育成を担当しています。" * 2,
+        ))
+    return dict(
+        records=records,
+        meta=dict(per_page=size, total_pages=1, total_count=size, current_page=1, has_next_page=False,
+                  next_page=None, has_previous_page=False, previous_page=None),
+    )
+
+
+def renderer_candidates():
+    '''
+    計測するレンダラーの(名前, dataをbytesにする関数)のlistを返す
+    '''
+    def stdlib_fallback(data):
+        # orjsonがインストールされていない環境での処理
+        with mock.patch.object(renderers, 'orjson', None):
+            return FastJSONRenderer().render(data)
+
+    return [
+        ('JSONRenderer (DRF)', lambda data: JSONRenderer().render(data)),
+        ('FastJSONRenderer', lambda data: FastJSONRenderer().render(data)),
+        ('FastJSONRenderer (stdlib)', stdlib_fallback),
+        ('iter_json (streaming)', lambda data: b''.join(iter_json(data))),
+    ]
+
+
+def run_renderer_benchmarks(sizes=DEFAULT_SIZES, iterations=DEFAULT_ITERATIONS, on_result=None):
+    '''
+    社員一覧のレスポンス(recordsの件数ごと)を各レンダラーでJSONにする時間を計測する
+    出力がDRFのJSONRendererと同じ内容になっているかも確認する
+    '''
+    results = []
+    for size in sizes:
+        data = synthetic_users_response(size)
+        expected = json.loads(JSONRenderer().render(data))
+        for name, render in renderer_candidates():
+            content = render(data)
+            timings = []
+            for _ in range(iterations):
+                started_at = time.perf_counter()
+                render(data)
+                timings.append((time.perf_counter() - started_at) * 1000)
+            result = dict(
+                size=size,
+                renderer=name,
+                p50_ms=round(statistics.median(timings), 3),
+                min_ms=round(min(timings), 3),
+                bytes=len(content),
+                same_output=json.loads(content) == expected,
+            )
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+    return results
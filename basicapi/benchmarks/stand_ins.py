@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from botocore.exceptions import ClientError
+from django.test.utils import override_settings
+from urllib3 import HTTPConnectionPool
+from urllib3.poolmanager import SSL_KEYWORDS
+from ..lib.kaonavi.http import kaonavi_session
+
+
+class KaonaviStub:
+    '''
+    カオナビAPI(/token, /members, /sheets/:sheet_id)の代わりに応答するローカルのHTTPサーバー
+    stand_insで、kaonavi_sessionと同じ設定(_build_session)のセッションの接続先をこのサーバーに向けるので、
+    接続プール・Keep-Alive・再試行・レート制限などの処理はそのままに、カオナビにだけ接続しなくなる(TLSは使わない)
+    latencyで1リクエストあたりの応答時間(秒)を指定できる
+    '''
+    def __init__(self, members, sheets, latency=0):
+        self.members = members
+        self.sheets = sheets
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def respond(self, method, path, body):
+        '''
+        リクエストに対するレスポンスの中身を返す
+        '''
+        endpoint = f"{method} {path.split('/api/v2.0', 1)[-1]}"
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if path.endswith('/token'):
+            return dict(access_token='benchmark-token', expires_in=3600)
+        elif path.endswith('/members'):
+            return dict(member_data=self.members)
+        elif method == 'GET':
+            return self.sheets
+        else:
+            return dict(member_data=json.loads(body)['member_data'])
+
+    def call_count(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    @contextmanager
+    def serve(self):
+        '''
+        with文の間、空いているポートでサーバーを動かし、(ホスト, ポート)を返す
+        '''
+        server = ThreadingHTTPServer(('127.0.0.1', 0), KaonaviStubHandler)
+        server.daemon_threads = True
+        server.stub = self
+        thread = threading.Thread(target=server.serve_forever, kwargs=dict(poll_interval=0.05), daemon=True)
+        thread.start()
+        try:
+            yield server.server_address
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+
+class KaonaviStubHandler(BaseHTTPRequestHandler):
+    # Keep-Aliveで接続を使い回せるようにする
+    protocol_version = 'HTTP/1.1'
+    # ヘッダーと本文を別々に書き込むため、Nagleアルゴリズムで応答が遅れないようにする
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._respond()
+
+    def do_POST(self):
+        self._respond()
+
+    def do_PATCH(self):
+        self._respond()
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        content = json.dumps(self.server.stub.respond(self.command, self.path, body), ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class S3Stub:
+    '''
+    boto3のS3クライアントの代わりに、プロフィール画像の存在確認・署名付きURLの発行・一覧の取得に応答する
+    latencyで1呼び出しあたりの応答時間(秒)を指定できる(署名付きURLの発行はS3へ通信しないので含めない)
+    '''
+    def __init__(self, keys, latency=0):
+        self.keys = set(keys)
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def head_object(self, Bucket, Key):
+        self._record('head_object', self.latency)
+        if Key not in self.keys:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {}
+
+    def generate_presigned_url(self, operation_name, Params, ExpiresIn):
+        self._record('generate_presigned_url', 0)
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+    def list_objects_v2(self, Bucket, Prefix='', **kwargs):
+        self._record('list_objects_v2', self.latency)
+        return dict(
+            Contents=[dict(Key=key) for key in sorted(self.keys) if key.startswith(Prefix)],
+            IsTruncated=False,
+        )
+
+    def get_paginator(self, operation_name):
+        s3 = self
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                return [s3.list_objects_v2(**kwargs)]
+
+        return Paginator()
+
+    def call_count(self, include_presign=False):
+        with self._lock:
+            return sum(count for name, count in self.calls.items() if include_presign or name != 'generate_presigned_url')
+
+    def _record(self, name, latency):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if latency:
+            time.sleep(latency)
+
+
+def redirect_session(session, host, port):
+    '''
+    sessionのhttpsのリクエストを、URLのホストに関係なくhost:port(TLSなし)に送るようにする
+    接続プールの大きさ・再試行などはsessionのアダプターの設定をそのまま使う
+    '''
+    poolmanager = session.get_adapter('https://').poolmanager
+
+    def connection_pool(_host, _port, **kwargs):
+        for keyword in SSL_KEYWORDS:
+            kwargs.pop(keyword, None)
+        return HTTPConnectionPool(host, port, **kwargs)
+
+    poolmanager.pool_classes_by_scheme = dict(poolmanager.pool_classes_by_scheme, https=connection_pool)
+
+
+@contextmanager
+def stand_ins(kaonavi, s3):
+    '''
+    with文の間、カオナビAPIへのリクエストをkaonavi(KaonaviStub)に、S3への問い合わせをs3(S3Stub)に向ける
+    カオナビAPIへのリクエストには、kaonavi_sessionと同じ設定で作ったセッションを使う
+    '''
+    session = kaonavi_session._build_session()
+    original_session = kaonavi_session._session
+    with kaonavi.serve() as (host, port):
+        redirect_session(session, host, port)
+        kaonavi_session._session = session
+        try:
+            with override_settings(STORAGE_CLIENT=s3):
+                yield
+        finally:
+            kaonavi_session._session = original_session
+            session.close()
@@ -0,0 +1,121 @@
+import statistics
+import time
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from ..lib.kaonavi.connector import KaonaviConnector, DIRECTORY_SOURCE_LOCAL, DIRECTORY_SOURCE_LIVE
+from ..lib.kaonavi.payload import payload_digest
+from ..lib.kaonavi.resilience import circuit_breaker
+from ..lib.kaonavi.sync import sync_kaonavi_members
+from ..lib.kaonavi.user_filter import UserFilter
+from ..lib.presigned_url_cache import presigned_url_cache
+from ..lib.profile_image_index import profile_image_index
+from ..models import User, KaonaviMember, KaonaviMemberDocument, KaonaviSelfIntroductionSheet, KaonaviChangeLog, SelfIntroductionEdit
+from .fixtures import synthetic_members, synthetic_sheets, synthetic_users, synthetic_image_keys
+from .stand_ins import KaonaviStub, S3Stub, stand_ins
+
+DEFAULT_SIZES = (100, 1000, 10000)
+DEFAULT_ITERATIONS = 5
+
+LIST_PARAMS = {'per_page': '30'}
+FILTER_PARAMS = {'per_page': '30', 'name': '佐藤', 'headquarters': '開発本部', 'years_of_service': '5'}
+CURSOR_PARAMS = {'per_page': '30', 'pagination': 'cursor', 'sort': '-years_of_service'}
+SPARSE_PARAMS = {'per_page': '30', 'fields': 'user_id,name,department'}
+
+# ベンチマーク中はレート制限・再試行をせず、キャッシュはプロセス内のものを使う(本番のキャッシュを汚さない)
+BENCHMARK_SETTINGS = dict(
+    KAONAVI_RATE_LIMIT_PER_SECOND=0,
+    KAONAVI_HTTP_MAX_RETRIES=0,
+    AWS_S3_BUCKET_NAME='benchmark',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}},
+)
+
+
+def scenarios(members):
+    '''
+    計測する処理の(名前, 関数, 計測前に1度実行するか)のlistを返す
+    '''
+    user = User.objects.filter(is_quit=False).order_by('kaonavi_code').first()
+    local = lambda: KaonaviConnector(source=DIRECTORY_SOURCE_LOCAL)
+    live = lambda: KaonaviConnector(source=DIRECTORY_SOURCE_LIVE)
+    version = payload_digest(members)
+    return [
+        ('sync (initial)', sync_kaonavi_members, False),
+        ('sync (no changes)', sync_kaonavi_members, True),
+        ('local get_users', lambda: local().get_users(LIST_PARAMS), True),
+        ('local get_users filtered', lambda: local().get_users(FILTER_PARAMS), True),
+        ('local get_users cursor', lambda: local().get_users(CURSOR_PARAMS), True),
+        ('local get_users fields', lambda: local().get_users(SPARSE_PARAMS), True),
+        ('local get_user', lambda: local().get_user(user.id, user.kaonavi_code), True),
+        ('live get_users', lambda: live().get_users(LIST_PARAMS), True),
+        ('live get_users filtered', lambda: live().get_users(FILTER_PARAMS), True),
+        ('live get_user', lambda: live().get_user(user.id, user.kaonavi_code), True),
+        ('UserFilter filtered', lambda: UserFilter(FILTER_PARAMS, members, version=version).call(), True),
+    ]
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, iterations=DEFAULT_ITERATIONS, kaonavi_latency=0, s3_latency=0, on_result=None):
+    '''
+    社員数(sizes)ごとに架空の社員・Userを作成し、社員一覧/社員詳細/UserFilterなどの処理を計測する
+    カオナビAPIとS3はスタンドイン(KaonaviStub, S3Stub)に向け、応答時間をlatencyで指定できる
+    処理ごとにレイテンシ(ms)・DBへのクエリ数・カオナビAPI/S3への呼び出し回数(1回あたり)のdictを返す
+    テスト用のDBで実行すること(manage.py benchmark_directory)
+    '''
+    results = []
+    with override_settings(**BENCHMARK_SETTINGS):
+        for size in sizes:
+            reset_state()
+            members = synthetic_members(size)
+            sheets = synthetic_sheets(members)
+            synthetic_users(members)
+            kaonavi = KaonaviStub(members, sheets, latency=kaonavi_latency)
+            s3 = S3Stub(synthetic_image_keys(members), latency=s3_latency)
+
+            with stand_ins(kaonavi, s3):
+                for name, func, warm_up in scenarios(members):
+                    result = measure(func, 1 if name == 'sync (initial)' else iterations, warm_up, kaonavi, s3)
+                    result = dict(size=size, scenario=name, **result)
+                    results.append(result)
+                    if on_result is not None:
+                        on_result(result)
+    return results
+
+
+def measure(func, iterations, warm_up, kaonavi, s3):
+    '''
+    funcをiterations回実行し、レイテンシの分布と1回あたりのクエリ数・カオナビAPI/S3への呼び出し回数を返す
+    warm_upがTrueの場合は、キャッシュなどを温めるために計測前に1度実行する
+    '''
+    if warm_up:
+        func()
+
+    timings = []
+    queries = 0
+    kaonavi_calls = kaonavi.call_count()
+    s3_calls = s3.call_count()
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as context:
+            started_at = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started_at) * 1000)
+        queries += len(context.captured_queries)
+
+    timings.sort()
+    return dict(
+        p50_ms=round(statistics.median(timings), 2),
+        p95_ms=round(timings[min(int(len(timings) * 0.95), len(timings) - 1)], 2),
+        max_ms=round(timings[-1], 2),
+        queries=round(queries / iterations, 1),
+        kaonavi_calls=round((kaonavi.call_count() - kaonavi_calls) / iterations, 1),
+        s3_calls=round((s3.call_count() - s3_calls) / iterations, 1),
+    )
+
+
+def reset_state():
+    '''
+    前の社員数での計測のデータと、プロセス内のキャッシュを消す
+    '''
+    for model in (SelfIntroductionEdit, KaonaviChangeLog, KaonaviMemberDocument, KaonaviSelfIntroductionSheet, KaonaviMember, User):
+        model.objects.all().delete()
+    profile_image_index.invalidate()
+    presigned_url_cache.clear()
+    circuit_breaker.record_success()
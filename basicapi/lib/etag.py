@@ -0,0 +1,13 @@
+import hashlib
+import json
+from .presigned_url_cache import url_generation
+
+
+def make_etag(*parts):
+    '''
+    レスポンスの元になったデータのバージョンなどからETagを作る
+    レスポンスに含まれるS3の署名付きURLには有効期限があるため、
+    署名付きURLを使い回す世代(url_generation)ごとにETagが変わるようにして、期限切れのURLを返し続けないようにしている
+    '''
+    raw = json.dumps([url_generation(), *parts], ensure_ascii=False, sort_keys=True, default=str)
+    return '"' + hashlib.sha1(raw.encode()).hexdigest() + '"'
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+import uuid
+import weakref
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+TOKEN_CACHE_KEY = 'kaonavi:access_token'
+TOKEN_LOCK_KEY = 'kaonavi:access_token:lock'
+DEFAULT_REFRESH_MARGIN = 300 # 有効期限の何秒前に取り直すか
+LOCK_TIMEOUT = 10
+LOCK_WAIT_INTERVAL = 0.1
+
+
+class AccessTokenCache:
+    '''
+    カオナビAPIのアクセストークンをプロセス内とDjangoのキャッシュに保持する
+    有効期限(expires_in)の少し前までは同じトークンを使い回し、期限が近づいたら取り直す
+    プロセス内はthreading.Lock、ワーカー間はcache.addによるロックで、取り直しが同時に1回だけ走るようにしている
+    ワーカー間のロックの値には取ったワーカーごとの値を入れ、自分が取ったロックのみ解放する
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._async_locks = weakref.WeakKeyDictionary()
+        self._token = None
+        self._expires_at = 0
+
+    def get(self, fetch):
+        '''
+        有効なトークンを返す
+        fetchは(access_token, expires_in)を返す関数で、キャッシュに有効なトークンが無い場合のみ呼ばれる
+        '''
+        token = self._local_token()
+        if token is not None:
+            return token
+
+        with self._lock:
+            # ロック待ちの間に他のスレッドが取り直している場合がある
+            token = self._local_token()
+            if token is not None:
+                return token
+
+            token = self._shared_token() or self._refresh(fetch)
+            return token
+
+    async def aget(self, fetch):
+        '''
+        getの非同期版
+        fetchは(access_token, expires_in)を返すコルーチン関数
+        '''
+        token = self._local_token()
+        if token is not None:
+            return token
+
+        async with self._async_lock():
+            token = self._local_token()
+            if token is not None:
+                return token
+
+            token = await sync_to_async(self._shared_token)()
+            if token is not None:
+                return token
+
+            owner = await sync_to_async(self._acquire_refresh_lock)()
+            if owner is None:
+                deadline = time.time() + LOCK_TIMEOUT
+                while time.time() < deadline:
+                    await asyncio.sleep(LOCK_WAIT_INTERVAL)
+                    token = await sync_to_async(self._shared_token)()
+                    if token is not None:
+                        return token
+                owner = await sync_to_async(self._acquire_refresh_lock)()
+
+            try:
+                token, expires_in = await fetch()
+                await sync_to_async(self._store)(token, expires_in)
+                return token
+            finally:
+                await sync_to_async(self._release_refresh_lock)(owner)
+
+    def invalidate(self, token):
+        '''
+        カオナビ側で無効になったトークンを破棄する(401が返ってきた場合など)
+        既に別のリクエストが新しいトークンに取り直している場合は何もしない
+        '''
+        with self._lock:
+            if self._token == token:
+                self._token = None
+                self._expires_at = 0
+            shared = cache.get(TOKEN_CACHE_KEY)
+            if shared is not None and shared['token'] == token:
+                cache.delete(TOKEN_CACHE_KEY)
+
+    def _local_token(self):
+        if self._token is not None and time.time() < self._expires_at - self._refresh_margin():
+            return self._token
+        return None
+
+    def _shared_token(self):
+        shared = cache.get(TOKEN_CACHE_KEY)
+        if shared is None or time.time() >= shared['expires_at'] - self._refresh_margin():
+            return None
+        self._token = shared['token']
+        self._expires_at = shared['expires_at']
+        return self._token
+
+    def _refresh(self, fetch):
+        # 他のワーカーが取り直し中であれば、その結果がキャッシュに入るのを待つ
+        # 待っても取り直されなかった(取り直し中のワーカーが失敗した)場合は、ロックを取り直せたかに関わらず自分で取り直す
+        owner = self._acquire_refresh_lock()
+        if owner is None:
+            deadline = time.time() + LOCK_TIMEOUT
+            while time.time() < deadline:
+                time.sleep(LOCK_WAIT_INTERVAL)
+                token = self._shared_token()
+                if token is not None:
+                    return token
+            owner = self._acquire_refresh_lock()
+
+        try:
+            token, expires_in = fetch()
+            self._store(token, expires_in)
+            return token
+        finally:
+            self._release_refresh_lock(owner)
+
+    def _store(self, token, expires_in):
+        self._token = token
+        self._expires_at = time.time() + expires_in
+        cache.set(
+            TOKEN_CACHE_KEY,
+            dict(token=token, expires_at=self._expires_at),
+            max(int(expires_in - self._refresh_margin()), 1)
+        )
+
+    def _acquire_refresh_lock(self):
+        '''
+        ワーカー間のロックを取り、取れた場合はロックの値(このワーカーの値)を、取れなかった場合はNoneを返す
+        '''
+        owner = uuid.uuid4().hex
+        return owner if cache.add(TOKEN_LOCK_KEY, owner, LOCK_TIMEOUT) else None
+
+    def _release_refresh_lock(self, owner):
+        # 待ちがタイムアウトした場合などに、他のワーカーが取ったロックを消さない
+        if owner is not None and cache.get(TOKEN_LOCK_KEY) == owner:
+            cache.delete(TOKEN_LOCK_KEY)
+
+    def _async_lock(self):
+        # asyncio.Lockはイベントループごとに作る
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_locks:
+            self._async_locks[loop] = asyncio.Lock()
+        return self._async_locks[loop]
+
+    def _refresh_margin(self):
+        return getattr(settings, 'KAONAVI_TOKEN_REFRESH_MARGIN', DEFAULT_REFRESH_MARGIN)
@@ -0,0 +1,149 @@
+import asyncio
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from .connector import (
+    KaonaviConnector, access_token_cache, response_json, END_POINT_URL_BASE, SELF_INTRO_SHEET_ID, DEFAULT_TOKEN_EXPIRES_IN
+)
+from .errors import KaonaviApiError
+from .http import async_kaonavi_session
+
+
+def sync_to_worker(func):
+    '''
+    funcをスレッドプールのスレッドで実行するsync_to_async(thread_sensitive=False)
+    thread_sensitive=True(デフォルト)だと全リクエストのDBへの問い合わせ・S3の署名・整形が1つのスレッドで順番に実行されるため、
+    社員一覧/社員詳細の処理はリクエストごとに別のスレッドで並行して行う
+    スレッドごとにDBの接続ができるので、前後で古い接続を閉じる(channelsのdatabase_sync_to_asyncと同じ)
+    '''
+    @wraps(func)
+    def inner(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(inner, thread_sensitive=False)
+
+
+class AsyncKaonaviConnector(KaonaviConnector):
+    '''
+    KaonaviConnectorの非同期版
+    カオナビAPIへのリクエスト(トークン・社員情報・自己紹介シートの取得)をasyncioで行い、
+    ASGIで動かす場合にカオナビAPIのレスポンス待ちの間ワーカーをブロックしないようにする
+    レスポンスの整形やDBへの問い合わせはKaonaviConnectorの処理をそのまま使い、sync_to_workerでリクエストごとに別のスレッドで実行する
+    '''
+    async def aget_access_token(self):
+        '''
+        get_access_tokenの非同期版
+        トークンのキャッシュはKaonaviConnectorと共有する
+        '''
+        return await access_token_cache.aget(self.arequest_access_token)
+
+    async def arequest_access_token(self):
+        '''
+        [POST] /token
+        '''
+        response = await async_kaonavi_session.request(
+            'POST',
+            f"{END_POINT_URL_BASE}/token",
+            auth=(settings.KAONAVI_API_KEY, settings.KAONAVI_API_SECRET),
+            content='grant_type=client_credentials',
+            headers={'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8'},
+        )
+        body = response_json(response)
+        if 'access_token' not in body:
+            raise KaonaviApiError('カオナビAPIのアクセストークンを取得できませんでした', status_code=response.status_code)
+        return body['access_token'], body.get('expires_in', DEFAULT_TOKEN_EXPIRES_IN)
+
+    async def arequest(self, method, url, headers={}, **kwargs):
+        '''
+        requestの非同期版
+        401が返ってきた場合は、トークンを取り直して1度だけ再試行する
+        '''
+        access_token = await self.aget_access_token()
+        response = await async_kaonavi_session.request(method, url, headers={**headers, 'Kaonavi-Token': access_token}, **kwargs)
+
+        if response.status_code == 401:
+            access_token_cache.invalidate(access_token)
+            access_token = await self.aget_access_token()
+            response = await async_kaonavi_session.request(method, url, headers={**headers, 'Kaonavi-Token': access_token}, **kwargs)
+
+        return response
+
+    async def aget_kaonavi_users(self):
+        '''
+        [GET] /members
+        '''
+        response = await self.arequest('GET', f"{END_POINT_URL_BASE}/members", headers={'Content-Type': 'application/json'})
+        return response_json(response, 'member_data')['member_data']
+
+    async def aget_self_introduction_sheet(self):
+        '''
+        [GET] /sheets/:sheet_id
+        '''
+        response = await self.arequest('GET', f"{END_POINT_URL_BASE}/sheets/{SELF_INTRO_SHEET_ID}", headers={'Content-Type': 'application/json'})
+        return response_json(response, 'member_data')
+
+    async def afetch_live_payloads(self):
+        '''
+        fetch_live_payloadsの非同期版
+        取得結果はfetch_live_payloadsと同じくこのインスタンスに保持するので、以降の同期処理ではカオナビAPIにリクエストしない
+        '''
+        if self._live_payloads is None:
+            try:
+                payloads = tuple(await asyncio.gather(
+                    self.aget_kaonavi_users(),
+                    self.aget_self_introduction_sheet(),
+                ))
+                await sync_to_worker(self.store_live_payloads)(payloads)
+            except KaonaviApiError as e:
+                self._live_payloads = await sync_to_worker(self.last_good_payloads)(e)
+        return self._live_payloads
+
+    async def aget_users(self, params):
+        '''
+        get_usersの非同期版
+        '''
+        if not self.use_local_store():
+            await self.afetch_live_payloads()
+        return await sync_to_worker(self.get_users)(params)
+
+    async def aget_user(self, user_id, kaonavi_code, fields=None):
+        '''
+        get_userの非同期版
+        '''
+        if not self.use_local_store():
+            await self.afetch_live_payloads()
+        return await sync_to_worker(self.get_user)(user_id, kaonavi_code, fields)
+
+    async def aget_users_by_ids(self, ids, fields=None):
+        '''
+        get_users_by_idsの非同期版
+        '''
+        if not self.use_local_store():
+            await self.afetch_live_payloads()
+        return await sync_to_worker(self.get_users_by_ids)(ids, fields)
+
+    async def ausers_etag(self, params):
+        '''
+        users_etagの非同期版
+        '''
+        if not self.use_local_store():
+            await self.afetch_live_payloads()
+        return await sync_to_worker(self.users_etag)(params)
+
+    async def auser_etag(self, user, fields=None):
+        '''
+        user_etagの非同期版
+        '''
+        if not self.use_local_store():
+            await self.afetch_live_payloads()
+        return await sync_to_worker(self.user_etag)(user, fields)
+
+    async def aenqueue_self_introduction_info(self, user, params):
+        '''
+        enqueue_self_introduction_infoの非同期版
+        '''
+        return await sync_to_worker(self.enqueue_self_introduction_info)(user, params)
@@ -1,12 +1,30 @@
 import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
-import requests
+from django.core.cache import cache
 from botocore.exceptions import ClientError
 from requests.auth import HTTPBasicAuth
 from django.core.paginator import EmptyPage, Paginator
-from ...models import User
+from django.db.models import Count, Max
+from ...models import User, KaonaviMember, KaonaviSelfIntroductionSheet, KaonaviChangeLog, KaonaviMemberDocument, SelfIntroductionEdit
 from ..api_result import ApiResult
+from ..etag import make_etag
+from ..presigned_url_cache import presigned_url_cache
+from ..response_cache import users_response_cache
+from ..profile_image_index import profile_image_index, PROFILE_IMAGE_PREFIX
+from . import cursor as cursor_pagination
+from .access_token import AccessTokenCache
+from .documents import list_row_json, detail_json
+from .errors import KaonaviApiError
+from .fields import USER_LIST_FIELDS, USER_DETAIL_FIELDS, InvalidFields, parse_fields, select, detail_sections
+from .http import kaonavi_session
+from .pagination import InvalidPagination, parse_positive_int
+from .payload import payload_digest
+from .sheet_index import SelfIntroductionSheetIndex
+from .user_ids import DEFAULT_MAX_BATCH_SIZE, InvalidUserIds, parse_user_ids
 from .user_filter import UserFilter as KaonaviUserFilter
+from .years_of_service import InvalidYearsOfService
 
 END_POINT_URL_BASE = 'https://api.kaonavi.jp/api/v2.0'
 SELF_INTRO_SHEET_ID = 20
@@ -18,21 +36,80 @@ HOBBY_FIELD_ID = 289
 SPECIALTY_FIELD_ID = 290 # 特技
 STRENGTHS_FIELD_ID = 291 # アピールポイント
 MESSAGE_FIELD_ID = 292
+# 自己紹介シートの項目(レスポンスのキー, 項目ID, タイトル)
+SELF_INTRO_FIELDS = (
+    ('job_description', JOB_DESCRIPTION_FIELD_ID, '業務内容、役割'),
+    ('birth_place', BIRTH_PLACE_FIELD_ID, '出身地'),
+    ('career', CAREER_FIELD_ID, '経歴、職歴'),
+    ('hobby', HOBBY_FIELD_ID, '趣味'),
+    ('specialty', SPECIALTY_FIELD_ID, '特技'),
+    ('strengths', STRENGTHS_FIELD_ID, 'アピールポイント'),
+    ('message', MESSAGE_FIELD_ID, '最後にひとこと'),
+)
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_PER_PAGE = 30
 DEFAULT_PAGE = 1
+DEFAULT_TOKEN_EXPIRES_IN = 3600
+# カオナビAPIから最後に取得できた(社員情報一覧, 自己紹介シート)を保持するキャッシュのキー
+LAST_GOOD_PAYLOADS_CACHE_KEY = 'kaonavi:last_good_payloads'
+# 最後に取得できたデータのハッシュ(社員情報一覧, 自己紹介シート)を保持するキャッシュのキー
+LAST_GOOD_DIGESTS_CACHE_KEY = 'kaonavi:last_good_payloads:digests'
+LAST_GOOD_PAYLOADS_REFRESH_LOCK_KEY = 'kaonavi:last_good_payloads:refreshing'
+DEFAULT_STALE_REFRESH_INTERVAL = 30
+
+# 社員一覧/社員詳細の読み込み元
+# local: manage.py sync_kaonaviで同期したローカルのDB、live: 毎回カオナビAPIから取得
+DIRECTORY_SOURCE_LOCAL = 'local'
+DIRECTORY_SOURCE_LIVE = 'live'
+
+# アクセストークンはプロセス全体(とDjangoのキャッシュ)で共有する
+access_token_cache = AccessTokenCache()
+# カオナビAPIへの互いに独立したリクエストを並行して投げるためのスレッドプール(プロセス全体で共有)
+upstream_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'KAONAVI_FETCH_WORKERS', 8),
+    thread_name_prefix='kaonavi'
+)
 
 class KaonaviConnector:
-    def __init__(self):
-        self.access_token = self.get_access_token()
+    def __init__(self, source=None):
+        self.source = source or getattr(settings, 'KAONAVI_DIRECTORY_SOURCE', DIRECTORY_SOURCE_LOCAL)
+        self._live_payloads = None
+        # カオナビAPIから取得したデータのハッシュ(社員情報一覧, 自己紹介シート)。取得のたびに1回だけ求める
+        self._live_digests = None
+        # このインスタンス(=1リクエスト)の間使い回す値(memoized)
+        self._memo = {}
+        # カオナビAPIから取得できず、最後に取得できたデータを返した場合はTrueになる
+        self.stale = False
+
+    def use_local_store(self):
+        return self.source == DIRECTORY_SOURCE_LOCAL
+
+    def memoized(self, key, compute):
+        '''
+        keyの値が未計算の場合のみcomputeを呼び、結果をこのインスタンス(=1リクエスト)の間使い回す
+        カオナビAPI・DBから取得したデータや、それから作った社員ごとのインデックスを二重に取得・走査しないためのもの
+        '''
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
 
     def get_access_token(self):
         '''
         カオナビAPIのアクセストークンを取得する
         カオナビAPIにアクセスするには毎回このトークンをリクエストヘッダーに含める必要がある
+        トークンはキャッシュしておき、有効期限が近づくまでは/tokenにリクエストせずに使い回す
+        '''
+        return access_token_cache.get(self.request_access_token)
+
+    def request_access_token(self):
+        '''
+        カオナビAPIから新しいアクセストークンを発行して(access_token, expires_in)を返す
         [POST] /token
         '''
-        response = requests.post(
+        response = kaonavi_session.request(
+            'POST',
             f"{END_POINT_URL_BASE}/token",
             auth=HTTPBasicAuth(
                 settings.KAONAVI_API_KEY,
@@ -41,97 +118,221 @@ class KaonaviConnector:
             data='grant_type=client_credentials',
             headers={'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8'},
         )
-        return response.json()['access_token']
+        body = response_json(response)
+        if 'access_token' not in body:
+            raise KaonaviApiError('カオナビAPIのアクセストークンを取得できませんでした', status_code=response.status_code)
+        return body['access_token'], body.get('expires_in', DEFAULT_TOKEN_EXPIRES_IN)
+
+    def request(self, method, url, headers={}, **kwargs):
+        '''
+        Kaonavi-Tokenヘッダーを付与してカオナビAPIにリクエストする
+        リクエストはプロセス全体で共有しているセッション(kaonavi_session)を使い、接続を使い回す
+        トークンが失効していて401が返ってきた場合は、トークンを取り直して1度だけ再試行する
+        '''
+        access_token = self.get_access_token()
+        response = kaonavi_session.request(method, url=url, headers={**headers, 'Kaonavi-Token': access_token}, **kwargs)
+
+        if response.status_code == 401:
+            access_token_cache.invalidate(access_token)
+            access_token = self.get_access_token()
+            response = kaonavi_session.request(method, url=url, headers={**headers, 'Kaonavi-Token': access_token}, **kwargs)
+
+        return response
 
     def get_kaonavi_users(self):
         '''
         カオナビに登録されている社員情報一覧を取得する
         [GET] /members
         '''
-        response = requests.get(
+        response = self.request(
+            'GET',
             f"{END_POINT_URL_BASE}/members",
             data='grant_type=client_credentials',
-            headers={
-                'Content-Type': 'application/json',
-                'Kaonavi-Token': self.access_token
-            },
+            headers={'Content-Type': 'application/json'},
         )
-        return response.json()['member_data']
+        return response_json(response, 'member_data')['member_data']
 
     def get_self_introduction_sheet(self):
         '''
         カオナビに登録されている自己紹介シートを取得する
         [GET] /sheets/:sheet_id
         '''
-        response = requests.get(
+        response = self.request(
+            'GET',
             f"{END_POINT_URL_BASE}/sheets/{SELF_INTRO_SHEET_ID}",
             data='grant_type=client_credentials',
-            headers={
-                'Content-Type': 'application/json',
-                'Kaonavi-Token': self.access_token
-            },
+            headers={'Content-Type': 'application/json'},
         )
-        return response.json()
+        return response_json(response, 'member_data')
+
+    def fetch_live_payloads(self):
+        '''
+        カオナビAPIから社員情報一覧(/members)と自己紹介シート(/sheets/:sheet_id)を並行して取得し、
+        (社員情報一覧, 自己紹介シート)のtupleで返す
+        取得結果はこのインスタンス(=1リクエスト)の間は使い回す
+        カオナビAPIから取得できなかった場合は、最後に取得できたデータを返す(last_good_payloads)
+        '''
+        if self._live_payloads is None:
+            try:
+                kaonavi_users = upstream_executor.submit(self.get_kaonavi_users)
+                self_intro_sheets = upstream_executor.submit(self.get_self_introduction_sheet)
+                self.store_live_payloads((kaonavi_users.result(), self_intro_sheets.result()))
+            except KaonaviApiError as e:
+                self._live_payloads = self.last_good_payloads(e)
+        return self._live_payloads
+
+    def store_live_payloads(self, payloads):
+        '''
+        カオナビAPIから取得できたデータをこのインスタンスと、カオナビAPIに障害があった際のためにDjangoのキャッシュに保持する
+        キャッシュには、保持しているデータとハッシュが変わった(または消えていた)場合のみ書き込む
+        '''
+        self._live_payloads = payloads
+        self._live_digests = tuple(payload_digest(payload) for payload in payloads)
+        if cache.get(LAST_GOOD_DIGESTS_CACHE_KEY) == self._live_digests and cache.touch(LAST_GOOD_PAYLOADS_CACHE_KEY, None):
+            return
+        cache.set(LAST_GOOD_PAYLOADS_CACHE_KEY, payloads, None)
+        cache.set(LAST_GOOD_DIGESTS_CACHE_KEY, self._live_digests, None)
+
+    def last_good_payloads(self, error):
+        '''
+        カオナビAPIから取得できなかった場合に、最後に取得できた(社員情報一覧, 自己紹介シート)を返し、staleにする
+        あわせてバックグラウンドで取り直す(refresh_live_payloads)
+        一度も取得できていない場合はerrorをそのまま送出する
+        '''
+        payloads = cache.get(LAST_GOOD_PAYLOADS_CACHE_KEY)
+        if payloads is None:
+            raise error
+        logger.warning('serving stale kaonavi payloads: %s', error)
+        self._live_digests = cache.get(LAST_GOOD_DIGESTS_CACHE_KEY) or tuple(payload_digest(payload) for payload in payloads)
+        self.stale = True
+        refresh_live_payloads()
+        return payloads
+
+    def live_digests(self):
+        '''
+        カオナビAPIから取得した(社員情報一覧, 自己紹介シート)のハッシュを返す
+        ETagや社員情報一覧の転置インデックスのキーに使う
+        '''
+        self.fetch_live_payloads()
+        return self._live_digests
+
+    def find_kaonavi_users(self, params):
+        '''
+        社員一覧の絞り込み条件に合うカオナビの社員情報を返す
+        ローカルのDBを読む場合はSQLで絞り込み、カオナビAPIから取得する場合はUserFilterで絞り込む
+        '''
+        if self.use_local_store():
+            return KaonaviMember.objects.search(params).payloads()
+        else:
+            kaonavi_users, _ = self.fetch_live_payloads()
+            return KaonaviUserFilter(params, kaonavi_users, version=self.live_digests()[0]).call()
+
+    def find_kaonavi_user(self, kaonavi_code):
+        '''
+        kaonavi_codeに該当するカオナビの社員情報を返す
+        存在しない場合はNoneを返す
+        '''
+        if self.use_local_store():
+            return self.memoized(
+                ('kaonavi_user', kaonavi_code),
+                lambda: next(iter(KaonaviMember.objects.filter(code=kaonavi_code).payloads()), NONE_AS_DEFAULT_VALUE)
+            )
+        else:
+            return self.live_kaonavi_users_by_code().get(kaonavi_code, NONE_AS_DEFAULT_VALUE)
+
+    def live_kaonavi_users_by_code(self):
+        '''
+        カオナビAPIから取得した社員情報一覧を{code: 社員情報}のdictにして返す
+        '''
+        def index():
+            kaonavi_users, _ = self.fetch_live_payloads()
+            return {kaonavi_user['code']: kaonavi_user for kaonavi_user in kaonavi_users}
+        return self.memoized('live_kaonavi_users_by_code', index)
+
+    def find_kaonavi_users_by_codes(self, kaonavi_codes):
+        '''
+        kaonavi_codesに該当するカオナビの社員情報を{code: 社員情報}のdictで返す
+        ローカルのDBを読む場合は1回のSQLで、カオナビAPIから取得する場合は1回の取得結果から引く
+        '''
+        if self.use_local_store():
+            kaonavi_users = {
+                kaonavi_user['code']: kaonavi_user
+                for kaonavi_user in KaonaviMember.objects.filter(code__in=kaonavi_codes).payloads()
+            }
+        else:
+            kaonavi_users = self.live_kaonavi_users_by_code()
+        return {kaonavi_code: kaonavi_users[kaonavi_code] for kaonavi_code in kaonavi_codes if kaonavi_code in kaonavi_users}
+
+    def load_self_introduction_sheet(self, kaonavi_codes=None):
+        '''
+        自己紹介シートを社員のcodeで引けるSelfIntroductionSheetIndexにして返す
+        ローカルのDBを読む場合、kaonavi_codesを指定するとその社員たちのシートのみを読み込む
+        カオナビにまだ反映していない編集(SelfIntroductionEdit)がある社員は、編集後の内容を返す
+        同じ社員たちのシートはこのインスタンスの間は読み込み直さない
+        '''
+        def load():
+            if self.use_local_store():
+                sheets = KaonaviSelfIntroductionSheet.objects.all()
+                if kaonavi_codes is not None:
+                    sheets = sheets.filter(code__in=kaonavi_codes)
+                self_intro_sheets = SelfIntroductionSheetIndex({'member_data': list(sheets.values_list('payload', flat=True))})
+            else:
+                _, live_sheets = self.fetch_live_payloads()
+                self_intro_sheets = SelfIntroductionSheetIndex(live_sheets)
+            return self_intro_sheets.overlay(SelfIntroductionEdit.objects.unsent().sheets(kaonavi_codes))
+        return self.memoized(('self_intro_sheets', frozenset(kaonavi_codes) if kaonavi_codes is not None else None), load)
 
     def get_users(self, params):
         '''
         カオナビ上に登録されている社員情報一覧を取得したのちに、
         djangoアプリ上のDBに保存されているユーザーと突合させてカオナビ上にある社員情報とDBに保存しているユーザー(社員)情報を併せて返却する
         kaonavi_user → カオナビ上の社員データ
-        以下のようにgetでDBに問い合わせしているため、
-        user = User.objects.get(kaonavi_code=kaonavi_user['code'])
-        カオナビ上に存在するが、djangoのDBに存在しないという場合にはエラーになる
-        どちらにも存在する前提としている
-        処理の最後でページネーションの処理があり、per_pageとpageをフロントから受け取る
+        ローカルのDBを読む場合は、絞り込み・件数・ページの切り出しをSQLで行い、該当ページの社員情報だけを読み込む
+        カオナビAPIから取得する場合は、DBへの問い合わせは絞り込み後の社員のkaonavi_codeでまとめて1回だけ行う
+        退職者と、カオナビ上に存在するがdjangoのDBに存在しない社員はレスポンスに含めない
+        ページネーションの処理があり、per_pageとpageをフロントから受け取る
+        プロフィール画像のURLや自己紹介シートの値などの重い処理は、ページネーション後に該当ページの社員分だけ行う
+        pagination=cursorまたはcursorを指定した場合はカーソルでのページネーションにする(get_users_by_cursor)
+        fieldsを指定した場合は、その項目だけを返す(指定していない項目の画像URL・自己紹介シートの取得はしない)
         '''
-        kaonavi_users = KaonaviUserFilter(params, self.get_kaonavi_users()).call()
+        if params.get('pagination') == 'cursor' or params.get('cursor'):
+            return self.get_users_by_cursor(params)
 
-        if len(kaonavi_users) == 0:
-            return ApiResult(success=True, data=[])
-        else:
-            self_intro_sheets = self.get_self_introduction_sheet()
-            formatted_users = []
-
-            for kaonavi_user in kaonavi_users:
-                user = User.objects.get(kaonavi_code=kaonavi_user['code'])
-                # 退職者はレスポンスに含めない
-                if user.is_quit:
-                    continue
-
-                departments = kaonavi_user['department']['names']
-                role = next((custom_field for custom_field in kaonavi_user['custom_fields'] if custom_field['name'] == '役職'), NONE_AS_DEFAULT_VALUE)
-                my_sheet = next((sheet for sheet in self_intro_sheets['member_data'] if sheet['code'] == kaonavi_user['code']), NONE_AS_DEFAULT_VALUE)
-                if my_sheet is not None:
-                    job_description = next((custom_field for custom_field in my_sheet['records'][0]['custom_fields'] if custom_field['id'] == JOB_DESCRIPTION_FIELD_ID), NONE_AS_DEFAULT_VALUE)
-                    job_description = job_description['values'][0] if job_description is not None else ''
-                else:
-                    job_description = ''
-
-                formatted_users.append(
-                    dict(
-                        image=self.get_profile_image_path(user.username),
-                        user_id=user.id,
-                        chatwork_id=user.chatwork_id,
-                        email=user.email,
-                        name=kaonavi_user['name'],
-                        name_kana=kaonavi_user['name_kana'],
-                        headquarters=departments[0] if len(departments) >= 1 else '',
-                        department=departments[1] if len(departments) >= 2 else '',
-                        group=departments[2] if len(departments) >= 3 else '',
-                        role=role['values'][0] if role is not None else '',
-                        job_description=job_description
-                    )
-                )
+        try:
+            selected_per_page = parse_positive_int(params, 'per_page', DEFAULT_PER_PAGE)
+            selected_page = parse_positive_int(params, 'page', DEFAULT_PAGE)
+            fields = parse_fields(params.get('fields'), USER_LIST_FIELDS)
 
-            selected_per_page = int(params['per_page']) if params.get('per_page') is not None else DEFAULT_PER_PAGE
-            selected_page = int(params['page']) if params.get('page') is not None else DEFAULT_PAGE
+            if self.use_local_store():
+                # 絞り込み・退職者/DBに存在しない社員の除外・件数の取得・ページの切り出しはSQLで行い、
+                # 社員情報(payload)は該当ページの社員分だけ読み込む
+                members = KaonaviMember.objects.search(params) \
+                    .filter(code__in=User.objects.filter(is_quit=False).values('kaonavi_code')) \
+                    .values_list('payload', flat=True)
+                users = None
+            else:
+                kaonavi_users = self.find_kaonavi_users(params)
+                users = self.find_users([kaonavi_user['code'] for kaonavi_user in kaonavi_users])
+                # 退職者・DBに存在しない社員はレスポンスに含めない
+                members = [kaonavi_user for kaonavi_user in kaonavi_users if kaonavi_user['code'] in users]
+        except (InvalidPagination, InvalidFields, InvalidYearsOfService) as e:
+            return ApiResult(success=False, errors=[str(e)])
 
-            paginator = Paginator(formatted_users, selected_per_page)
+        paginator = Paginator(members, selected_per_page)
 
+        if paginator.count == 0:
+            return ApiResult(success=True, data=[])
+        else:
             try:
                 page = paginator.page(selected_page)
+                kaonavi_users = list(page.object_list)
+                if users is None:
+                    users = self.find_users([kaonavi_user['code'] for kaonavi_user in kaonavi_users])
                 data = dict(
-                    records=page.object_list,
+                    records=self.list_rows(
+                        [(kaonavi_user, users[kaonavi_user['code']]) for kaonavi_user in kaonavi_users if kaonavi_user['code'] in users],
+                        fields
+                    ),
                     meta=dict(
                         per_page=selected_per_page,
                         total_pages=paginator.num_pages,
@@ -148,51 +349,276 @@ class KaonaviConnector:
             except EmptyPage:
                 return ApiResult(success=False, errors=['指定されたページは存在しません'])
 
-    def get_user(self, user_id, kaonavi_code):
+    def get_users_by_cursor(self, params):
+        '''
+        社員一覧をカーソルでページネーションして返す
+        sort(name_kana, department, years_of_service、先頭に-を付けると降順)と社員のcodeの順で並べ、
+        前のページの最後の社員より後ろのper_page件を返す
+        全件数を数えないため、何ページ目でも1ページ分の取得コストで済む
+        カーソルは社員情報のバージョンに紐づけていて、同期などで社員情報が更新された場合は最初のページから取得し直す必要がある
+        '''
+        try:
+            selected_per_page = parse_positive_int(params, 'per_page', DEFAULT_PER_PAGE)
+            fields = parse_fields(params.get('fields'), USER_LIST_FIELDS)
+            field, descending = cursor_pagination.parse_sort(params.get('sort'))
+            sort = params.get('sort') or cursor_pagination.DEFAULT_SORT
+
+            if self.use_local_store():
+                version = self.local_members_version()
+                after = cursor_pagination.decode_cursor(params['cursor'], version, sort) if params.get('cursor') else None
+                column, _ = cursor_pagination.SORT_FIELDS[field]
+                # 退職者・DBに存在しない社員はSQLで除外する
+                members = KaonaviMember.objects.search(params) \
+                    .filter(code__in=User.objects.filter(is_quit=False).values('kaonavi_code'))
+                if after is not None:
+                    members = members.filter(cursor_pagination.after_cursor_q(column, *after, descending))
+                # 次のページがあるかを判定するため1件多く取得する(LIMITはSQLで行い、ページ分の社員情報だけを読み込む)
+                kaonavi_users = members.order_by(*cursor_pagination.order_by(column, descending))[:selected_per_page + 1] \
+                    .payloads()
+                users = None
+            else:
+                kaonavi_users = self.find_kaonavi_users(params)
+                users = self.find_users([kaonavi_user['code'] for kaonavi_user in kaonavi_users])
+                kaonavi_users = [kaonavi_user for kaonavi_user in kaonavi_users if kaonavi_user['code'] in users]
+                version = cursor_pagination.live_version(kaonavi_users)
+                after = cursor_pagination.decode_cursor(params['cursor'], version, sort) if params.get('cursor') else None
+                kaonavi_users = cursor_pagination.live_page(kaonavi_users, field, descending, after, selected_per_page)
+        except (cursor_pagination.InvalidCursor, InvalidPagination, InvalidFields, InvalidYearsOfService) as e:
+            return ApiResult(success=False, errors=[str(e)])
+
+        has_next_page = len(kaonavi_users) > selected_per_page
+        kaonavi_users = kaonavi_users[:selected_per_page]
+        # カオナビAPIから取得する場合は、絞り込みの際に取得したユーザーをそのまま使う
+        if users is None:
+            users = self.find_users([kaonavi_user['code'] for kaonavi_user in kaonavi_users])
+
+        if has_next_page:
+            _, get_value = cursor_pagination.SORT_FIELDS[field]
+            last = kaonavi_users[-1]
+            next_cursor = cursor_pagination.encode_cursor(version, sort, get_value(last), last['code'])
+        else:
+            next_cursor = None
+
+        data = dict(
+            records=self.list_rows(
+                [(kaonavi_user, users[kaonavi_user['code']]) for kaonavi_user in kaonavi_users if kaonavi_user['code'] in users],
+                fields
+            ),
+            meta=dict(
+                per_page=selected_per_page,
+                sort=sort,
+                has_next_page=has_next_page,
+                next_cursor=next_cursor
+            )
+        )
+        return ApiResult(success=True, data=data)
+
+    def users_etag(self, params):
+        '''
+        社員一覧のETagを返す
+        社員情報・自己紹介シート・Userのバージョンと、絞り込み/ページネーションのパラメータから作る
+        '''
+        user_summary = User.objects.aggregate(updated_at=Max('updated_at'), count=Count('id'))
+        edit_summary = SelfIntroductionEdit.objects.unsent().version()
+        if self.use_local_store():
+            version = [KaonaviChangeLog.objects.current_version(), user_summary, edit_summary]
+        else:
+            version = [*self.live_digests(), user_summary, edit_summary]
+        return make_etag('users', version, sorted(params.items()))
+
+    def user_etag(self, user, fields=None):
+        '''
+        社員詳細のETagを返す
+        その社員の社員情報・自己紹介シート・Userのバージョンと、fieldsパラメータから作る
+        続けてget_userを呼ぶ場合にUserを取得し直さないよう、userを保持しておく
+        '''
+        self._memo[('user', user.kaonavi_code)] = user
+        if self.use_local_store():
+            member = KaonaviMember.objects.filter(code=user.kaonavi_code).values_list('synced_at', flat=True).first()
+            sheet = KaonaviSelfIntroductionSheet.objects.filter(code=user.kaonavi_code).values_list('synced_at', flat=True).first()
+            edit = SelfIntroductionEdit.objects.unsent().filter(code=user.kaonavi_code).version()
+            version = [member, sheet, edit]
+        else:
+            self_intro_sheets = self.load_self_introduction_sheet([user.kaonavi_code])
+            version = [payload_digest(self.find_kaonavi_user(user.kaonavi_code)), payload_digest(self_intro_sheets.find(user.kaonavi_code))]
+        return make_etag('user', str(user.id), user.updated_at, version, fields)
+
+    def local_members_version(self):
+        '''
+        ローカルのDBに同期した社員情報のバージョン(社員情報の最新の変更履歴のid)を返す
+        '''
+        return KaonaviChangeLog.objects.filter(kind=KaonaviChangeLog.KIND_MEMBER).current_version()
+
+    def list_rows(self, members, fields):
+        '''
+        社員一覧のページ分の(カオナビの社員情報, User)から、レスポンスのrecordsを返す
+        ローカルのDBを読む場合で全項目を返すときは、社員ごとの文書(KaonaviMemberDocument)に画像URLを差し込んだJSON(RawJSON)をそのまま使う
+        文書が無い社員や、fieldsを指定した場合はその場で整形する
+        '''
+        documents = {}
+        if fields is None and self.use_local_store():
+            documents = KaonaviMemberDocument.objects.fragments([kaonavi_user['code'] for kaonavi_user, _ in members], 'list_row')
+        self_intro_sheets = self.load_list_sheets(
+            [kaonavi_user['code'] for kaonavi_user, _ in members if kaonavi_user['code'] not in documents], fields
+        )
+        return [
+            list_row_json(documents[kaonavi_user['code']], self.get_profile_image_path(user.username))
+            if kaonavi_user['code'] in documents
+            else self.format_user(kaonavi_user, user, self_intro_sheets, fields)
+            for kaonavi_user, user in members
+        ]
+
+    def load_list_sheets(self, kaonavi_codes, fields):
+        '''
+        社員一覧のページ分の自己紹介シートを読み込む
+        fieldsにjob_descriptionが含まれない場合は読み込まずにNoneを返す
+        '''
+        if fields is not None and 'job_description' not in fields:
+            return None
+        return self.load_self_introduction_sheet(kaonavi_codes)
+
+    def format_user(self, kaonavi_user, user, self_intro_sheets, fields=None):
+        '''
+        社員一覧のレスポンスの1行分を返す
+        fieldsを指定した場合はその項目の値だけを求める
+        '''
+        departments = kaonavi_user['department']['names']
+
+        def role():
+            role = self.custom_field(kaonavi_user, '役職')
+            return role['values'][0] if role is not None else ''
+
+        return select(dict(
+            image=lambda: self.get_profile_image_path(user.username),
+            user_id=lambda: user.id,
+            chatwork_id=lambda: user.chatwork_id,
+            email=lambda: user.email,
+            name=lambda: kaonavi_user['name'],
+            name_kana=lambda: kaonavi_user['name_kana'],
+            headquarters=lambda: departments[0] if len(departments) >= 1 else '',
+            department=lambda: departments[1] if len(departments) >= 2 else '',
+            group=lambda: departments[2] if len(departments) >= 3 else '',
+            role=role,
+            job_description=lambda: self_intro_sheets.custom_fields(kaonavi_user['code']).get(JOB_DESCRIPTION_FIELD_ID, '')
+        ), fields)
+
+    def find_users(self, kaonavi_codes):
+        '''
+        kaonavi_codesに該当する在籍中のユーザーを{kaonavi_code: User}のdictで返す
+        社員一覧のレスポンスに使うカラムのみを取得する
+        '''
+        users = User.objects.filter(kaonavi_code__in=kaonavi_codes, is_quit=False) \
+            .only('id', 'username', 'email', 'chatwork_id', 'is_quit', 'kaonavi_code')
+        return {user.kaonavi_code: user for user in users}
+
+    def get_user(self, user_id, kaonavi_code, fields=None):
         '''
         引数で受け取るUser.kaonavi_codeを元にカオナビ上の社員情報一覧から、該当の社員情報を取得する
         引数のkaonavi_codeの社員情報がカオナビ上に存在しない場合は500エラーを返す(存在する前提)
         タグや自己紹介シートの値などもカオナビ上から取得してレスポンスに含めてる
+        fields(fieldsパラメータの値)を指定した場合は、その項目だけを返す(指定していない項目の画像URL・自己紹介シートの取得はしない)
         '''
-        kaonavi_user = next((kaonavi_user for kaonavi_user in self.get_kaonavi_users() if kaonavi_user['code'] == kaonavi_code), NONE_AS_DEFAULT_VALUE)
+        try:
+            fields = parse_fields(fields, USER_DETAIL_FIELDS)
+            sections = detail_sections(fields)
+        except InvalidFields as e:
+            return ApiResult(success=False, errors=[str(e)])
+
+        # ローカルのDBを読む場合で全項目を返すときは、社員ごとの文書に画像URLを差し込んで返す
+        if fields is None and self.use_local_store():
+            detail = KaonaviMemberDocument.objects.fragments([kaonavi_code], 'detail').get(kaonavi_code)
+            if detail is not None:
+                user = self.memoized(('user', kaonavi_code), lambda: User.objects.get(kaonavi_code=kaonavi_code))
+                return ApiResult(success=True, data=detail_json(detail, self.get_profile_image_path(user.username)))
+
+        kaonavi_user = self.find_kaonavi_user(kaonavi_code)
         if kaonavi_user is None:
             return ApiResult(success=False, errors=[f"id:{user_id}の社員情報の取得に失敗しました"])
         else:
-            user = User.objects.get(kaonavi_code=kaonavi_user['code'])
-            departments = kaonavi_user['department']['names']
-            formatted_user = dict(
-                overview=dict(
-                    image=self.get_profile_image_path(user.username),
-                    email=user.email,
-                    name=kaonavi_user['name'],
-                    name_kana=kaonavi_user['name_kana'],
-                    chatwork_id=user.chatwork_id,
-                    headquarters=departments[0] if len(departments) >= 1 else '',
-                    department=departments[1] if len(departments) >= 2 else '',
-                    group=departments[2] if len(departments) >= 3 else '',
-                ),
-                tags=self.tags(kaonavi_user),
-                details=self.self_introduction_info(kaonavi_user)
-            )
-            return ApiResult(success=True, data=formatted_user)
+            user = self.memoized(('user', kaonavi_code), lambda: User.objects.get(kaonavi_code=kaonavi_user['code']))
+            return ApiResult(success=True, data=self.format_user_detail(kaonavi_user, user, None, *sections))
+
+    def get_users_by_ids(self, ids, fields=None):
+        '''
+        ids(idsパラメータの値、ユーザーのidのカンマ区切り)の社員詳細をまとめて返す
+        このメソッドへのエンドポイントは[GET] /users/batch/?ids=...
+        各社員の値はget_userと同じ形で、{ユーザーのid: 社員詳細}のdictにして指定された順番で返す
+        ユーザー・社員情報・自己紹介シートはそれぞれ全員分を1回で取得し、プロフィール画像の存在確認はprofile_image_indexの1回の一覧で行う
+        ユーザーまたはカオナビ上の社員情報が存在しないidはnot_foundに含める
+        ローカルのDBを読む場合で全項目を返すときは、社員ごとの文書があればそれを使い、無い社員の分だけ社員情報・自己紹介シートを読み込む
+        '''
+        try:
+            user_ids = parse_user_ids(ids, getattr(settings, 'USERS_BATCH_MAX_IDS', DEFAULT_MAX_BATCH_SIZE))
+            fields = parse_fields(fields, USER_DETAIL_FIELDS)
+            overview_fields, with_tags, with_details = detail_sections(fields)
+        except (InvalidUserIds, InvalidFields) as e:
+            return ApiResult(success=False, errors=[str(e)])
+
+        users = {user.id: user for user in User.objects.filter(id__in=user_ids)}
+        documents = {}
+        if fields is None and self.use_local_store():
+            documents = KaonaviMemberDocument.objects.fragments([user.kaonavi_code for user in users.values()], 'detail')
+        kaonavi_codes = [user.kaonavi_code for user in users.values() if user.kaonavi_code not in documents]
+        kaonavi_users = self.find_kaonavi_users_by_codes(kaonavi_codes) if kaonavi_codes else {}
+        self_intro_sheets = self.load_self_introduction_sheet(kaonavi_codes) if with_details and kaonavi_codes else None
+
+        records = {}
+        not_found = []
+        for user_id in user_ids:
+            user = users.get(user_id)
+            kaonavi_user = kaonavi_users.get(user.kaonavi_code) if user is not None else None
+            if user is not None and user.kaonavi_code in documents:
+                records[str(user_id)] = detail_json(documents[user.kaonavi_code], self.get_profile_image_path(user.username))
+            elif kaonavi_user is None:
+                not_found.append(str(user_id))
+            else:
+                records[str(user_id)] = self.format_user_detail(
+                    kaonavi_user, user, self_intro_sheets, overview_fields, with_tags, with_details
+                )
+        return ApiResult(success=True, data=dict(records=records, not_found=not_found))
+
+    def format_user_detail(self, kaonavi_user, user, self_intro_sheets, overview_fields=None, with_tags=True, with_details=True):
+        '''
+        社員詳細のレスポンス(overview/tags/details)を返す
+        overview_fields・with_tags・with_detailsはdetail_sectionsで求めたもの
+        '''
+        departments = kaonavi_user['department']['names']
+        formatted_user = {}
+        if overview_fields is None or overview_fields:
+            formatted_user['overview'] = select(dict(
+                image=lambda: self.get_profile_image_path(user.username),
+                email=lambda: user.email,
+                name=lambda: kaonavi_user['name'],
+                name_kana=lambda: kaonavi_user['name_kana'],
+                chatwork_id=lambda: user.chatwork_id,
+                headquarters=lambda: departments[0] if len(departments) >= 1 else '',
+                department=lambda: departments[1] if len(departments) >= 2 else '',
+                group=lambda: departments[2] if len(departments) >= 3 else '',
+            ), overview_fields)
+        if with_tags:
+            formatted_user['tags'] = self.tags(kaonavi_user)
+        if with_details:
+            formatted_user['details'] = self.self_introduction_info(kaonavi_user, self_intro_sheets)
+        return formatted_user
 
     def get_profile_image_path(self, username):
         '''
         S3に格納されたその社員のプロフィール画像の絶対パス(https:xxx.jpg)を返す
         S3にその社員のプロフィール画像が存在しない場合はno-image画像の絶対パスを返す
+        署名付きURLはキャッシュしておき、有効期限が近づくまでは同じURLを返す
         '''
         s3_client = settings.STORAGE_CLIENT
         params={
             'Bucket': settings.AWS_S3_BUCKET_NAME,
-            'Key': f"all-profile-images/{username}.jpg"
+            'Key': f"{PROFILE_IMAGE_PREFIX}{username}.jpg"
         }
 
         if self.is_profile_image_exist(s3_client, params) == False:
-            params['Key'] = 'all-profile-images/no-image.jpg'
+            params['Key'] = f"{PROFILE_IMAGE_PREFIX}no-image.jpg"
 
-        image_url = s3_client.generate_presigned_url('get_object',
+        image_url = presigned_url_cache.get(params['Key'], lambda: s3_client.generate_presigned_url('get_object',
             Params=params,
-            ExpiresIn=settings.AWS_S3_EXPIRES_IN)
+            ExpiresIn=settings.AWS_S3_EXPIRES_IN))
 
         return image_url
 
@@ -200,13 +626,36 @@ class KaonaviConnector:
         '''
         S3にその社員のプロフィール画像が存在するかを確認する
         存在している場合はTrue、存在しない場合はFalseを返す
+        基本的にはプロセス内に保持しているS3のキーの一覧(profile_image_index)で判定し、
+        一覧を取得できていない場合のみhead_objectで1件ずつ確認する
         '''
+        exists = profile_image_index.exists(params['Key'])
+        if exists is not None:
+            return exists
+
         try:
             s3_client.head_object(Bucket=params['Bucket'], Key=params['Key'])
             return True
         except ClientError as e:
-            if e.response['Error']['Code'] == '404':
+            error_code = e.response['Error']['Code']
+            if error_code in ('404', 'NoSuchKey'):
                 return False
+            # 権限不足(403)などの場合も、no-image画像を返せるように存在しない扱いにする
+            logger.warning('S3のプロフィール画像の存在確認に失敗しました key=%s code=%s', params['Key'], error_code)
+            return False
+
+    def custom_field(self, kaonavi_user, name):
+        '''
+        社員情報の項目(custom_fields)のうち、項目名がnameのものを返す(無い場合はNone)
+        社員ごとに{項目名: 項目}のdictにしたものを使い回し、custom_fieldsを毎回走査しない
+        '''
+        def index():
+            custom_fields = {}
+            for custom_field in kaonavi_user['custom_fields']:
+                # 同じ項目名が複数ある場合は先頭のものを使う
+                custom_fields.setdefault(custom_field['name'], custom_field)
+            return custom_fields
+        return self.memoized(('custom_fields', kaonavi_user['code']), index).get(name, NONE_AS_DEFAULT_VALUE)
 
     def tags(self, kaonavi_user):
         '''
@@ -216,9 +665,9 @@ class KaonaviConnector:
         存在する値のみレスポンスする
         '''
         years_of_service = f"勤続{kaonavi_user['years_of_service']}"
-        _role = next((custom_field for custom_field in kaonavi_user['custom_fields'] if custom_field['name'] == '役職'), NONE_AS_DEFAULT_VALUE)
+        _role = self.custom_field(kaonavi_user, '役職')
         role = f"役職：{_role['values'][0]}" if _role is not None else None
-        _recruit_category = next((custom_field for custom_field in kaonavi_user['custom_fields'] if custom_field['name'] == '採用区分'), NONE_AS_DEFAULT_VALUE)
+        _recruit_category = self.custom_field(kaonavi_user, '採用区分')
         recruit_category = _recruit_category['values'][0] if _recruit_category is not None else None
         gender = kaonavi_user['gender']
 
@@ -232,89 +681,73 @@ class KaonaviConnector:
         # Noneのものは返り値に含めない
         return [value for value in _tags.values() if value is not None]
 
-    def self_introduction_info(self, kaonavi_user):
+    def self_introduction_info(self, kaonavi_user, self_intro_sheets=None):
         '''
         カオナビ上に保存されている自己紹介シート(カスタムフォーム)を取得し、フォーマットして返却する
         各社員がカオナビ上で自由に編集できるシートになっているため、データが存在しない場合もある
         データが存在しない場合は各項目のvalueを空文字として返却する
+        取得済みの自己紹介シート(SelfIntroductionSheetIndex)を渡した場合はそれを使う
         '''
-        sheets = self.get_self_introduction_sheet()
-        my_sheet = next((sheet for sheet in sheets['member_data'] if sheet['code'] == kaonavi_user['code']), NONE_AS_DEFAULT_VALUE)
-        data = dict(
-            job_description=dict(title='業務内容、役割', value=''),
-            birth_place=dict(title='出身地', value=''),
-            career=dict(title='経歴、職歴', value=''),
-            hobby=dict(title='趣味', value=''),
-            specialty=dict(title='特技', value=''),
-            strengths=dict(title='アピールポイント', value=''),
-            message=dict(title='最後にひとこと', value='')
-        )
+        if self_intro_sheets is None:
+            self_intro_sheets = self.load_self_introduction_sheet([kaonavi_user['code']])
+        custom_fields = self_intro_sheets.custom_fields(kaonavi_user['code'])
 
-        if my_sheet is None:
-            return data
-        else:
-            custom_fields = my_sheet['records'][0]['custom_fields']
-            # Pythonにswitch文無いんだ、他にいい書き方ないかな
-            for custom_field in custom_fields:
-                custom_field_value = custom_field['values'][0]
-                if custom_field['id'] == JOB_DESCRIPTION_FIELD_ID:
-                    data['job_description']['value'] = custom_field_value
-                elif custom_field['id'] == BIRTH_PLACE_FIELD_ID:
-                    data['birth_place']['value'] = custom_field_value
-                elif custom_field['id'] == CAREER_FIELD_ID:
-                    data['career']['value'] = custom_field_value
-                elif custom_field['id'] == HOBBY_FIELD_ID:
-                    data['hobby']['value'] = custom_field_value
-                elif custom_field['id'] == SPECIALTY_FIELD_ID:
-                    data['specialty']['value'] = custom_field_value
-                elif custom_field['id'] == STRENGTHS_FIELD_ID:
-                    data['strengths']['value'] = custom_field_value
-                elif custom_field['id'] == MESSAGE_FIELD_ID:
-                    data['message']['value'] = custom_field_value
-            return data
-
-    def create_or_update_self_introduction_info(self, user, params):
-        '''
-        カオナビ上の自己紹介シート(カスタムフォーム)の作成/編集をする
-        このメソッドへのエンドポイントは[PATCH] /users/:user_id だが、
-        このメソッド内でのカオナビへのリクエストエンドポイントは以下のように分岐する
-        ↓
-        該当社員の自己紹介シートが未作成の場合：[POST] /sheets/:sheet_id/add に対してリクエストし、新規作成
-        該当社員の自己紹介シートが存在する場合：[PATCH] /sheets/:sheet_id に対してリクエストし、更新
-        '''
-        sheets = self.get_self_introduction_sheet()
-        my_sheet = next((sheet for sheet in sheets['member_data'] if sheet['code'] == user.kaonavi_code), NONE_AS_DEFAULT_VALUE)
-        request_json = self.build_self_introduction_json(user, params)
-
-        if my_sheet is None:
-            # 自己紹介シート未作成の場合は新規作成
-            method = 'POST'
+        return {
+            key: dict(title=title, value=custom_fields.get(field_id, ''))
+            for key, field_id, title in SELF_INTRO_FIELDS
+        }
+
+    def enqueue_self_introduction_info(self, user, params):
+        '''
+        カオナビ上の自己紹介シート(カスタムフォーム)の作成/編集を受け付ける
+        このメソッドへのエンドポイントは[PATCH] /users/:user_id
+        編集内容はSelfIntroductionEditとして送信待ちにし、カオナビへの送信は
+        manage.py flush_self_introduction_edits(flush_self_introduction_edits)で複数社員分まとめて行う
+        送信待ちの間もローカルの読み込みには編集後の内容が反映されるよう、その社員の文書と社員一覧のレスポンスのキャッシュを無効にする
+        '''
+        sheet = self.build_self_introduction_data(user, params)['member_data'][0]
+        edit = SelfIntroductionEdit.objects.enqueue(user, sheet)
+        KaonaviMemberDocument.objects.invalidate([user.kaonavi_code])
+        users_response_cache.invalidate()
+        return ApiResult(success=True, data=edit)
+
+    def send_self_introduction_sheets(self, method, sheets):
+        '''
+        複数社員分の自己紹介シートを1リクエストでカオナビに送信する
+        自己紹介シートが未作成の社員：[POST] /sheets/:sheet_id/add に対してリクエストし、新規作成
+        自己紹介シートが作成済の社員：[PATCH] /sheets/:sheet_id に対してリクエストし、更新
+        更新に成功した場合はローカルのDBの自己紹介シートにも反映し、社員一覧のレスポンスのキャッシュを無効にする
+        '''
+        if method == 'POST':
             url = f"{END_POINT_URL_BASE}/sheets/{SELF_INTRO_SHEET_ID}/add"
         else:
-            # 既に自己紹介シート作成済の場合は更新
-            method = 'PATCH'
             url = f"{END_POINT_URL_BASE}/sheets/{SELF_INTRO_SHEET_ID}"
 
-        response = requests.request(
-            method=method,
-            url=url,
+        response = self.request(
+            method,
+            url,
             headers={
                 'Content-Type': 'application/json',
-                'Kaonavi-Token': self.access_token,
                 # 'Dry-Run': '1' # 1はテスト
             },
-            data=request_json
+            data=json.dumps({'member_data': sheets})
         )
 
         if response.ok:
+            for sheet in sheets:
+                KaonaviSelfIntroductionSheet.objects.store(sheet)
+            users_response_cache.invalidate()
             return ApiResult(success=True)
         else:
-            errors = response.json()['errors']
-            return ApiResult(success=False, errors=errors)
+            try:
+                errors = response.json()['errors']
+            except (ValueError, KeyError):
+                errors = [f"カオナビAPIがステータス{response.status_code}を返しました"]
+            return ApiResult(success=False, errors=errors, data=dict(status_code=response.status_code))
 
-    def build_self_introduction_json(self, user, params):
+    def build_self_introduction_data(self, user, params):
         '''
-        create_or_update_self_introduction_infoメソッドにて自己紹介シートを作成/更新する際の項目をjsonで返却する
+        自己紹介シートを作成/更新する際の項目をdictで返却する
         以下カオナビAPIの「シート情報」の仕様に基づいてる
         https://developer.kaonavi.jp/api/v2.0/index.html#tag/%E3%82%B7%E3%83%BC%E3%83%88%E6%83%85%E5%A0%B1/paths/~1sheets~1%7Bsheet_id%7D/patch
         '''
@@ -338,4 +771,40 @@ class KaonaviConnector:
                 }
             ]
         }
-        return json.dumps(obj)
\ No newline at end of file
+        return obj
+
+
+def response_json(response, key=None):
+    '''
+    カオナビAPIのレスポンスのJSON(dict)を返す
+    エラーのステータスの場合や、JSONではない・keyを含まないレスポンスの場合はKaonaviApiErrorにする
+    '''
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    if response.status_code >= 400:
+        errors = body.get('errors') if isinstance(body, dict) else None
+        raise KaonaviApiError(f"カオナビAPIがステータス{response.status_code}を返しました", status_code=response.status_code, errors=errors)
+    if not isinstance(body, dict) or (key is not None and key not in body):
+        raise KaonaviApiError('カオナビAPIのレスポンスが不正です', status_code=response.status_code)
+    return body
+
+
+def refresh_live_payloads():
+    '''
+    カオナビAPIから社員情報一覧と自己紹介シートをバックグラウンドで取り直し、最後に取得できたデータを更新する
+    取り直しはワーカー全体でKAONAVI_STALE_REFRESH_INTERVAL秒に1回まで
+    '''
+    interval = getattr(settings, 'KAONAVI_STALE_REFRESH_INTERVAL', DEFAULT_STALE_REFRESH_INTERVAL)
+    if not cache.add(LAST_GOOD_PAYLOADS_REFRESH_LOCK_KEY, True, interval):
+        return
+
+    def refresh():
+        connector = KaonaviConnector(source=DIRECTORY_SOURCE_LIVE)
+        try:
+            connector.store_live_payloads((connector.get_kaonavi_users(), connector.get_self_introduction_sheet()))
+        except KaonaviApiError as e:
+            logger.warning('failed to refresh kaonavi payloads: %s', e)
+
+    upstream_executor.submit(refresh)
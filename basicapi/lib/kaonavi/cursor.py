@@ -0,0 +1,114 @@
+import base64
+import bisect
+import hashlib
+import json
+from django.db.models import F, Q
+from .years_of_service import parse_years_of_service
+
+# sortパラメータで指定できる項目と、ローカルのDB(KaonaviMember)のカラム、カオナビの社員情報から値を取り出す関数
+# departmentは所属(本部 部 グループ)のフルパスで並べる
+SORT_FIELDS = {
+    'name_kana': ('name_kana', lambda kaonavi_user: kaonavi_user['name_kana'] or ''),
+    'department': ('department_name', lambda kaonavi_user: kaonavi_user['department']['name'] or ''),
+    'years_of_service': ('service_months', lambda kaonavi_user: parse_years_of_service(kaonavi_user.get('years_of_service'))),
+}
+DEFAULT_SORT = 'name_kana'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def parse_sort(sort):
+    '''
+    sortパラメータ(例: name_kana, -years_of_service)を(項目, 降順かどうか)にして返す
+    '''
+    sort = sort or DEFAULT_SORT
+    descending = sort.startswith('-')
+    field = sort[1:] if descending else sort
+    if field not in SORT_FIELDS:
+        raise InvalidCursor(f'sortは{"/".join(SORT_FIELDS.keys())}のいずれかを指定してください')
+    return field, descending
+
+
+def encode_cursor(version, sort, value, code):
+    '''
+    次のページの取得に使うカーソルを返す
+    データのバージョン・並び順・そのページの最後の社員の(並び替えの値, code)を含める
+    '''
+    raw = json.dumps(dict(version=version, sort=sort, value=value, code=code), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor, version, sort):
+    '''
+    カーソルから、前のページの最後の社員の(並び替えの値, code)を返す
+    カーソルを作成した後に社員情報が更新された(バージョンが変わった)場合や、並び順が変わった場合はInvalidCursorになる
+    '''
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        value, code = data['value'], data['code']
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor('cursorが不正です')
+    if data.get('sort') != sort:
+        raise InvalidCursor('cursorと並び順(sort)が一致しません')
+    if data.get('version') != version:
+        raise InvalidCursor('社員情報が更新されたため、最初のページから取得し直してください')
+    return value, code
+
+
+def sort_key(value, code):
+    # Noneは昇順の場合は先頭、降順の場合は末尾に並べる
+    return (value is not None, value if value is not None else '', code)
+
+
+def after_cursor_q(column, value, code, descending):
+    '''
+    ローカルのDBで(column, code)の並び順でカーソルより後ろの社員に絞り込むための条件を返す
+    '''
+    if not descending:
+        if value is None:
+            return Q(**{f'{column}__isnull': True, 'code__gt': code}) | Q(**{f'{column}__isnull': False})
+        return Q(**{f'{column}__gt': value}) | Q(**{column: value, 'code__gt': code})
+    else:
+        if value is None:
+            return Q(**{f'{column}__isnull': True, 'code__lt': code})
+        return Q(**{f'{column}__lt': value}) | Q(**{column: value, 'code__lt': code}) | Q(**{f'{column}__isnull': True})
+
+
+def order_by(column, descending):
+    if descending:
+        return (F(column).desc(nulls_last=True), '-code')
+    return (F(column).asc(nulls_first=True), 'code')
+
+
+def live_version(kaonavi_users):
+    '''
+    カオナビAPIから取得した社員情報一覧のバージョン(並び替えに使う値のハッシュ)を返す
+    '''
+    digest = hashlib.sha1()
+    for kaonavi_user in kaonavi_users:
+        values = [kaonavi_user['code']] + [get_value(kaonavi_user) for _, get_value in SORT_FIELDS.values()]
+        digest.update(json.dumps(values, ensure_ascii=False).encode())
+    return digest.hexdigest()[:16]
+
+
+def live_page(kaonavi_users, field, descending, after, per_page):
+    '''
+    カオナビAPIから取得した社員情報一覧を並び替え、カーソル(after)の次のper_page + 1件を返す
+    (per_page + 1件目があれば次のページがある)
+    カーソルの位置は二分探索で求める
+    '''
+    _, get_value = SORT_FIELDS[field]
+    rows = sorted(
+        ((sort_key(get_value(kaonavi_user), kaonavi_user['code']), kaonavi_user) for kaonavi_user in kaonavi_users),
+        key=lambda row: row[0]
+    )
+    keys = [key for key, _ in rows]
+
+    if not descending:
+        start = 0 if after is None else bisect.bisect_right(keys, sort_key(*after))
+        return [kaonavi_user for _, kaonavi_user in rows[start:start + per_page + 1]]
+    else:
+        end = len(rows) if after is None else bisect.bisect_left(keys, sort_key(*after))
+        return [kaonavi_user for _, kaonavi_user in reversed(rows[max(end - per_page - 1, 0):end])]
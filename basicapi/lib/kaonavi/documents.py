@@ -0,0 +1,98 @@
+from django.utils import timezone
+from ...models import User, KaonaviMember, KaonaviSelfIntroductionSheet, KaonaviMemberDocument, SelfIntroductionEdit
+from ..renderers import RawJSON, dumps
+from .fields import USER_LIST_FIELDS, USER_OVERVIEW_FIELDS
+from .payload import payload_digest
+
+BATCH_SIZE = 500
+# 文書の書き出し方(項目や並び順)を変えた場合は上げる(全社員の文書を作り直す)
+DOCUMENT_FORMAT_VERSION = 1
+# 画像URL(image)は文書に含めず、返す際に先頭に差し込む
+LIST_ROW_FIELDS = frozenset(USER_LIST_FIELDS) - {'image'}
+OVERVIEW_FIELDS = frozenset(USER_OVERVIEW_FIELDS) - {'image'}
+DETAIL_PREFIX = b'{"overview":{'
+
+
+def list_row_json(list_row, image_url):
+    '''
+    社員一覧の1行分の文書に画像URLを差し込んだJSONを返す
+    '''
+    return RawJSON(b'{"image":' + dumps(image_url) + b',' + list_row[1:])
+
+
+def detail_json(detail, image_url):
+    '''
+    社員詳細の文書のoverviewに画像URLを差し込んだJSONを返す
+    '''
+    return RawJSON(DETAIL_PREFIX + b'"image":' + dumps(image_url) + b',' + detail[len(DETAIL_PREFIX):])
+
+
+def refresh_member_documents(connector, kaonavi_codes=None):
+    '''
+    社員ごとの文書(KaonaviMemberDocument)を元のデータに合わせて作り直す
+    社員情報・自己紹介シート(送信待ちの編集を含む)・Userのハッシュを比べ、変わった社員の文書のみ作る
+    kaonavi_codesを指定した場合はその社員たちのみを対象にする
+    connectorはレスポンスの整形と自己紹介シートの読み込みに使うので、ローカルのDBを読むもの(source=local)を渡す
+    作成・更新・削除した件数をdictで返す
+    '''
+    members = KaonaviMember.objects.all()
+    users = User.objects.only('id', 'username', 'email', 'chatwork_id', 'kaonavi_code')
+    sheets = KaonaviSelfIntroductionSheet.objects.all()
+    documents = KaonaviMemberDocument.objects.all()
+    if kaonavi_codes is not None:
+        members = members.filter(code__in=kaonavi_codes)
+        users = users.filter(kaonavi_code__in=kaonavi_codes)
+        sheets = sheets.filter(code__in=kaonavi_codes)
+        documents = documents.filter(code__in=kaonavi_codes)
+
+    member_hashes = dict(members.values_list('code', 'content_hash'))
+    users = {user.kaonavi_code: user for user in users}
+    sheet_hashes = dict(sheets.values_list('code', 'content_hash'))
+    sheet_hashes.update({
+        code: payload_digest(sheet)
+        for code, sheet in SelfIntroductionEdit.objects.unsent().sheets(kaonavi_codes).items()
+    })
+    existing = {code: (pk, source_hash) for code, pk, source_hash in documents.values_list('code', 'pk', 'source_hash')}
+
+    source_hashes = {
+        code: payload_digest([
+            DOCUMENT_FORMAT_VERSION, member_hash, sheet_hashes.get(code),
+            [str(users[code].id), users[code].email, users[code].chatwork_id],
+        ])
+        for code, member_hash in member_hashes.items() if code in users
+    }
+    changed = [code for code, source_hash in source_hashes.items() if existing.get(code, (None, None))[1] != source_hash]
+
+    to_create = []
+    to_update = []
+    for i in range(0, len(changed), BATCH_SIZE):
+        codes = changed[i:i + BATCH_SIZE]
+        kaonavi_users = dict(KaonaviMember.objects.filter(code__in=codes).values_list('code', 'payload'))
+        self_intro_sheets = connector.load_self_introduction_sheet(codes)
+        for code in codes:
+            kaonavi_user, user = kaonavi_users[code], users[code]
+            document = KaonaviMemberDocument(
+                code=code,
+                list_row=dumps(connector.format_user(kaonavi_user, user, self_intro_sheets, LIST_ROW_FIELDS)),
+                detail=dumps(connector.format_user_detail(kaonavi_user, user, self_intro_sheets, OVERVIEW_FIELDS)),
+                source_hash=source_hashes[code],
+                generated_at=timezone.now(),
+            )
+            if code in existing:
+                document.pk = existing[code][0]
+                to_update.append(document)
+            else:
+                to_create.append(document)
+
+    KaonaviMemberDocument.objects.bulk_update(to_update, ['list_row', 'detail', 'source_hash', 'generated_at'], batch_size=BATCH_SIZE)
+    KaonaviMemberDocument.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+
+    # 社員情報・Userが無くなった社員の文書は削除する
+    to_delete = [pk for code, (pk, _) in existing.items() if code not in source_hashes]
+    for i in range(0, len(to_delete), BATCH_SIZE):
+        KaonaviMemberDocument.objects.filter(pk__in=to_delete[i:i + BATCH_SIZE]).delete()
+
+    return dict(
+        created=len(to_create), updated=len(to_update), deleted=len(to_delete),
+        unchanged=len(source_hashes) - len(changed)
+    )
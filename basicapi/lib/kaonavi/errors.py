@@ -0,0 +1,15 @@
+class KaonaviApiError(Exception):
+    '''
+    カオナビAPIへのリクエストに失敗した(接続できない・エラーのステータスが返ってきた・レスポンスが不正)
+    '''
+    def __init__(self, message, status_code=None, errors=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.errors = errors or [message]
+
+
+class KaonaviUnavailable(KaonaviApiError):
+    '''
+    サーキットブレーカーが開いている、またはレート制限の待ち時間が長すぎるため、カオナビAPIにリクエストしなかった
+    '''
+    pass
@@ -0,0 +1,48 @@
+# fieldsパラメータで指定できる項目
+# 社員一覧(/users/)のrecordsの各項目
+USER_LIST_FIELDS = (
+    'image', 'user_id', 'chatwork_id', 'email', 'name', 'name_kana',
+    'headquarters', 'department', 'group', 'role', 'job_description',
+)
+# 社員詳細(/users/:user_id)のoverviewの各項目
+USER_OVERVIEW_FIELDS = (
+    'image', 'email', 'name', 'name_kana', 'chatwork_id', 'headquarters', 'department', 'group',
+)
+# 社員詳細ではoverview/tags/detailsをまとめて指定するか、overviewの項目を個別に指定する
+USER_DETAIL_FIELDS = ('overview', 'tags', 'details') + USER_OVERVIEW_FIELDS
+
+
+class InvalidFields(Exception):
+    pass
+
+
+def parse_fields(value, allowed):
+    '''
+    fieldsパラメータ(カンマ区切り 例: name,department,user_id)をfrozensetにして返す
+    指定されていない場合は全項目を返すという意味でNoneを返す
+    '''
+    if value is None or value == '':
+        return None
+    fields = frozenset(field.strip() for field in value.split(',') if field.strip())
+    unknown = fields - set(allowed)
+    if unknown:
+        raise InvalidFields(f'fieldsに指定できない項目です: {",".join(sorted(unknown))} (指定できる項目: {",".join(allowed)})')
+    return fields
+
+
+def select(columns, fields):
+    '''
+    {項目名: 値を返す関数}のうち、fieldsに含まれる項目だけ関数を呼んでdictにする
+    fieldsがNoneの場合は全項目
+    '''
+    return {key: get_value() for key, get_value in columns.items() if fields is None or key in fields}
+
+
+def detail_sections(fields):
+    '''
+    社員詳細のfieldsから、(overviewの項目のset(またはNone=全項目), tagsを含むか, detailsを含むか)を返す
+    '''
+    if fields is None:
+        return None, True, True
+    overview = None if 'overview' in fields else fields & set(USER_OVERVIEW_FIELDS)
+    return overview, 'tags' in fields, 'details' in fields
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .errors import KaonaviApiError, KaonaviUnavailable
+from .resilience import rate_limiter, circuit_breaker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+# 再試行するのは冪等なメソッドのみ(POST /token, POST /sheets/:sheet_id/add, PATCH /sheets/:sheet_id は再試行しない)
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RateLimitedRetry(Retry):
+    '''
+    再試行の前にもレート制限(rate_limiter)のトークンを1個使うRetry
+    urllib3が再試行するリクエストもカオナビAPIへの1リクエストとして数える
+    '''
+    def sleep(self, response=None):
+        super().sleep(response)
+        rate_limiter.acquire()
+
+
+class KaonaviSession:
+    '''
+    カオナビAPIへのリクエストに使うHTTPセッション
+    プロセス全体で1つのrequests.Sessionを共有し、TLSの接続をKeep-Aliveで使い回す
+    タイムアウトと、冪等なメソッドの429/5xxに対するバックオフ付きの再試行を設定している
+    リクエスト(再試行を含む)の前にレート制限(rate_limiter)とサーキットブレーカー(circuit_breaker)を確認し、
+    接続できない場合はrequestsの例外ではなくKaonaviApiErrorを送出する
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session = None
+        self.request_count = 0
+        self.error_count = 0
+        self.total_elapsed = 0.0
+        self.max_elapsed = 0.0
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (
+            getattr(settings, 'KAONAVI_HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+            getattr(settings, 'KAONAVI_HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+        ))
+        circuit_breaker.allow()
+        try:
+            rate_limiter.acquire()
+        except KaonaviUnavailable:
+            circuit_breaker.release_trial()
+            raise
+        started_at = time.monotonic()
+        status_code = None
+        try:
+            response = self.session().request(method, url, **kwargs)
+            status_code = response.status_code
+            return response
+        except requests.RequestException as e:
+            raise KaonaviApiError(f'カオナビAPIに接続できませんでした: {e}') from e
+        finally:
+            record_result(status_code)
+            elapsed = time.monotonic() - started_at
+            self._record(elapsed, status_code)
+            logger.debug(
+                'kaonavi %s %s status=%s elapsed=%.1fms %s',
+                method, url, status_code, elapsed * 1000, self.pool_stats()
+            )
+
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def pool_stats(self):
+        '''
+        コネクションプールごとの(新規に張った接続数, リクエスト数)と、このセッションのレイテンシの集計を返す
+        新規接続数がリクエスト数に比べて十分少なければ、接続が使い回せている
+        '''
+        pools = {}
+        if self._session is not None:
+            adapter = self._session.get_adapter('https://')
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is not None:
+                    pools[pool.host] = dict(connections=pool.num_connections, requests=pool.num_requests)
+        return dict(
+            pools=pools,
+            requests=self.request_count,
+            errors=self.error_count,
+            avg_ms=round(self.total_elapsed / self.request_count * 1000, 1) if self.request_count else 0,
+            max_ms=round(self.max_elapsed * 1000, 1),
+        )
+
+    def _record(self, elapsed, status_code):
+        with self._lock:
+            self.request_count += 1
+            if status_code is None or status_code >= 500:
+                self.error_count += 1
+            self.total_elapsed += elapsed
+            self.max_elapsed = max(self.max_elapsed, elapsed)
+
+    def _build_session(self):
+        pool_size = getattr(settings, 'KAONAVI_HTTP_POOL_SIZE', DEFAULT_POOL_SIZE)
+        retry = RateLimitedRetry(
+            total=getattr(settings, 'KAONAVI_HTTP_MAX_RETRIES', DEFAULT_MAX_RETRIES),
+            backoff_factor=getattr(settings, 'KAONAVI_HTTP_BACKOFF_FACTOR', DEFAULT_BACKOFF_FACTOR),
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+
+class AsyncKaonaviSession:
+    '''
+    KaonaviSessionの非同期版(httpx.AsyncClient)
+    接続プールはイベントループごとに1つ作り、そのループ内の全リクエストで共有する
+    タイムアウト・再試行の設定、レート制限・サーキットブレーカーはKaonaviSessionと同じものを使う
+    '''
+    def __init__(self):
+        self._clients = weakref.WeakKeyDictionary()
+
+    async def request(self, method, url, **kwargs):
+        client = self.client()
+        max_retries = getattr(settings, 'KAONAVI_HTTP_MAX_RETRIES', DEFAULT_MAX_RETRIES) if method in IDEMPOTENT_METHODS else 0
+        backoff_factor = getattr(settings, 'KAONAVI_HTTP_BACKOFF_FACTOR', DEFAULT_BACKOFF_FACTOR)
+
+        circuit_breaker.allow()
+        for attempt in range(max_retries + 1):
+            try:
+                await rate_limiter.aacquire()
+            except KaonaviUnavailable:
+                # 1回目はまだ送っていないので試しのリクエストを取り消し、再試行の場合は直前の失敗を記録する
+                if attempt == 0:
+                    circuit_breaker.release_trial()
+                else:
+                    record_result(response.status_code)
+                raise
+            started_at = time.monotonic()
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.HTTPError as e:
+                record_result(None)
+                raise KaonaviApiError(f'カオナビAPIに接続できませんでした: {e}') from e
+            logger.debug(
+                'kaonavi(async) %s %s status=%s elapsed=%.1fms attempt=%d',
+                method, url, response.status_code, (time.monotonic() - started_at) * 1000, attempt + 1
+            )
+            if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                record_result(response.status_code)
+                return response
+            await asyncio.sleep(backoff_factor * (2 ** attempt))
+
+    def client(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            pool_size = getattr(settings, 'KAONAVI_HTTP_POOL_SIZE', DEFAULT_POOL_SIZE)
+            self._clients[loop] = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                timeout=httpx.Timeout(
+                    getattr(settings, 'KAONAVI_HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+                    connect=getattr(settings, 'KAONAVI_HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+                ),
+            )
+        return self._clients[loop]
+
+
+def record_result(status_code):
+    '''
+    リクエストの結果をサーキットブレーカーに記録する(接続エラー・429・5xxを失敗とする)
+    '''
+    if status_code is None or status_code in RETRY_STATUSES:
+        circuit_breaker.record_failure()
+    else:
+        circuit_breaker.record_success()
+
+
+# プロセス全体で共有する
+kaonavi_session = KaonaviSession()
+async_kaonavi_session = AsyncKaonaviSession()
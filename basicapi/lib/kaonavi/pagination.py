@@ -0,0 +1,16 @@
+class InvalidPagination(Exception):
+    pass
+
+
+def parse_positive_int(params, name, default):
+    '''
+    ページネーションのパラメータ(page, per_page)を1以上の整数にして返す
+    指定されていない(空の値を含む)場合はdefaultを返し、1以上の整数でない場合はInvalidPaginationを送出する
+    '''
+    value = params.get(name)
+    if value is None or value == '':
+        return default
+    value = str(value).strip()
+    if not value.isdecimal() or int(value) < 1:
+        raise InvalidPagination(f'{name}には1以上の整数を指定してください')
+    return int(value)
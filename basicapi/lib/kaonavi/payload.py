@@ -0,0 +1,10 @@
+import hashlib
+import json
+
+
+def payload_digest(payload):
+    '''
+    カオナビAPIから取得したデータ(社員情報・自己紹介シートなど)のハッシュを返す
+    キーの順番が違うだけのデータは同じハッシュになる
+    '''
+    return hashlib.sha1(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import threading
+import time
+from django.conf import settings
+from .errors import KaonaviUnavailable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_LIMIT_PER_SECOND = 5
+DEFAULT_RATE_LIMIT_BURST = 10
+DEFAULT_RATE_LIMIT_MAX_WAIT = 10
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+
+
+class TokenBucket:
+    '''
+    カオナビAPIへのリクエストのレート制限(トークンバケット)
+    1秒あたりKAONAVI_RATE_LIMIT_PER_SECOND個のトークンが溜まり(上限はKAONAVI_RATE_LIMIT_BURST個)、
+    リクエストの度に1個使う。トークンが無い場合は溜まるまで待つ
+    待ち時間がKAONAVI_RATE_LIMIT_MAX_WAIT秒を超える場合は待たずにKaonaviUnavailableにする
+    KAONAVI_RATE_LIMIT_PER_SECONDが0の場合は制限しない
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = None
+        self._updated_at = time.monotonic()
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self):
+        '''
+        acquireの非同期版
+        '''
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _reserve(self):
+        '''
+        トークンを1個予約し、使えるようになるまでの秒数を返す
+        '''
+        rate = getattr(settings, 'KAONAVI_RATE_LIMIT_PER_SECOND', DEFAULT_RATE_LIMIT_PER_SECOND)
+        if rate <= 0:
+            return 0
+        burst = getattr(settings, 'KAONAVI_RATE_LIMIT_BURST', DEFAULT_RATE_LIMIT_BURST)
+
+        with self._lock:
+            now = time.monotonic()
+            tokens = burst if self._tokens is None else min(burst, self._tokens + (now - self._updated_at) * rate)
+            wait = max(0, (1 - tokens) / rate)
+            if wait > getattr(settings, 'KAONAVI_RATE_LIMIT_MAX_WAIT', DEFAULT_RATE_LIMIT_MAX_WAIT):
+                raise KaonaviUnavailable('カオナビAPIへのリクエストが多すぎるため、時間をおいて再度お試しください')
+            # 待っている間に溜まる分も含めて1個使う(負の値は先に予約された分)
+            self._tokens = tokens - 1
+            self._updated_at = now
+            return wait
+
+
+class CircuitBreaker:
+    '''
+    カオナビAPIのサーキットブレーカー
+    接続エラー・429・5xxがKAONAVI_CIRCUIT_FAILURE_THRESHOLD回続くと開き(open)、
+    KAONAVI_CIRCUIT_RESET_TIMEOUT秒の間はカオナビAPIにリクエストせずにKaonaviUnavailableにする
+    その後は1リクエストだけ試し(half_open)、成功すれば閉じ(closed)、失敗すれば再び開く
+    試しのリクエストをレート制限などで送らなかった場合はrelease_trialで開いた状態に戻し、次のリクエストで試し直す
+    '''
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+
+    def allow(self):
+        '''
+        リクエストしてよいかを確認する。開いている場合はKaonaviUnavailableにする
+        '''
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            reset_timeout = getattr(settings, 'KAONAVI_CIRCUIT_RESET_TIMEOUT', DEFAULT_RESET_TIMEOUT)
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= reset_timeout:
+                # 試しに1リクエストだけ通す
+                self.state = self.HALF_OPEN
+                return
+            raise KaonaviUnavailable('カオナビAPIに接続できないため、時間をおいて再度お試しください')
+
+    def release_trial(self):
+        '''
+        allowで通した試しのリクエストをカオナビAPIに送らなかった場合に呼ぶ
+        '''
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info('kaonavi circuit closed')
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            threshold = getattr(settings, 'KAONAVI_CIRCUIT_FAILURE_THRESHOLD', DEFAULT_FAILURE_THRESHOLD)
+            if self.state == self.HALF_OPEN or self.failures >= threshold:
+                if self.state != self.OPEN:
+                    logger.warning('kaonavi circuit opened after %d failures', self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        return dict(state=self.state, failures=self.failures)
+
+
+# プロセス全体で共有する
+rate_limiter = TokenBucket()
+circuit_breaker = CircuitBreaker()
@@ -0,0 +1,105 @@
+import bisect
+import threading
+from collections import defaultdict
+from .years_of_service import parse_years_of_service
+
+# 転置インデックスを作る項目
+SEARCH_FIELDS = {
+    'name': lambda kaonavi_user: kaonavi_user['name'],
+    'name_kana': lambda kaonavi_user: kaonavi_user['name_kana'],
+    'department': lambda kaonavi_user: kaonavi_user['department']['name'],
+}
+
+
+def ngrams(text):
+    '''
+    文字列のuni-gramとbi-gramを返す
+    '''
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class MemberSearchIndex:
+    '''
+    カオナビの社員情報一覧に対するn-gram(uni-gram/bi-gram)の転置インデックス
+    社員一覧の部分一致での絞り込みを、全社員の走査ではなくポスティングリスト(社員のindexのset)の積で行う
+    n-gramの積だけだと「文字は含むが連続していない」社員も候補に残るため、最後に候補だけ部分一致で確認する
+    勤続年数は月数に変換してソートしておき、範囲での絞り込みを二分探索で行う
+    '''
+    def __init__(self, kaonavi_users):
+        self.size = len(kaonavi_users)
+        self.values = {}
+        self.postings = {}
+
+        for field, get_value in SEARCH_FIELDS.items():
+            values = [get_value(kaonavi_user) or '' for kaonavi_user in kaonavi_users]
+            postings = defaultdict(set)
+            for i, value in enumerate(values):
+                for gram in ngrams(value):
+                    postings[gram].add(i)
+            self.values[field] = values
+            self.postings[field] = postings
+
+        # (勤続月数, index)の昇順。勤続年数が変換できない社員は含めない
+        service_months = sorted(
+            (months, i) for i, months in enumerate(
+                parse_years_of_service(kaonavi_user.get('years_of_service')) for kaonavi_user in kaonavi_users
+            ) if months is not None
+        )
+        self.service_months = [months for months, _ in service_months]
+        self.service_month_indexes = [i for _, i in service_months]
+
+    def search(self, field, query):
+        '''
+        fieldの値にqueryを含む社員の(社員情報一覧での)indexをsetで返す
+        '''
+        if query == '':
+            return set(range(self.size))
+
+        postings = self.postings[field]
+        grams = [query[i:i + 2] for i in range(len(query) - 1)] if len(query) >= 2 else [query]
+        posting_lists = sorted((postings.get(gram, set()) for gram in set(grams)), key=len)
+
+        candidates = set(posting_lists[0])
+        for posting_list in posting_lists[1:]:
+            candidates &= posting_list
+            if not candidates:
+                break
+
+        values = self.values[field]
+        return {i for i in candidates if query in values[i]}
+
+
+    def search_years_of_service(self, min_months=None, max_months=None):
+        '''
+        勤続月数がmin_months以上max_months以下の社員のindexをsetで返す(Noneの場合は上限/下限なし)
+        '''
+        start = 0 if min_months is None else bisect.bisect_left(self.service_months, min_months)
+        end = len(self.service_months) if max_months is None else bisect.bisect_right(self.service_months, max_months)
+        return set(self.service_month_indexes[start:end])
+
+
+_lock = threading.Lock()
+_cached_index = None
+_cached_version = None
+
+
+def member_search_index(kaonavi_users, version=None):
+    '''
+    社員情報一覧の転置インデックスを返す
+    version(社員情報一覧を取得した際に求めたハッシュ)が前回と同じであれば、作成済みのインデックスを使い回す
+    一覧の中身を毎回比べないよう、versionは取得したデータを保持する際に1回だけ求めたもの(KaonaviConnector.live_digests)を渡す
+    versionが無い場合は使い回さずに作る
+    '''
+    global _cached_index, _cached_version
+
+    if version is not None:
+        with _lock:
+            if _cached_index is not None and _cached_version == version:
+                return _cached_index
+
+    index = MemberSearchIndex(kaonavi_users)
+    if version is not None:
+        with _lock:
+            _cached_index = index
+            _cached_version = version
+    return index
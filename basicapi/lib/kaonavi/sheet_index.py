@@ -0,0 +1,42 @@
+class SelfIntroductionSheetIndex:
+    '''
+    カオナビから取得した自己紹介シート({'member_data': [...]})を社員のcodeで引けるようにしたもの
+    シートの項目(custom_fields)も社員ごとに{項目ID: 値}の形に変換し、一度変換したものは使い回す
+    '''
+    def __init__(self, sheets):
+        self.sheets = {sheet['code']: sheet for sheet in sheets['member_data']}
+        self._custom_fields = {}
+
+    def overlay(self, sheets):
+        '''
+        {code: シート}で渡したシートで、その社員の自己紹介シートを置き換える
+        カオナビにまだ反映していない編集(SelfIntroductionEdit)を読み込み結果に反映するのに使う
+        '''
+        for kaonavi_code, sheet in sheets.items():
+            self.sheets[kaonavi_code] = sheet
+            self._custom_fields.pop(kaonavi_code, None)
+        return self
+
+    def __contains__(self, kaonavi_code):
+        return kaonavi_code in self.sheets
+
+    def find(self, kaonavi_code):
+        '''
+        その社員の自己紹介シートを返す
+        シートが未作成の場合はNoneを返す
+        '''
+        return self.sheets.get(kaonavi_code)
+
+    def custom_fields(self, kaonavi_code):
+        '''
+        その社員の自己紹介シートの項目を{項目ID: 値}のdictで返す
+        シートが未作成の場合は空のdictを返す
+        '''
+        if kaonavi_code not in self._custom_fields:
+            sheet = self.find(kaonavi_code)
+            records = sheet['records'] if sheet is not None else []
+            self._custom_fields[kaonavi_code] = {
+                custom_field['id']: custom_field['values'][0] if len(custom_field['values']) >= 1 else ''
+                for custom_field in (records[0]['custom_fields'] if len(records) >= 1 else [])
+            }
+        return self._custom_fields[kaonavi_code]
@@ -0,0 +1,139 @@
+import logging
+from django.conf import settings
+from ...models import SelfIntroductionEdit, KaonaviSelfIntroductionSheet, KaonaviChangeLog
+from .connector import KaonaviConnector, DIRECTORY_SOURCE_LIVE, DIRECTORY_SOURCE_LOCAL
+from .documents import refresh_member_documents
+from .errors import KaonaviApiError, KaonaviUnavailable
+from .sheet_index import SelfIntroductionSheetIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def flush_self_introduction_edits(connector=None, batch_size=None):
+    '''
+    送信待ちの自己紹介シートの編集(SelfIntroductionEdit)を、複数社員分まとめてカオナビに送信する
+    シートが未作成の社員はPOST、作成済の社員はPATCHの1リクエストずつにまとめる
+    作成済かどうかはローカルのDBの自己紹介シートで判定し、カオナビ上のシートはダウンロードしない
+    送信後に、送信した社員の文書(KaonaviMemberDocument)を作り直す
+    1プロセスで実行する想定(manage.py flush_self_introduction_edits)
+    送信した件数をdictで返す
+    '''
+    connector = connector or KaonaviConnector(source=DIRECTORY_SOURCE_LIVE)
+    batch_size = batch_size or getattr(settings, 'KAONAVI_SHEET_WRITE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    edits = claim_edits(batch_size)
+    result = dict(sent=len(edits), succeeded=0, retrying=0, failed=0)
+    if not edits:
+        return result
+
+    try:
+        existing_codes = sheet_existing_codes(connector, [edit.code for edit in edits])
+    except KaonaviApiError as e:
+        logger.warning('failed to fetch self introduction sheets: %s', e)
+        for edit in edits:
+            result[finish_edit(edit, success=False, errors=e.errors, retryable=True)] += 1
+        return result
+
+    batches = dict(POST=[], PATCH=[])
+    for edit in edits:
+        batches['PATCH' if edit.code in existing_codes else 'POST'].append(edit)
+
+    for method, batch in batches.items():
+        if batch:
+            for status in send_edits(connector, method, batch):
+                result[status] += 1
+
+    # 反映済み・失敗になった編集は読み込み時に上書きしなくなるため、その社員の文書を作り直す
+    refresh_member_documents(KaonaviConnector(source=DIRECTORY_SOURCE_LOCAL), [edit.code for edit in edits])
+    return result
+
+
+def sheet_existing_codes(connector, kaonavi_codes):
+    '''
+    kaonavi_codesのうち、カオナビ上に自己紹介シートのレコードがある社員のcodeをsetで返す
+    一度も同期していない(ローカルのDBに自己紹介シートが無い)場合のみ、カオナビ上のシートをダウンロードして判定する
+    '''
+    if KaonaviChangeLog.objects.filter(kind=KaonaviChangeLog.KIND_SHEET).exists():
+        return KaonaviSelfIntroductionSheet.objects.existing_codes(kaonavi_codes)
+    self_intro_sheets = SelfIntroductionSheetIndex(connector.get_self_introduction_sheet())
+    return {kaonavi_code for kaonavi_code in kaonavi_codes if kaonavi_code in self_intro_sheets}
+
+
+def claim_edits(batch_size):
+    '''
+    送信待ちの編集を古い順にbatch_size件まで送信中にして返す
+    同じ社員の編集が複数ある場合は、新しいものだけを送信し、古いものは置き換え済みにする
+    送信待ちのまま内容が置き換えられる(enqueue)ことがあるため、送信中にした後の内容を読み直して返す
+    '''
+    edits = list(SelfIntroductionEdit.objects.filter(status=SelfIntroductionEdit.STATUS_PENDING).order_by('id')[:batch_size])
+    latest = {edit.code: edit.id for edit in edits}
+    superseded = [edit.id for edit in edits if latest[edit.code] != edit.id]
+    if superseded:
+        SelfIntroductionEdit.objects.filter(id__in=superseded, status=SelfIntroductionEdit.STATUS_PENDING) \
+            .update(status=SelfIntroductionEdit.STATUS_SUPERSEDED)
+
+    SelfIntroductionEdit.objects.filter(id__in=latest.values(), status=SelfIntroductionEdit.STATUS_PENDING) \
+        .update(status=SelfIntroductionEdit.STATUS_PROCESSING)
+    return list(SelfIntroductionEdit.objects.filter(id__in=latest.values(), status=SelfIntroductionEdit.STATUS_PROCESSING))
+
+
+def send_edits(connector, method, edits, switched=False):
+    '''
+    編集をまとめて1リクエストで送信し、結果を各編集に記録する
+    カオナビ側で弾かれた(4xx)場合は、どの社員の編集が原因か分かるように1件ずつ送り直す
+    1件ずつ送っても弾かれた場合は、ローカルのDBでの作成済かどうかの判定が古い(同期後にカオナビ上で作成/削除された)可能性があるので、
+    POSTとPATCHを入れ替えて1度だけ送り直す
+    編集ごとの結果(succeeded/retrying/failed)をlistで返す
+    '''
+    try:
+        result = connector.send_self_introduction_sheets(method, [edit.sheet for edit in edits])
+    except KaonaviUnavailable as e:
+        # カオナビAPIにリクエストしていないので、送信回数に数えずに送信待ちに戻す
+        logger.warning('kaonavi is unavailable: %s', e)
+        SelfIntroductionEdit.objects.filter(id__in=[edit.id for edit in edits]).update(status=SelfIntroductionEdit.STATUS_PENDING)
+        return ['retrying' for edit in edits]
+    except KaonaviApiError as e:
+        logger.warning('failed to send self introduction sheets: %s', e)
+        return [finish_edit(edit, success=False, errors=e.errors, retryable=True) for edit in edits]
+
+    if result.is_success():
+        return [finish_edit(edit, success=True) for edit in edits]
+
+    retryable = result.data['status_code'] == 429 or result.data['status_code'] >= 500
+    if not retryable and len(edits) > 1:
+        return [status for edit in edits for status in send_edits(connector, method, [edit], switched)]
+    if not retryable and not switched:
+        return send_edits(connector, 'PATCH' if method == 'POST' else 'POST', edits, switched=True)
+    return [finish_edit(edit, success=False, errors=result.error_messages(), retryable=retryable) for edit in edits]
+
+
+def finish_edit(edit, success, errors=None, retryable=False):
+    '''
+    送信結果を編集に記録する
+    一時的なエラーの場合は、送信回数の上限までは送信待ちに戻す
+    '''
+    edit.attempts += 1
+    edit.errors = errors
+    if success:
+        edit.status = SelfIntroductionEdit.STATUS_SUCCEEDED
+    elif retryable and edit.attempts < getattr(settings, 'KAONAVI_SHEET_WRITE_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS):
+        edit.status = SelfIntroductionEdit.STATUS_PENDING
+    else:
+        edit.status = SelfIntroductionEdit.STATUS_FAILED
+    edit.save(update_fields=['attempts', 'errors', 'status', 'updated_at'])
+    return {
+        SelfIntroductionEdit.STATUS_SUCCEEDED: 'succeeded',
+        SelfIntroductionEdit.STATUS_PENDING: 'retrying',
+        SelfIntroductionEdit.STATUS_FAILED: 'failed',
+    }[edit.status]
+
+
+def requeue_interrupted_edits():
+    '''
+    送信中のまま止まった(送信処理が途中で終了した)編集を送信待ちに戻す
+    送信処理の起動時に呼ぶ
+    '''
+    return SelfIntroductionEdit.objects.filter(status=SelfIntroductionEdit.STATUS_PROCESSING) \
+        .update(status=SelfIntroductionEdit.STATUS_PENDING)
@@ -0,0 +1,139 @@
+from django.db import transaction
+from django.utils import timezone
+from ...models import KaonaviMember, KaonaviSelfIntroductionSheet, KaonaviChangeLog
+from ..response_cache import users_response_cache
+from .connector import KaonaviConnector, DIRECTORY_SOURCE_LIVE, DIRECTORY_SOURCE_LOCAL
+from .documents import refresh_member_documents
+from .payload import payload_digest
+from .years_of_service import parse_years_of_service
+
+BATCH_SIZE = 500
+
+
+def sync_kaonavi_members(connector=None):
+    '''
+    カオナビ上の社員情報(/members)と自己紹介シート(/sheets/:sheet_id)を取得し、ローカルのDBに同期する
+    社員・シートごとに中身のハッシュを比較し、変わったものだけを書き込んで変更履歴(KaonaviChangeLog)に残す
+    カオナビ上から削除された社員・シートはローカルからも削除する
+    同期後に、社員ごとの文書(KaonaviMemberDocument)のうち元のデータが変わった社員の分を作り直す
+    変更があった場合は社員一覧のレスポンスのキャッシュを無効にする
+    同期した件数と、同期後のデータのバージョンをdictで返す
+    '''
+    connector = connector or KaonaviConnector(source=DIRECTORY_SOURCE_LIVE)
+    kaonavi_users = connector.get_kaonavi_users()
+    sheets = connector.get_self_introduction_sheet()['member_data']
+    synced_at = timezone.now()
+    positions = assign_positions(
+        [kaonavi_user['code'] for kaonavi_user in kaonavi_users],
+        dict(KaonaviMember.objects.values_list('code', 'position'))
+    )
+
+    members = [
+        KaonaviMember(
+            code=kaonavi_user['code'],
+            name=kaonavi_user['name'] or '',
+            name_kana=kaonavi_user.get('name_kana') or '',
+            department_name=(kaonavi_user.get('department') or {}).get('name') or '',
+            gender=kaonavi_user.get('gender') or '',
+            service_months=parse_years_of_service(kaonavi_user.get('years_of_service')),
+            position=positions[i],
+            payload=kaonavi_user,
+            content_hash=payload_digest(kaonavi_user),
+            synced_at=synced_at,
+        )
+        for i, kaonavi_user in enumerate(kaonavi_users)
+    ]
+    self_intro_sheets = [
+        KaonaviSelfIntroductionSheet(code=sheet['code'], payload=sheet, content_hash=payload_digest(sheet), synced_at=synced_at)
+        for sheet in sheets
+    ]
+
+    with transaction.atomic():
+        member_count = apply_changes(
+            KaonaviMember,
+            KaonaviChangeLog.KIND_MEMBER,
+            members,
+            ['name', 'name_kana', 'department_name', 'gender', 'service_months', 'position', 'payload', 'content_hash', 'synced_at'],
+            compare=('content_hash', 'position')
+        )
+        sheet_count = apply_changes(
+            KaonaviSelfIntroductionSheet,
+            KaonaviChangeLog.KIND_SHEET,
+            self_intro_sheets,
+            ['payload', 'content_hash', 'synced_at']
+        )
+
+    document_count = refresh_member_documents(KaonaviConnector(source=DIRECTORY_SOURCE_LOCAL))
+
+    if any(count[action] for count in (member_count, sheet_count, document_count) for action in ('created', 'updated', 'deleted')):
+        users_response_cache.invalidate()
+
+    return dict(
+        members=member_count, sheets=sheet_count, documents=document_count,
+        version=KaonaviChangeLog.objects.current_version()
+    )
+
+
+def assign_positions(codes, current_positions):
+    '''
+    カオナビの社員情報一覧の順番(codes)どおりに並ぶよう、社員ごとの並び順(position)を決める
+    positionは大小関係だけ合っていればよいので、既存の社員の順番が変わっていなければ既存のpositionを使い回す
+    (削除による歯抜けはそのままにし、追加された社員には直前の社員の次の値を振る)
+    そうすることで、社員の追加・削除があっても他の社員のレコードを書き換えずに済む
+    順番が入れ替わった場合や、振る値が空いていない場合は全員を振り直す
+    '''
+    positions = []
+    last = -1
+    for code in codes:
+        position = current_positions.get(code, last + 1)
+        if position <= last:
+            return list(range(len(codes)))
+        positions.append(position)
+        last = position
+    return positions
+
+
+def apply_changes(model, kind, rows, fields, compare=('content_hash',)):
+    '''
+    codeをキーにして、modelのテーブルの中身をrowsに合わせる
+    compareのカラムの値が変わったレコードのみ更新し、無いレコードは作成、rowsに含まれないレコードは削除する
+    作成・更新・削除したレコードは変更履歴に残す
+    '''
+    existing = {
+        values[0]: values[1:]
+        for values in model.objects.values_list('code', 'pk', *compare)
+    }
+    codes = set()
+    to_create = []
+    to_update = []
+    unchanged = 0
+
+    for row in rows:
+        codes.add(row.code)
+        if row.code in existing:
+            pk, *current = existing[row.code]
+            if current == [getattr(row, column) for column in compare]:
+                unchanged += 1
+                continue
+            row.pk = pk
+            to_update.append(row)
+        else:
+            to_create.append(row)
+
+    model.objects.bulk_update(to_update, fields, batch_size=BATCH_SIZE)
+    model.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+
+    to_delete = {code: values[0] for code, values in existing.items() if code not in codes}
+    pks = list(to_delete.values())
+    for i in range(0, len(pks), BATCH_SIZE):
+        model.objects.filter(pk__in=pks[i:i + BATCH_SIZE]).delete()
+
+    changed_at = timezone.now()
+    KaonaviChangeLog.objects.bulk_create(
+        [KaonaviChangeLog(kind=kind, code=row.code, action=KaonaviChangeLog.ACTION_CREATED, changed_at=changed_at) for row in to_create] +
+        [KaonaviChangeLog(kind=kind, code=row.code, action=KaonaviChangeLog.ACTION_UPDATED, changed_at=changed_at) for row in to_update] +
+        [KaonaviChangeLog(kind=kind, code=code, action=KaonaviChangeLog.ACTION_DELETED, changed_at=changed_at) for code in to_delete],
+        batch_size=BATCH_SIZE
+    )
+
+    return dict(created=len(to_create), updated=len(to_update), deleted=len(to_delete), unchanged=unchanged)
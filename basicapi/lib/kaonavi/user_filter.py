@@ -1,36 +1,73 @@
+from .search_index import member_search_index
+from .years_of_service import years_of_service_range
+
 class UserFilter:
-    def __init__(self, params, kaonavi_users):
+    def __init__(self, params, kaonavi_users, version=None):
         self.kaonavi_users = kaonavi_users
+        # 社員情報一覧のバージョン(ハッシュ)。転置インデックスを使い回すキーにする
+        self.version = version
         self.name = params.get('name')
         self.headquarters = params.get('headquarters')
         self.department = params.get('department')
         self.group = params.get('group')
         self.gender = params.get('gender')
-        # self.years_of_service = params.get('years_of_service')
+        # 「x年以上」「x年以下」「x年台」を勤続月数の範囲にしたもの
+        self.min_service_months, self.max_service_months = years_of_service_range(params)
 
     def call(self):
-        records = self.kaonavi_users
+        matched = self.matched_indexes()
+        predicate = self.compile()
 
-        if self.name:
-            records = self.filter_list(lambda user: self.name in user['name'], records)
+        if matched is None:
+            records = self.kaonavi_users
+        else:
+            records = [self.kaonavi_users[i] for i in sorted(matched)]
 
-        if self.headquarters:
-            records = self.filter_list(lambda user: self.headquarters in user['department']['name'], records)
+        if predicate is None:
+            return list(records)
+        # 残りの条件は1つの関数にまとめて、1回の走査で判定する
+        return [user for user in records if predicate(user)]
 
-        if self.department:
-            records = self.filter_list(lambda user: self.department in user['department']['name'], records)
+    def matched_indexes(self):
+        '''
+        転置インデックスで絞り込める条件(氏名・部署名の部分一致、勤続年数の範囲)に合う社員のindexをsetで返す
+        該当する条件が指定されていない場合はNoneを返す
+        '''
+        conditions = [
+            ('name', self.name),
+            ('department', self.headquarters),
+            ('department', self.department),
+            ('department', self.group),
+        ]
+        conditions = [(field, query) for field, query in conditions if query]
+        has_service_range = self.min_service_months is not None or self.max_service_months is not None
+        if not conditions and not has_service_range:
+            return None
 
-        if self.group:
-            records = self.filter_list(lambda user: self.group in user['department']['name'], records)
+        index = member_search_index(self.kaonavi_users, self.version)
+        matched = None
+        if has_service_range:
+            matched = index.search_years_of_service(self.min_service_months, self.max_service_months)
+        for field, query in conditions:
+            if matched is not None and not matched:
+                break
+            matched = index.search(field, query) if matched is None else matched & index.search(field, query)
+        return matched
 
-        if self.gender: # 男性 or 女性
-            records = self.filter_list(lambda user: self.gender in user['gender'], records)
+    def compile(self):
+        '''
+        転置インデックスを使わない条件を、社員情報を受け取ってTrue/Falseを返す1つの関数にまとめる
+        該当する条件が指定されていない場合はNoneを返す
+        '''
+        predicates = []
 
-        # if self.years_of_service:
-            # 「x年以上」「x年以下」「x年台」なのか
-        return records
+        if self.gender: # 男性 or 女性
+            gender = self.gender
+            predicates.append(lambda user: gender in user['gender'])
 
-    # イテラブルから条件に合う要素を抽出してリストで返す
-    def filter_list(self, func, iterable):
-        result = filter(func, iterable)
-        return list(result)
\ No newline at end of file
+        if len(predicates) == 0:
+            return None
+        elif len(predicates) == 1:
+            return predicates[0]
+        else:
+            return lambda user: all(predicate(user) for predicate in predicates)
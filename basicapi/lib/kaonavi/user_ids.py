@@ -0,0 +1,31 @@
+import uuid
+
+DEFAULT_MAX_BATCH_SIZE = 50
+
+
+class InvalidUserIds(Exception):
+    pass
+
+
+def parse_user_ids(value, max_count=DEFAULT_MAX_BATCH_SIZE):
+    '''
+    idsパラメータ(ユーザーのidのカンマ区切り)をUUIDのlistにして返す
+    重複は除き、指定された順番を保つ
+    '''
+    if not value:
+        raise InvalidUserIds('idsを指定してください')
+    user_ids = []
+    for user_id in value.split(','):
+        if not user_id.strip():
+            continue
+        try:
+            user_id = uuid.UUID(user_id.strip())
+        except ValueError:
+            raise InvalidUserIds(f'idsに不正なidが含まれています: {user_id.strip()}')
+        if user_id not in user_ids:
+            user_ids.append(user_id)
+    if not user_ids:
+        raise InvalidUserIds('idsを指定してください')
+    if len(user_ids) > max_count:
+        raise InvalidUserIds(f'idsは{max_count}件まで指定できます')
+    return user_ids
@@ -0,0 +1,52 @@
+import re
+
+YEARS_PATTERN = re.compile(r'(\d+)\s*年')
+MONTHS_PATTERN = re.compile(r'(\d+)\s*(?:ヶ|ケ|ヵ|カ|か|箇)?\s*月')
+
+# 勤続年数での絞り込み条件(years_of_service_condition)
+# or_more: x年以上、or_less: x年以下、band: x年台
+# いずれも勤続年数の年の部分(ヶ月は切り捨て)で比較する
+YEARS_OF_SERVICE_CONDITIONS = ('or_more', 'or_less', 'band')
+DEFAULT_YEARS_OF_SERVICE_CONDITION = 'or_more'
+
+
+class InvalidYearsOfService(Exception):
+    pass
+
+
+def parse_years_of_service(years_of_service):
+    '''
+    カオナビの勤続年数(例: 「3年5ヶ月」)を月数に変換する
+    変換できない場合はNoneを返す
+    '''
+    if not years_of_service:
+        return None
+    years = YEARS_PATTERN.search(years_of_service)
+    months = MONTHS_PATTERN.search(years_of_service)
+    if years is None and months is None:
+        return None
+    return (int(years.group(1)) if years else 0) * 12 + (int(months.group(1)) if months else 0)
+
+
+def years_of_service_range(params):
+    '''
+    パラメータのyears_of_serviceとyears_of_service_conditionから、勤続月数の範囲(min_months, max_months)を返す
+    上限・下限が無い場合はNone、勤続年数での絞り込みをしない場合は(None, None)を返す
+    years_of_service・years_of_service_conditionが不正な場合はInvalidYearsOfServiceを送出する
+    '''
+    years = params.get('years_of_service')
+    if years is None or str(years).strip() == '':
+        return None, None
+    if not str(years).strip().isdecimal():
+        raise InvalidYearsOfService('years_of_serviceには0以上の整数を指定してください')
+    years = int(years)
+    condition = params.get('years_of_service_condition') or DEFAULT_YEARS_OF_SERVICE_CONDITION
+
+    if condition == 'or_more':
+        return years * 12, None
+    elif condition == 'or_less':
+        return None, years * 12 + 11
+    elif condition == 'band':
+        return years * 12, years * 12 + 11
+    else:
+        raise InvalidYearsOfService(f'years_of_service_conditionは{"/".join(YEARS_OF_SERVICE_CONDITIONS)}のいずれかを指定してください')
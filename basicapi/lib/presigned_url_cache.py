@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_EXPIRY_MARGIN = 300 # 署名付きURLの有効期限の何秒前まで使い回すか
+
+
+def url_generation_window():
+    '''
+    署名付きURLを使い回す期間(秒)を返す(有効期限からAWS_S3_PRESIGNED_URL_MARGINを引いたもの)
+    '''
+    margin = getattr(settings, 'AWS_S3_PRESIGNED_URL_MARGIN', DEFAULT_EXPIRY_MARGIN)
+    return max(settings.AWS_S3_EXPIRES_IN - margin, 1)
+
+
+def url_generation(now=None):
+    '''
+    現在の署名付きURLの世代(url_generation_window秒ごとに変わる)を返す
+    同じ世代の間に発行したURLは、世代が変わってからもAWS_S3_PRESIGNED_URL_MARGIN秒以上有効
+    '''
+    return int((time.time() if now is None else now) // url_generation_window())
+
+
+class PresignedUrlCache:
+    '''
+    S3の署名付きURLをオブジェクトのキーごとに保持し、発行した世代(url_generation)の間だけ使い回す
+    ETagも同じ世代ごとに変わるので、ETagが変わるまでに返したURLは、その後もAWS_S3_PRESIGNED_URL_MARGIN秒以上有効
+    同じ画像には同じURLを返すので、ブラウザ側でも画像をキャッシュできる
+    保持する件数がmax_sizeを超えた場合は、最も長く使われていないものから捨てる(LRU)
+    '''
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._urls = OrderedDict()
+
+    def get(self, key, generate):
+        '''
+        keyの署名付きURLを返す
+        generateは署名付きURLを発行する関数で、使い回せるURLが無い場合のみ呼ばれる
+        '''
+        now = time.time()
+        with self._lock:
+            cached = self._urls.get(key)
+            if cached is not None and now < cached[1]:
+                self._urls.move_to_end(key)
+                return cached[0]
+
+        url = generate()
+        reuse_until = (url_generation(now) + 1) * url_generation_window()
+
+        with self._lock:
+            self._urls[key] = (url, reuse_until)
+            self._urls.move_to_end(key)
+            while len(self._urls) > self.max_size:
+                self._urls.popitem(last=False)
+        return url
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+
+
+# プロセス全体で共有する
+presigned_url_cache = PresignedUrlCache()
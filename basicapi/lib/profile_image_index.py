@@ -0,0 +1,82 @@
+import logging
+import threading
+import time
+from botocore.exceptions import ClientError
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_IMAGE_PREFIX = 'all-profile-images/'
+DEFAULT_INDEX_TTL = 300
+
+
+class ProfileImageIndex:
+    '''
+    S3のall-profile-images/配下にあるオブジェクトのキーをプロセス内にsetで保持する
+    list_objects_v2でまとめて取得し、TTL(AWS_S3_PROFILE_IMAGE_INDEX_TTL秒)が過ぎたら取り直す
+    プロフィール画像の存在確認を社員ごとのhead_objectではなく、setの参照で済ませるためのもの
+    プロフィール画像はこのアプリの外からアップロードされるため、アップロードされた画像は最大でTTLの間は存在しないものとして扱う
+    '''
+    def __init__(self, prefix=PROFILE_IMAGE_PREFIX):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._keys = None
+        self._built_at = 0
+
+    def exists(self, key):
+        '''
+        キーが存在する場合はTrue、存在しない場合はFalseを返す
+        S3から一覧を取得できなかった場合はNoneを返す
+        '''
+        keys = self.keys()
+        if keys is None:
+            return None
+        return key in keys
+
+    def keys(self):
+        '''
+        キーの一覧を返す
+        取り直し中は、他のスレッドには取り直す前の一覧を返す(一覧が未取得の場合のみ取り直しを待つ)
+        '''
+        if self._keys is not None and not self._is_expired():
+            return self._keys
+
+        if self._lock.acquire(blocking=self._keys is None):
+            try:
+                if self._keys is None or self._is_expired():
+                    self._rebuild()
+            finally:
+                self._lock.release()
+        return self._keys
+
+    def invalidate(self):
+        '''
+        次回の参照時にS3から一覧を取り直す
+        '''
+        with self._lock:
+            self._built_at = 0
+
+    def _is_expired(self):
+        ttl = getattr(settings, 'AWS_S3_PROFILE_IMAGE_INDEX_TTL', DEFAULT_INDEX_TTL)
+        return time.time() >= self._built_at + ttl
+
+    def _rebuild(self):
+        s3_client = settings.STORAGE_CLIENT
+        keys = set()
+        try:
+            paginator = s3_client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=settings.AWS_S3_BUCKET_NAME, Prefix=self.prefix):
+                for content in page.get('Contents', []):
+                    keys.add(content['Key'])
+        except ClientError as e:
+            # 取得に失敗した場合は前回の一覧を使い続け、TTL後に再度取り直す
+            logger.error('S3からプロフィール画像の一覧を取得できませんでした: %s', e.response['Error'].get('Code'))
+            self._built_at = time.time()
+            return
+
+        self._keys = keys
+        self._built_at = time.time()
+
+
+# プロセス全体で共有する
+profile_image_index = ProfileImageIndex()
@@ -0,0 +1,94 @@
+import json
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Userのid(UUID)などのDRFのJSONEncoderと同じ形で書き出せる型はorjsonに任せ、
+# datetimeやDecimalなど書き出し方が異なる型はDRFのJSONEncoderで変換する
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson is not None else 0
+STREAMING_CHUNK_SIZE = 100
+
+
+class RawJSON(bytes):
+    '''
+    JSONにシリアライズ済みのbytes(社員ごとの文書など)
+    dumps/iter_jsonはシリアライズし直さずに、そのまま連結して書き出す
+    '''
+    pass
+
+
+def contains_raw_json(data):
+    '''
+    dataそのもの、またはdataのdictの値・listの要素(とその1つ下の階層)にRawJSONが含まれるかを返す
+    '''
+    def is_raw(value):
+        return isinstance(value, RawJSON)
+
+    def holds_raw(value):
+        if isinstance(value, dict):
+            return any(map(is_raw, value.values()))
+        if isinstance(value, (list, tuple)):
+            return any(map(is_raw, value))
+        return is_raw(value)
+
+    if isinstance(data, dict):
+        return any(map(holds_raw, data.values()))
+    if isinstance(data, (list, tuple)):
+        return any(map(holds_raw, data))
+    return is_raw(data)
+
+
+def dumps(data):
+    '''
+    dataをJSONのbytesにする
+    orjsonがインストールされている場合はorjsonを使い、無い場合は標準ライブラリのjsonを使う
+    どちらの場合もDRFのJSONRendererと同じ出力(空白なし・日本語はエスケープしない)になる
+    RawJSONを含むdict/listは、RawJSON以外の部分だけをシリアライズして連結する
+    '''
+    if isinstance(data, RawJSON):
+        return bytes(data)
+    if contains_raw_json(data):
+        if isinstance(data, dict):
+            return b'{' + b','.join(dumps(str(key)) + b':' + dumps(value) for key, value in data.items()) + b'}'
+        return b'[' + b','.join(dumps(value) for value in data) + b']'
+    if orjson is not None:
+        content = orjson.dumps(data, default=JSONEncoder().default, option=ORJSON_OPTIONS)
+    else:
+        content = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode()
+    # JSONRendererと同じく、JavaScriptの文字列中で改行扱いになるU+2028/U+2029はエスケープする
+    return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def iter_json(data, key='records', chunk_size=STREAMING_CHUNK_SIZE):
+    '''
+    dataをJSONにしたbytesを少しずつ返すジェネレーター
+    data[key]の配列はchunk_size件ずつ書き出し、大きなレスポンスでも全体を1つのbytesにしないようにする
+    '''
+    records = data[key]
+    rest = {k: v for k, v in data.items() if k != key}
+    yield b'{' + dumps(key) + b':['
+    for i in range(0, len(records), chunk_size):
+        chunk = dumps(records[i:i + chunk_size])[1:-1]
+        yield (b',' if i > 0 else b'') + chunk
+    yield b']'
+    for k, v in rest.items():
+        yield b',' + dumps(k) + b':' + dumps(v)
+    yield b'}'
+
+
+class FastJSONRenderer(JSONRenderer):
+    '''
+    DRFのJSONRendererの代わりに、orjsonでJSONを書き出すレンダラー
+    orjsonがインストールされていない場合や、インデント付きでの出力を指定された場合はJSONRendererと同じ処理をする(RawJSONを含む場合を除く)
+    '''
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # RawJSONを含む場合はJSONRendererでは書き出せないため、インデントの指定があってもdumpsで書き出す
+        if (orjson is None or self.get_indent(accepted_media_type, renderer_context or {})) and not contains_raw_json(data):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
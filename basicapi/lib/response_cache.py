@@ -0,0 +1,85 @@
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+
+DEFAULT_TTL = 60
+# パラメータが省略された場合の値(省略した場合と明示した場合で同じキャッシュを使うため)
+DEFAULT_PARAMS = dict(page='1', per_page='30')
+
+
+class ResponseCache:
+    '''
+    レスポンスのデータをDjangoのキャッシュに保持する
+    キャッシュのキーはクエリパラメータを正規化したもの
+    世代番号(generation)を持っていて、invalidateで世代を進めると、それより前に保存したキャッシュは使われなくなる(stale)
+    ヒット・ミス・staleの回数もキャッシュに記録する
+    '''
+    def __init__(self, name):
+        self.name = name
+
+    def get(self, params):
+        '''
+        キャッシュしているデータ(dict(etag=..., data=...))を返す
+        キャッシュが無い場合・古い世代のキャッシュの場合はNoneを返す
+        '''
+        entry = cache.get(self.key(params))
+        if entry is None:
+            self._count('miss')
+            return None
+        if entry['generation'] != self.generation():
+            self._count('stale')
+            return None
+        self._count('hit')
+        return entry
+
+    def set(self, params, etag, data):
+        entry = dict(generation=self.generation(), etag=etag, data=data)
+        cache.set(self.key(params), entry, getattr(settings, 'USERS_RESPONSE_CACHE_TTL', DEFAULT_TTL))
+
+    def invalidate(self):
+        '''
+        保存済みのキャッシュを全て使われないようにする
+        '''
+        key = f'{self.name}:generation'
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # addとincrの間にキャッシュから消えた場合
+            cache.set(key, 1, None)
+
+    def generation(self):
+        return cache.get(f'{self.name}:generation', 0)
+
+    def stats(self):
+        '''
+        ヒット・ミス・staleの回数を返す
+        '''
+        counts = cache.get_many([f'{self.name}:stats:{kind}' for kind in ('hit', 'miss', 'stale')])
+        return {kind: counts.get(f'{self.name}:stats:{kind}', 0) for kind in ('hit', 'miss', 'stale')}
+
+    def key(self, params):
+        return f'{self.name}:' + hashlib.sha1(json.dumps(self.normalize(params), ensure_ascii=False).encode()).hexdigest()
+
+    def normalize(self, params):
+        '''
+        クエリパラメータを、空の値を除いてキーでソートしたlistにする
+        空の値は社員一覧でも指定しなかったものとして扱うので除くが、それ以外の値は前後の空白も含めてそのままキーにする
+        (絞り込みは指定された値のまま行うため)
+        '''
+        normalized = {key: DEFAULT_PARAMS[key] for key in DEFAULT_PARAMS}
+        normalized.update({key: str(value) for key, value in params.items() if str(value) != ''})
+        return sorted(normalized.items())
+
+    def _count(self, kind):
+        key = f'{self.name}:stats:{kind}'
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+# 社員一覧(/api/users/)のレスポンスのキャッシュ
+users_response_cache = ResponseCache('users_response')
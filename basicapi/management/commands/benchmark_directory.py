@@ -0,0 +1,50 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from ...benchmarks.suite import run_benchmarks, DEFAULT_SIZES, DEFAULT_ITERATIONS
+
+
+class Command(BaseCommand):
+    '''
+    社員一覧/社員詳細/UserFilterなどの処理を、架空の社員数ごとに計測する
+    カオナビAPIとS3はスタンドインに向け、DBはテスト用のDBを作成して使うので、本番の環境には影響しない
+    デプロイ前に実行し、レイテンシ・クエリ数・カオナビAPI/S3への呼び出し回数が増えていないかを確認する
+    例) python manage.py benchmark_directory --sizes 100 1000 --kaonavi-latency 0.05 --format json
+    '''
+    help = '社員一覧/社員詳細の処理を架空の社員数ごとに計測する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='計測する社員数')
+        parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help='処理ごとの計測回数')
+        parser.add_argument('--kaonavi-latency', type=float, default=0, help='カオナビAPIの1リクエストあたりの応答時間(秒)')
+        parser.add_argument('--s3-latency', type=float, default=0, help='S3の1呼び出しあたりの応答時間(秒)')
+        parser.add_argument('--format', choices=['table', 'json'], default='table')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            if options['format'] == 'table':
+                self.stdout.write(
+                    f"{'size':>6} {'scenario':<26} {'p50_ms':>9} {'p95_ms':>9} {'max_ms':>9} "
+                    f"{'queries':>8} {'kaonavi':>8} {'s3':>6}"
+                )
+            results = run_benchmarks(
+                sizes=options['sizes'],
+                iterations=options['iterations'],
+                kaonavi_latency=options['kaonavi_latency'],
+                s3_latency=options['s3_latency'],
+                on_result=self.write_row if options['format'] == 'table' else None,
+            )
+            if options['format'] == 'json':
+                self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def write_row(self, result):
+        self.stdout.write(
+            f"{result['size']:>6} {result['scenario']:<26} {result['p50_ms']:>9} {result['p95_ms']:>9} "
+            f"{result['max_ms']:>9} {result['queries']:>8} {result['kaonavi_calls']:>8} {result['s3_calls']:>6}"
+        )
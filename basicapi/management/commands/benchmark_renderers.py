@@ -0,0 +1,34 @@
+import json
+from django.core.management.base import BaseCommand
+from ...benchmarks.renderers import run_renderer_benchmarks, DEFAULT_SIZES, DEFAULT_ITERATIONS
+
+
+class Command(BaseCommand):
+    '''
+    社員一覧のレスポンスをJSONにする時間を、DRFのJSONRendererとFastJSONRenderer(orjson/標準ライブラリ)、
+    recordsを少しずつ書き出す場合(iter_json)で比べる
+    例) python manage.py benchmark_renderers --sizes 30 300 3000
+    '''
+    help = '社員一覧のレスポンスのJSONレンダラーを比較する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='recordsの件数')
+        parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help='レンダラーごとの計測回数')
+        parser.add_argument('--format', choices=['table', 'json'], default='table')
+
+    def handle(self, *args, **options):
+        if options['format'] == 'table':
+            self.stdout.write(f"{'size':>6} {'renderer':<26} {'p50_ms':>9} {'min_ms':>9} {'bytes':>10} same_output")
+        results = run_renderer_benchmarks(
+            sizes=options['sizes'],
+            iterations=options['iterations'],
+            on_result=self.write_row if options['format'] == 'table' else None,
+        )
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+
+    def write_row(self, result):
+        self.stdout.write(
+            f"{result['size']:>6} {result['renderer']:<26} {result['p50_ms']:>9} {result['min_ms']:>9} "
+            f"{result['bytes']:>10} {result['same_output']}"
+        )
@@ -0,0 +1,43 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ...lib.kaonavi.sheet_writer import flush_self_introduction_edits, requeue_interrupted_edits, DEFAULT_BATCH_SIZE
+
+DEFAULT_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    '''
+    [PATCH] /users/:user_id で受け付けた自己紹介シートの編集を、複数社員分まとめてカオナビに送信する
+    --loopを指定した場合は常駐し、KAONAVI_SHEET_WRITE_INTERVAL秒ごとに送信待ちの編集を送信する
+    例) python manage.py flush_self_introduction_edits --loop
+    '''
+    help = '送信待ちの自己紹介シートの編集をカオナビに送信する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='常駐して定期的に送信する')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=getattr(settings, 'KAONAVI_SHEET_WRITE_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+            help='1リクエストにまとめる社員数の上限',
+        )
+
+    def handle(self, *args, **options):
+        requeue_interrupted_edits()
+        interval = getattr(settings, 'KAONAVI_SHEET_WRITE_INTERVAL', DEFAULT_INTERVAL)
+
+        while True:
+            # 送信待ちが溜まっている場合は、空になるまで続けて送信する
+            while True:
+                result = flush_self_introduction_edits(batch_size=options['batch_size'])
+                if result['sent']:
+                    self.stdout.write(
+                        f"sent={result['sent']} succeeded={result['succeeded']} "
+                        f"retrying={result['retrying']} failed={result['failed']}"
+                    )
+                if result['sent'] < options['batch_size'] or result['retrying']:
+                    break
+            if not options['loop']:
+                break
+            time.sleep(interval)
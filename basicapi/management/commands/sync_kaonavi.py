@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...lib.kaonavi.errors import KaonaviApiError
+from ...lib.kaonavi.sync import sync_kaonavi_members
+
+
+class Command(BaseCommand):
+    '''
+    カオナビの社員情報と自己紹介シートをローカルのDBに同期する
+    cronなどで定期的に実行する想定
+    例) */10 * * * * python manage.py sync_kaonavi
+    '''
+    help = 'カオナビの社員情報と自己紹介シートをローカルのDBに同期する'
+
+    def handle(self, *args, **options):
+        try:
+            result = sync_kaonavi_members()
+        except KaonaviApiError as e:
+            raise CommandError(f'カオナビから取得できなかったため同期を中止しました: {e}')
+        for name in ('members', 'sheets', 'documents'):
+            counts = result[name]
+            self.stdout.write(
+                f"{name}: created={counts['created']} updated={counts['updated']} "
+                f"deleted={counts['deleted']} unchanged={counts['unchanged']}"
+            )
+        self.stdout.write(f"version: {result['version']}")
+        self.stdout.write(self.style.SUCCESS('カオナビとの同期が完了しました'))
@@ -0,0 +1,40 @@
+# Generated by Django 4.0.2 on 2026-10-18 11:52
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basicapi', '0006_user_is_quit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KaonaviMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=10, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('name_kana', models.CharField(blank=True, default='', max_length=255)),
+                ('department_name', models.CharField(blank=True, default='', max_length=255)),
+                ('gender', models.CharField(blank=True, default='', max_length=10)),
+                ('position', models.PositiveIntegerField(db_index=True)),
+                ('payload', models.JSONField()),
+                ('synced_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='同期日時')),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='KaonaviSelfIntroductionSheet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=10, unique=True)),
+                ('payload', models.JSONField()),
+                ('synced_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='同期日時')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.2 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+def fill_service_months(apps, schema_editor):
+    from basicapi.lib.kaonavi.years_of_service import parse_years_of_service
+
+    KaonaviMember = apps.get_model('basicapi', 'KaonaviMember')
+    members = list(KaonaviMember.objects.all())
+    for member in members:
+        member.service_months = parse_years_of_service(member.payload.get('years_of_service'))
+    KaonaviMember.objects.bulk_update(members, ['service_months'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basicapi', '0007_kaonavimember_kaonaviselfintroductionsheet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kaonavimember',
+            name='service_months',
+            field=models.PositiveIntegerField(db_index=True, null=True),
+        ),
+        migrations.RunPython(fill_service_months, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.0.2 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basicapi', '0008_kaonavimember_service_months'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='kaonavimember',
+            index=models.Index(fields=['name_kana', 'code'], name='basicapi_ka_name_ka_4b912f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='kaonavimember',
+            index=models.Index(fields=['department_name', 'code'], name='basicapi_ka_departm_6a9900_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='kaonavimember',
+            index=models.Index(fields=['service_months', 'code'], name='basicapi_ka_service_31a4a2_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.0.2 on 2026-10-18 12:03
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basicapi', '0009_kaonavimember_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KaonaviChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('member', '社員情報'), ('sheet', '自己紹介シート')], max_length=10)),
+                ('code', models.CharField(db_index=True, max_length=10)),
+                ('action', models.CharField(choices=[('created', '作成'), ('updated', '更新'), ('deleted', '削除')], max_length=10)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='変更日時')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='kaonavimember',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='kaonaviselfintroductionsheet',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.2 on 2026-10-18 12:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basicapi', '0010_kaonavi_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SelfIntroductionEdit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(db_index=True, max_length=10)),
+                ('sheet', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', '送信待ち'), ('processing', '送信中'), ('succeeded', '反映済み'), ('failed', '失敗')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='送信回数')),
+                ('errors', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='登録日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='self_introduction_edits', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='selfintroductionedit',
+            index=models.Index(fields=['status', 'id'], name='basicapi_se_status_daf836_idx'),
+        ),
+    ]
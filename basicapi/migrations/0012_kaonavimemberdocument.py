@@ -0,0 +1,25 @@
+# Generated by Django 4.0.2 on 2026-10-18 12:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basicapi', '0011_selfintroductionedit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KaonaviMemberDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=10, unique=True)),
+                ('list_row', models.BinaryField()),
+                ('detail', models.BinaryField()),
+                ('source_hash', models.CharField(max_length=40)),
+                ('generated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='作成日時')),
+            ],
+        ),
+    ]
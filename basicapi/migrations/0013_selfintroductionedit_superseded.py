@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basicapi', '0012_kaonavimemberdocument'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='selfintroductionedit',
+            name='status',
+            field=models.CharField(choices=[('pending', '送信待ち'), ('processing', '送信中'), ('succeeded', '反映済み'), ('failed', '失敗'), ('superseded', '置き換え済み')], default='pending', max_length=10),
+        ),
+    ]
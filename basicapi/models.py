@@ -1,11 +1,16 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.conf import settings
 import uuid
 from datetime import datetime, timedelta
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models import Count, Max
 from django.db.models.signals import post_save
-# from django.dispatch import receiver
+from django.dispatch import receiver
+from django.utils import timezone
+from .lib.kaonavi.payload import payload_digest
+from .lib.kaonavi.years_of_service import years_of_service_range
+from .lib.response_cache import users_response_cache
 # from django.core.mail import send_mail
 
 class UserManager(BaseUserManager):
@@ -50,6 +55,24 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+def is_last_login_only(update_fields):
+    # ログインのたびのlast_loginの更新では、社員一覧/社員詳細のレスポンスは変わらない
+    return update_fields is not None and set(update_fields) <= {'last_login'}
+
+@receiver(post_save, sender=User)
+def invalidate_users_response_cache(sender, instance, update_fields=None, **kwargs):
+    # 社員一覧のレスポンスにはUserの値(メールアドレス・退職済みかなど)も含まれるため、キャッシュを無効にする
+    if is_last_login_only(update_fields):
+        return
+    users_response_cache.invalidate()
+
+@receiver(post_save, sender=User)
+def invalidate_member_document(sender, instance, update_fields=None, **kwargs):
+    # 社員ごとの文書にはUserの値(id・メールアドレス・chatwork_id)も含まれるため、作り直すまで使わない
+    if is_last_login_only(update_fields):
+        return
+    KaonaviMemberDocument.objects.invalidate([instance.kaonavi_code])
+
 # class UserActivateTokensManager(models.Manager):
 
 #     def activate_user_by_token(self, activate_token):
@@ -161,3 +184,277 @@ class LunchRequests(models.Model):
 
     def __str__(self):
         return str(self.applicant) + ' --- send to ---> ' + str(self.recipient_calender_uid)
+
+class KaonaviMemberQuerySet(models.QuerySet):
+
+    def search(self, params):
+        '''
+        lib/kaonavi/user_filter.pyのUserFilterと同じ条件(部分一致)でカオナビの社員情報を絞り込む
+        '''
+        queryset = self
+        if params.get('name'):
+            queryset = queryset.filter(name__contains=params['name'])
+        for key in ('headquarters', 'department', 'group'):
+            if params.get(key):
+                queryset = queryset.filter(department_name__contains=params[key])
+        if params.get('gender'):
+            queryset = queryset.filter(gender__contains=params['gender'])
+        min_months, max_months = years_of_service_range(params)
+        if min_months is not None:
+            queryset = queryset.filter(service_months__gte=min_months)
+        if max_months is not None:
+            queryset = queryset.filter(service_months__lte=max_months)
+        return queryset
+
+    def payloads(self):
+        return list(self.values_list('payload', flat=True))
+
+
+class KaonaviMember(models.Model):
+    ''' カオナビの社員情報(/members)をローカルに同期したもの '''
+
+    code = models.CharField(max_length=10, unique=True)
+    name = models.CharField(max_length=255)
+    name_kana = models.CharField(max_length=255, blank=True, default='')
+    department_name = models.CharField(max_length=255, blank=True, default='')
+    gender = models.CharField(max_length=10, blank=True, default='')
+    # 勤続年数(「3年5ヶ月」など)を月数にしたもの
+    service_months = models.PositiveIntegerField(null=True, db_index=True)
+    # カオナビから返ってくる並び順
+    position = models.PositiveIntegerField(db_index=True)
+    # カオナビから返ってきたmember_dataの要素をそのまま保持する
+    payload = models.JSONField()
+    # payloadのハッシュ。同期の際に中身が変わったかの判定に使う
+    content_hash = models.CharField(max_length=40, blank=True, default='')
+    synced_at = models.DateTimeField(verbose_name="同期日時", default=timezone.now)
+
+    objects = KaonaviMemberQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['position']
+        # 社員一覧のカーソルでのページネーション(sort + code順)用
+        indexes = [
+            models.Index(fields=['name_kana', 'code']),
+            models.Index(fields=['department_name', 'code']),
+            models.Index(fields=['service_months', 'code']),
+        ]
+
+    def __str__(self):
+        return f'{self.code} {self.name}'
+
+
+class KaonaviSelfIntroductionSheetQuerySet(models.QuerySet):
+
+    def existing_codes(self, kaonavi_codes):
+        '''
+        kaonavi_codesのうち、自己紹介シートのレコードがある社員のcodeをsetで返す
+        同期(sync_kaonavi)とカオナビへの作成/更新の成功時に更新しているので、
+        カオナビ上のシートをダウンロードせずに作成(POST)か更新(PATCH)かを判定できる
+        '''
+        return set(self.filter(code__in=kaonavi_codes).values_list('code', flat=True))
+
+    def store(self, sheet):
+        '''
+        自己紹介シート(カオナビのmember_dataの要素)を1件保存する
+        中身が変わっていない場合は何もせずFalseを返し、変わった場合は変更履歴も残してTrueを返す
+        '''
+        content_hash = payload_digest(sheet)
+        current = self.filter(code=sheet['code']).values_list('content_hash', flat=True).first()
+        if current == content_hash:
+            return False
+
+        with transaction.atomic():
+            self.update_or_create(
+                code=sheet['code'],
+                defaults=dict(payload=sheet, content_hash=content_hash, synced_at=timezone.now())
+            )
+            KaonaviChangeLog.objects.create(
+                kind=KaonaviChangeLog.KIND_SHEET,
+                code=sheet['code'],
+                action=KaonaviChangeLog.ACTION_CREATED if current is None else KaonaviChangeLog.ACTION_UPDATED
+            )
+        return True
+
+
+class KaonaviSelfIntroductionSheet(models.Model):
+    ''' カオナビの自己紹介シート(/sheets/:sheet_id)をローカルに同期したもの '''
+
+    code = models.CharField(max_length=10, unique=True)
+    # カオナビから返ってきたmember_dataの要素をそのまま保持する
+    payload = models.JSONField()
+    # payloadのハッシュ。同期の際に中身が変わったかの判定に使う
+    content_hash = models.CharField(max_length=40, blank=True, default='')
+    synced_at = models.DateTimeField(verbose_name="同期日時", default=timezone.now)
+
+    objects = KaonaviSelfIntroductionSheetQuerySet.as_manager()
+
+    def __str__(self):
+        return self.code
+
+
+class KaonaviMemberDocumentQuerySet(models.QuerySet):
+
+    def fragments(self, kaonavi_codes, column):
+        '''
+        kaonavi_codesの社員の文書(list_rowまたはdetail)を{code: bytes}で返す
+        文書が無い社員は含めない
+        '''
+        return {
+            code: bytes(fragment)
+            for code, fragment in self.filter(code__in=kaonavi_codes).values_list('code', column)
+        }
+
+    def invalidate(self, kaonavi_codes):
+        '''
+        元のデータが変わった社員の文書を削除する
+        作り直すまで(次のsync_kaonavi・flush_self_introduction_editsまで)は、読み込みの際にその場で作る
+        '''
+        return self.filter(code__in=kaonavi_codes).delete()
+
+
+class KaonaviMemberDocument(models.Model):
+    '''
+    社員一覧の1行分(list_row)と社員詳細(detail)のレスポンスを、社員ごとにJSONにして保存したもの
+    社員情報・自己紹介シート(送信待ちの編集を含む)・Userから作り、それらが変わった社員のみ作り直す
+    プロフィール画像のURL(image)は署名付きURLでリクエストごとに変わるため含めず、返す際に差し込む
+    '''
+
+    code = models.CharField(max_length=10, unique=True)
+    list_row = models.BinaryField()
+    detail = models.BinaryField()
+    # 元のデータのハッシュ。変わった社員の判定に使う
+    source_hash = models.CharField(max_length=40)
+    generated_at = models.DateTimeField(verbose_name="作成日時", default=timezone.now)
+
+    objects = KaonaviMemberDocumentQuerySet.as_manager()
+
+    def __str__(self):
+        return self.code
+
+
+class KaonaviChangeLogQuerySet(models.QuerySet):
+
+    def current_version(self):
+        '''
+        最新の変更履歴のidを、ローカルのDBに同期したデータのバージョンとして返す
+        '''
+        return self.aggregate(version=Max('id'))['version'] or 0
+
+
+class KaonaviChangeLog(models.Model):
+    '''
+    ローカルのDBに同期したカオナビのデータ(社員情報・自己紹介シート)の変更履歴
+    idは単調増加するので、そのままデータのバージョンとして使う
+    '''
+
+    KIND_MEMBER = 'member'
+    KIND_SHEET = 'sheet'
+    KIND = [
+        (KIND_MEMBER, '社員情報'),
+        (KIND_SHEET, '自己紹介シート'),
+    ]
+    ACTION_CREATED = 'created'
+    ACTION_UPDATED = 'updated'
+    ACTION_DELETED = 'deleted'
+    ACTION = [
+        (ACTION_CREATED, '作成'),
+        (ACTION_UPDATED, '更新'),
+        (ACTION_DELETED, '削除'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND)
+    code = models.CharField(max_length=10, db_index=True)
+    action = models.CharField(max_length=10, choices=ACTION)
+    changed_at = models.DateTimeField(verbose_name="変更日時", default=timezone.now)
+
+    objects = KaonaviChangeLogQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f'{self.id} {self.kind} {self.code} {self.action}'
+
+
+class SelfIntroductionEditQuerySet(models.QuerySet):
+
+    def unsent(self):
+        '''
+        カオナビにまだ反映していない(送信待ち・送信中の)編集に絞り込む
+        '''
+        return self.filter(status__in=[SelfIntroductionEdit.STATUS_PENDING, SelfIntroductionEdit.STATUS_PROCESSING])
+
+    def enqueue(self, user, sheet):
+        '''
+        自己紹介シートの編集(カオナビのmember_dataの要素)をカオナビへの送信待ちにする
+        同じ社員の送信待ちの編集が既にある場合は、新しく作らずにその内容を置き換える
+        置き換えは送信待ちのままの場合のみ行い、その間に送信処理(claim_edits)が送信中にした場合は新しく作る
+        '''
+        with transaction.atomic():
+            edit = self.filter(code=sheet['code'], status=SelfIntroductionEdit.STATUS_PENDING).order_by('-id').first()
+            if edit is not None:
+                updated_at = timezone.now()
+                if self.filter(id=edit.id, status=SelfIntroductionEdit.STATUS_PENDING).update(sheet=sheet, updated_at=updated_at):
+                    edit.sheet = sheet
+                    edit.updated_at = updated_at
+                    return edit
+            return self.create(user=user, code=sheet['code'], sheet=sheet)
+
+    def sheets(self, kaonavi_codes=None):
+        '''
+        編集後の自己紹介シートを社員ごとに{code: sheet}で返す
+        同じ社員の編集が複数ある場合は新しいものを使う
+        '''
+        edits = self.order_by('id')
+        if kaonavi_codes is not None:
+            edits = edits.filter(code__in=kaonavi_codes)
+        return dict(edits.values_list('code', 'sheet'))
+
+    def version(self):
+        '''
+        ETagに含めるための、編集の件数と最終更新日時を返す
+        '''
+        return self.aggregate(updated_at=Max('updated_at'), count=Count('id'))
+
+
+class SelfIntroductionEdit(models.Model):
+    '''
+    社員一覧の[PATCH] /users/:user_id で受け付けた自己紹介シートの編集
+    manage.py flush_self_introduction_editsで、複数社員分をまとめてカオナビに送信する
+    カオナビに反映されるまでは、ローカルの読み込み時にこの内容を自己紹介シートに上書きして返す
+    '''
+
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    # 送信前に同じ社員の新しい編集に置き換えられた(この編集自体は送信していない)
+    STATUS_SUPERSEDED = 'superseded'
+    STATUS = [
+        (STATUS_PENDING, '送信待ち'),
+        (STATUS_PROCESSING, '送信中'),
+        (STATUS_SUCCEEDED, '反映済み'),
+        (STATUS_FAILED, '失敗'),
+        (STATUS_SUPERSEDED, '置き換え済み'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='self_introduction_edits')
+    code = models.CharField(max_length=10, db_index=True)
+    # カオナビの自己紹介シートのmember_dataの要素と同じ形で保持する
+    sheet = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(verbose_name="送信回数", default=0)
+    errors = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(verbose_name="登録日時", auto_now_add=True)
+    updated_at = models.DateTimeField(verbose_name="更新日時", auto_now=True)
+
+    objects = SelfIntroductionEditQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.id} {self.code} {self.status}'
@@ -1,7 +1,7 @@
 from django.db.models import Q
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Profile, LunchRequests
+from .models import Profile, LunchRequests, SelfIntroductionEdit
 
 class UserSerializer(serializers.ModelSerializer):
 
@@ -49,3 +49,13 @@ class LunchRequestsSerializer(serializers.ModelSerializer):
             'applicant', 'recipient_calender_uid', 'apply_content', 'preferred_days', 'created_at',
             'updated_at'
         )
+
+class SelfIntroductionEditSerializer(serializers.ModelSerializer):
+
+    created_at = serializers.DateTimeField(format='%Y-%m-%d %H:%M:%S', read_only=True)
+    updated_at = serializers.DateTimeField(format='%Y-%m-%d %H:%M:%S', read_only=True)
+
+    class Meta:
+        model = SelfIntroductionEdit
+        fields = ('id', 'user', 'status', 'attempts', 'errors', 'created_at', 'updated_at')
+        read_only_fields = fields
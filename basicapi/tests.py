@@ -1,3 +1,652 @@
-from django.test import TestCase
+import datetime
+import decimal
+import json
+import threading
+import uuid
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import requests
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.contrib.auth.models import update_last_login
+from django.db import connection
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .benchmarks.renderers import run_renderer_benchmarks, synthetic_users_response
+from .benchmarks.fixtures import DEPARTMENTS, FIRST_NAMES, GROUPS, HEADQUARTERS, LAST_NAMES, synthetic_members, synthetic_sheets, synthetic_users, synthetic_image_keys
+from .benchmarks.stand_ins import KaonaviStub, S3Stub, stand_ins
+from .benchmarks.suite import BENCHMARK_SETTINGS, reset_state, run_benchmarks, scenarios
+from .lib.etag import make_etag
+from .lib import renderers
+from .lib.renderers import FastJSONRenderer, RawJSON, dumps, iter_json
+from .lib.kaonavi.access_token import AccessTokenCache, TOKEN_CACHE_KEY, TOKEN_LOCK_KEY
+from .lib.kaonavi.connector import KaonaviConnector
+from .lib.kaonavi.errors import KaonaviUnavailable
+from .lib.kaonavi.http import KaonaviSession, AsyncKaonaviSession
+from .lib.kaonavi.resilience import rate_limiter, circuit_breaker
+from .lib.kaonavi.sheet_writer import claim_edits, flush_self_introduction_edits
+from .lib.kaonavi.sync import sync_kaonavi_members
+from .lib.kaonavi.user_filter import UserFilter
+from .lib.kaonavi.years_of_service import parse_years_of_service, years_of_service_range
+from .lib.response_cache import users_response_cache
+from .lib.profile_image_index import ProfileImageIndex
+from .lib.presigned_url_cache import PresignedUrlCache, url_generation, url_generation_window
+from .models import User, KaonaviMember, KaonaviSelfIntroductionSheet, SelfIntroductionEdit
+from .views import async_users_view, async_user_view
 
-# Create your tests here.
+
+DIRECTORY_TEST_SETTINGS = dict(KAONAVI_DIRECTORY_SOURCE='local', **BENCHMARK_SETTINGS)
+
+
+class DirectoryTestMixin:
+    '''
+    架空の社員をローカルのDBに同期し、社員一覧のAPIを呼び出すテストの共通処理
+    カオナビAPIとS3はスタンドイン(KaonaviStub, S3Stub)に向ける
+    '''
+    size = 50
+
+    def setUp(self):
+        reset_state()
+        members = synthetic_members(self.size)
+        sheets = synthetic_sheets(members)
+        synthetic_users(members)
+        self.kaonavi = KaonaviStub(members, sheets)
+        self.stand_ins = stand_ins(self.kaonavi, S3Stub(synthetic_image_keys(members)))
+        self.stand_ins.__enter__()
+        self.addCleanup(self.stand_ins.__exit__, None, None, None)
+        sync_kaonavi_members()
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.filter(is_quit=False).first())
+
+    def get_users(self, **params):
+        response = self.client.get('/api/users/', params)
+        return response, json.loads(response.content)
+
+
+@override_settings(**DIRECTORY_TEST_SETTINGS)
+class DirectoryTestCase(DirectoryTestMixin, TestCase):
+    pass
+
+
+class UsersCursorPaginationTests(DirectoryTestCase):
+
+    def walk(self, per_page, sort):
+        '''
+        カーソルをたどって全ページを取得し、ページごとのuser_idのlistを返す
+        '''
+        pages = []
+        params = dict(pagination='cursor', per_page=per_page, sort=sort)
+        while True:
+            response, body = self.get_users(**params)
+            self.assertEqual(response.status_code, 200)
+            pages.append([record['user_id'] for record in body['records']])
+            if not body['meta']['has_next_page']:
+                return pages
+            params['cursor'] = body['meta']['next_cursor']
+
+    def test_walks_every_page_without_duplicates(self):
+        active_count = User.objects.filter(is_quit=False).count()
+        for sort in ('name_kana', '-name_kana', 'department', '-years_of_service'):
+            with self.subTest(sort=sort):
+                pages = self.walk(7, sort)
+                user_ids = [user_id for page in pages for user_id in page]
+                self.assertTrue(all(len(page) == 7 for page in pages[:-1]))
+                self.assertTrue(0 < len(pages[-1]) <= 7)
+                self.assertEqual(len(user_ids), len(set(user_ids)))
+                self.assertEqual(len(user_ids), active_count)
+
+    def test_limits_members_in_sql(self):
+        with CaptureQueriesContext(connection) as context:
+            KaonaviConnector().get_users(dict(pagination='cursor', per_page='7'))
+        members_queries = [query['sql'] for query in context.captured_queries if '"payload"' in query['sql']]
+        self.assertEqual(len(members_queries), 1)
+        self.assertIn('LIMIT 8', members_queries[0])
+
+    def test_invalid_per_page_is_bad_request(self):
+        for per_page in ('0', '-1', 'x'):
+            with self.subTest(per_page=per_page):
+                response, body = self.get_users(pagination='cursor', per_page=per_page)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('per_page', body[0])
+
+    def test_invalid_sort_or_cursor_is_bad_request(self):
+        response, _ = self.get_users(pagination='cursor', sort='salary')
+        self.assertEqual(response.status_code, 400)
+        response, _ = self.get_users(pagination='cursor', cursor='invalid')
+        self.assertEqual(response.status_code, 400)
+
+
+class UsersParameterTests(DirectoryTestCase):
+
+    def test_invalid_years_of_service_is_bad_request(self):
+        for pagination in ('page', 'cursor'):
+            for params in (dict(years_of_service='abc'), dict(years_of_service='-1'),
+                           dict(years_of_service='3', years_of_service_condition='about')):
+                with self.subTest(pagination=pagination, **params):
+                    response, body = self.get_users(pagination=pagination, **params)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('years_of_service', body[0])
+
+    def test_invalid_page_or_per_page_is_bad_request(self):
+        for params in (dict(per_page='abc'), dict(per_page='0'), dict(per_page='-1'),
+                       dict(page='abc'), dict(page='0'), dict(page='-1')):
+            with self.subTest(**params):
+                response, body = self.get_users(**params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(next(iter(params)), body[0])
+
+    def test_page_out_of_range_is_bad_request(self):
+        response, _ = self.get_users(page='100')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_fields_is_bad_request(self):
+        response, body = self.get_users(fields='name,salary')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('salary', body[0])
+        response, _ = self.get_users(pagination='cursor', fields='name,salary')
+        self.assertEqual(response.status_code, 400)
+
+    def test_years_of_service_filter(self):
+        active_codes = User.objects.filter(is_quit=False).values('kaonavi_code')
+        expected = KaonaviMember.objects.filter(code__in=active_codes, service_months__lte=9 * 12 + 11).count()
+        response, body = self.get_users(years_of_service='9', years_of_service_condition='or_less')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body['meta']['total_count'], expected)
+
+
+class UsersEtagTests(DirectoryTestCase):
+
+    def assert_conditional_get(self, url, change):
+        '''
+        ETagが変わらない間は304、changeを実行してデータが変わった後は新しいETagで200を返すこと
+        '''
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_users_list(self):
+        user = User.objects.filter(is_quit=False).last()
+
+        def change():
+            user.email = 'changed@example.com'
+            user.save()
+        self.assert_conditional_get('/api/users/?per_page=5', change)
+
+    def test_users_list_differs_by_parameters(self):
+        self.assertNotEqual(self.client.get('/api/users/?page=1')['ETag'], self.client.get('/api/users/?page=2')['ETag'])
+
+    def test_user_detail(self):
+        user = User.objects.filter(is_quit=False).last()
+
+        def change():
+            user.chatwork_id = 'changed'
+            user.save()
+        self.assert_conditional_get(f'/api/users/{user.id}/', change)
+
+
+class UsersResponseCacheTests(DirectoryTestCase):
+
+    def test_serves_same_parameters_from_cache(self):
+        response, body = self.get_users(per_page='5')
+        stats = users_response_cache.stats()
+        with mock.patch.object(KaonaviConnector, 'get_users', side_effect=AssertionError('not cached')):
+            cached_response, cached_body = self.get_users(per_page='5')
+        self.assertEqual(cached_response.status_code, 200)
+        self.assertEqual(cached_body, body)
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+        self.assertEqual(users_response_cache.stats()['hit'], stats['hit'] + 1)
+
+    def test_sync_invalidates_only_when_changed(self):
+        user = User.objects.filter(is_quit=False).first()
+        member = next(member for member in self.kaonavi.members if member['code'] == user.kaonavi_code)
+        response, body = self.get_users(name='改名')
+        self.assertEqual(body, [])
+
+        sync_kaonavi_members()
+        self.assertIsNotNone(users_response_cache.get(dict(name='改名')))
+
+        member['name'] = '改名 太郎'
+        sync_kaonavi_members()
+        self.assertIsNone(users_response_cache.get(dict(name='改名')))
+        response, body = self.get_users(name='改名')
+        self.assertEqual([record['user_id'] for record in body['records']], [str(user.id)])
+
+    def test_edit_invalidates(self):
+        user = User.objects.filter(is_quit=False).first()
+        self.get_users()
+        self.assertIsNotNone(users_response_cache.get({}))
+
+        contents = dict.fromkeys(['birth_place', 'job_description', 'career', 'hobby', 'specialty', 'strengths', 'message'], '編集後')
+        response = self.client.patch(f'/api/users/{user.id}/', dict(contents=contents), format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNone(users_response_cache.get({}))
+
+    def test_whitespace_is_part_of_cache_key(self):
+        name = KaonaviMember.objects.filter(code__in=User.objects.filter(is_quit=False).values('kaonavi_code')) \
+            .first().name
+        response, body = self.get_users(name=name)
+        self.assertGreater(len(body['records']), 0)
+        for params in (dict(name=f' {name}'), dict(name=name, page='')):
+            with self.subTest(**params):
+                uncached = KaonaviConnector().get_users(params)
+                response, body = self.get_users(**params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(body, json.loads(dumps(uncached.data)))
+
+    def test_login_keeps_users_response_cache(self):
+        self.get_users()
+        self.assertIsNotNone(users_response_cache.get({}))
+        user = User.objects.filter(is_quit=False).first()
+        update_last_login(None, user)
+        self.assertIsNotNone(users_response_cache.get({}))
+
+        user.save()
+        self.assertIsNone(users_response_cache.get({}))
+
+
+# 非同期ビューはDBへのアクセスを別スレッドで行うため、テストのデータをコミットしておく
+@override_settings(**DIRECTORY_TEST_SETTINGS)
+class AsyncUsersViewTests(DirectoryTestMixin, TransactionTestCase):
+
+    def test_invalid_fields_is_bad_request(self):
+        user = User.objects.filter(is_quit=False).first()
+        request = AsyncRequestFactory().get(
+            '/api/users/', dict(fields='name,salary'), authorization=f'JWT {AccessToken.for_user(user)}'
+        )
+        response = async_to_sync(async_users_view)(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('salary', json.loads(response.content)[0])
+
+    def test_invalid_edit_body_is_bad_request(self):
+        user = User.objects.filter(is_quit=False).first()
+        for body in (b'{"contents": ', b'\xff', b'[]', b'{}'):
+            with self.subTest(body=body):
+                request = AsyncRequestFactory().patch(
+                    f'/api/users/{user.id}/', body, content_type='application/json',
+                    authorization=f'JWT {AccessToken.for_user(user)}'
+                )
+                response = async_to_sync(async_user_view)(request, pk=user.id)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('detail', json.loads(response.content))
+
+                response = self.client.patch(f'/api/users/{user.id}/', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(SelfIntroductionEdit.objects.exists())
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    '''
+    server.statusesの先頭から順にステータスを返すHTTPサーバーのハンドラー(空になった後は200を返す)
+    '''
+    def do_GET(self):
+        self.server.requests += 1
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(KAONAVI_HTTP_BACKOFF_FACTOR=0, KAONAVI_HTTP_MAX_RETRIES=3, KAONAVI_RATE_LIMIT_PER_SECOND=0)
+class KaonaviSessionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), UpstreamHandler)
+        self.server.statuses = []
+        self.server.requests = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/members'
+        circuit_breaker.record_success()
+        self.addCleanup(circuit_breaker.record_success)
+
+    def open_circuit(self):
+        '''
+        サーキットブレーカーを開き、試しのリクエストを通せる状態にする
+        '''
+        circuit_breaker.record_success()
+        circuit_breaker.state = circuit_breaker.OPEN
+        circuit_breaker.opened_at = time.monotonic() - 3600
+
+    def test_takes_rate_limit_token_per_retry(self):
+        self.server.statuses = [503, 503]
+        with mock.patch.object(rate_limiter, 'acquire', wraps=rate_limiter.acquire) as acquire:
+            response = KaonaviSession().request('GET', self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(acquire.call_count, 3)
+
+    def test_rate_limited_trial_does_not_stick_half_open(self):
+        for session in (KaonaviSession(), AsyncKaonaviSession()):
+            with self.subTest(session=type(session).__name__):
+                self.open_circuit()
+                limited = KaonaviUnavailable('rate limited')
+                with mock.patch.object(rate_limiter, 'acquire', side_effect=limited), \
+                        mock.patch.object(rate_limiter, 'aacquire', side_effect=limited):
+                    with self.assertRaises(KaonaviUnavailable):
+                        self.request(session)
+                self.assertEqual(circuit_breaker.state, circuit_breaker.OPEN)
+                self.assertEqual(self.server.requests, 0)
+
+                # 次のリクエストで試し直し、成功すれば閉じる
+                self.assertEqual(self.request(session).status_code, 200)
+                self.assertEqual(circuit_breaker.state, circuit_breaker.CLOSED)
+                self.server.requests = 0
+
+    def request(self, session):
+        if isinstance(session, AsyncKaonaviSession):
+            return async_to_sync(session.request)('GET', self.url)
+        return session.request('GET', self.url)
+
+
+class SelfIntroductionEditQueueTests(TestCase):
+
+    def setUp(self):
+        synthetic_users(synthetic_members(1), quit_ratio=0)
+        self.user = User.objects.get()
+
+    def sheet(self, value):
+        return dict(code=self.user.kaonavi_code, records=[dict(custom_fields=[dict(id=287, values=[value])])])
+
+    def test_enqueue_replaces_pending_edit(self):
+        first = SelfIntroductionEdit.objects.enqueue(self.user, self.sheet('a'))
+        second = SelfIntroductionEdit.objects.enqueue(self.user, self.sheet('b'))
+        self.assertEqual(second.id, first.id)
+        self.assertEqual(SelfIntroductionEdit.objects.get().sheet, self.sheet('b'))
+
+    def test_enqueue_does_not_rewrite_claimed_edit(self):
+        first = SelfIntroductionEdit.objects.enqueue(self.user, self.sheet('a'))
+        claimed = claim_edits(10)
+        second = SelfIntroductionEdit.objects.enqueue(self.user, self.sheet('b'))
+
+        self.assertEqual([(edit.id, edit.sheet) for edit in claimed], [(first.id, self.sheet('a'))])
+        self.assertNotEqual(second.id, first.id)
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.sheet), (SelfIntroductionEdit.STATUS_PROCESSING, self.sheet('a')))
+        self.assertEqual(second.status, SelfIntroductionEdit.STATUS_PENDING)
+
+    def test_claim_marks_older_edits_superseded(self):
+        older = SelfIntroductionEdit.objects.create(user=self.user, code=self.user.kaonavi_code, sheet=self.sheet('a'))
+        newer = SelfIntroductionEdit.objects.create(user=self.user, code=self.user.kaonavi_code, sheet=self.sheet('b'))
+        claimed = claim_edits(10)
+
+        self.assertEqual([edit.id for edit in claimed], [newer.id])
+        older.refresh_from_db()
+        self.assertEqual(older.status, SelfIntroductionEdit.STATUS_SUPERSEDED)
+
+
+@override_settings(AWS_S3_EXPIRES_IN=3600, AWS_S3_PRESIGNED_URL_MARGIN=300, USERS_RESPONSE_CACHE_TTL=60)
+class SelfIntroductionEditFlushTests(DirectoryTestCase):
+
+    def edit(self, user, value):
+        contents = dict.fromkeys(['birth_place', 'job_description', 'career', 'hobby', 'specialty', 'strengths', 'message'], value)
+        response = self.client.patch(f'/api/users/{user.id}/', dict(contents=contents), format='json')
+        self.assertEqual(response.status_code, 202)
+
+    def test_sends_one_request_per_method(self):
+        users = list(User.objects.filter(is_quit=False))
+        existing_codes = KaonaviSelfIntroductionSheet.objects.existing_codes([user.kaonavi_code for user in users])
+        created = [user for user in users if user.kaonavi_code not in existing_codes][:3]
+        updated = [user for user in users if user.kaonavi_code in existing_codes][:3]
+        for user in created + updated:
+            self.edit(user, f'{user.kaonavi_code}の編集')
+        # 送信前に同じ社員を編集し直した場合は、最後の内容だけを送る
+        self.edit(updated[0], '編集し直し')
+
+        calls = dict(self.kaonavi.calls)
+        result = flush_self_introduction_edits()
+
+        self.assertEqual(result, dict(sent=6, succeeded=6, retrying=0, failed=0))
+        # 作成済かどうかはローカルのDBで判定するので、シートはダウンロードしない
+        sent = {endpoint: count - calls.get(endpoint, 0) for endpoint, count in self.kaonavi.calls.items()
+                if 'sheets' in endpoint and count > calls.get(endpoint, 0)}
+        self.assertEqual(sent, {'POST /sheets/20/add': 1, 'PATCH /sheets/20': 1})
+        self.assertFalse(SelfIntroductionEdit.objects.unsent().exists())
+        for user, value in [*((user, f'{user.kaonavi_code}の編集') for user in created + updated[1:]), (updated[0], '編集し直し')]:
+            sheet = KaonaviSelfIntroductionSheet.objects.get(code=user.kaonavi_code).payload
+            self.assertEqual({field['values'][0] for field in sheet['records'][0]['custom_fields']}, {value})
+
+
+class PresignedUrlGenerationTests(SimpleTestCase):
+
+    def test_urls_outlive_etag(self):
+        '''
+        ETagが変わった後もレスポンスのキャッシュの間はURLが使われるため、それまでURLが有効であること
+        '''
+        cache = PresignedUrlCache()
+        issued_at = {}
+        for now in range(0, 3600 * 3, 37):
+            with mock.patch('time.time', return_value=now):
+                url = cache.get('image.jpg', lambda: f'url-{now}')
+                issued_at.setdefault(url, now)
+                etag = make_etag('users')
+            # ETagは署名付きURLの世代が変わる時刻に変わる
+            etag_expires_at = (url_generation(now) + 1) * url_generation_window()
+            with mock.patch('time.time', return_value=etag_expires_at - 1):
+                self.assertEqual(make_etag('users'), etag)
+            with mock.patch('time.time', return_value=etag_expires_at):
+                self.assertNotEqual(make_etag('users'), etag)
+            self.assertGreaterEqual(issued_at[url] + 3600, etag_expires_at + 60, f'now={now}')
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, KAONAVI_TOKEN_REFRESH_MARGIN=300)
+class AccessTokenCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.fetch = mock.Mock(side_effect=[('token-1', 3600), ('token-2', 3600)])
+
+    def test_reuses_token_until_refresh_margin(self):
+        tokens = AccessTokenCache()
+        now = time.time()
+        with mock.patch('time.time', return_value=now):
+            self.assertEqual(tokens.get(self.fetch), 'token-1')
+            self.assertEqual(tokens.get(self.fetch), 'token-1')
+        with mock.patch('time.time', return_value=now + 3600 - 301):
+            self.assertEqual(tokens.get(self.fetch), 'token-1')
+        with mock.patch('time.time', return_value=now + 3600 - 299):
+            self.assertEqual(tokens.get(self.fetch), 'token-2')
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_shares_token_between_workers(self):
+        self.assertEqual(AccessTokenCache().get(self.fetch), 'token-1')
+        self.assertEqual(AccessTokenCache().get(self.fetch), 'token-1')
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertIsNone(cache.get(TOKEN_LOCK_KEY))
+
+    def test_async_shares_token_between_workers(self):
+        async def fetch():
+            return self.fetch()
+
+        self.assertEqual(async_to_sync(AccessTokenCache().aget)(fetch), 'token-1')
+        self.assertEqual(async_to_sync(AccessTokenCache().aget)(fetch), 'token-1')
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertIsNone(cache.get(TOKEN_LOCK_KEY))
+
+    @mock.patch('basicapi.lib.kaonavi.access_token.LOCK_TIMEOUT', 0.2)
+    @mock.patch('basicapi.lib.kaonavi.access_token.LOCK_WAIT_INTERVAL', 0.05)
+    def test_timed_out_wait_keeps_other_workers_lock(self):
+        # 他のワーカーが取り直し中のまま、待ちがタイムアウトする
+        cache.add(TOKEN_LOCK_KEY, 'other-worker', 60)
+        self.assertEqual(AccessTokenCache().get(self.fetch), 'token-1')
+        self.assertEqual(cache.get(TOKEN_LOCK_KEY), 'other-worker')
+
+        async def fetch():
+            return self.fetch()
+
+        cache.delete(TOKEN_CACHE_KEY)
+        self.assertEqual(async_to_sync(AccessTokenCache().aget)(fetch), 'token-2')
+        self.assertEqual(cache.get(TOKEN_LOCK_KEY), 'other-worker')
+
+    def test_retries_once_with_new_token_after_401(self):
+        valid_tokens = {'token-2'}
+
+        def request(method, url, headers=None, **kwargs):
+            response = requests.Response()
+            if url.endswith('/token'):
+                token, expires_in = self.fetch()
+                response.status_code, body = 200, dict(access_token=token, expires_in=expires_in)
+            elif headers['Kaonavi-Token'] in valid_tokens:
+                response.status_code, body = 200, dict(member_data=[])
+            else:
+                response.status_code, body = 401, dict(errors=['invalid token'])
+            response._content = json.dumps(body).encode()
+            return response
+
+        with mock.patch('basicapi.lib.kaonavi.connector.access_token_cache', AccessTokenCache()), \
+                mock.patch('basicapi.lib.kaonavi.connector.kaonavi_session.request', side_effect=request) as session_request:
+            self.assertEqual(KaonaviConnector(source='live').get_kaonavi_users(), [])
+        self.assertEqual(self.fetch.call_count, 2)
+        self.assertEqual(session_request.call_count, 4)
+
+
+@override_settings(AWS_S3_BUCKET_NAME='tests', AWS_S3_PROFILE_IMAGE_INDEX_TTL=300)
+class ProfileImageIndexTests(SimpleTestCase):
+
+    def test_lists_once_per_ttl(self):
+        s3 = S3Stub(['all-profile-images/a.jpg'])
+        index = ProfileImageIndex()
+        now = time.time()
+        with override_settings(STORAGE_CLIENT=s3), mock.patch('time.time', return_value=now):
+            self.assertTrue(index.exists('all-profile-images/a.jpg'))
+            s3.keys.add('all-profile-images/b.jpg')
+            self.assertFalse(index.exists('all-profile-images/b.jpg'))
+        with override_settings(STORAGE_CLIENT=s3), mock.patch('time.time', return_value=now + 300):
+            self.assertTrue(index.exists('all-profile-images/b.jpg'))
+        self.assertEqual(s3.calls, {'list_objects_v2': 2})
+
+
+class UserFilterTests(SimpleTestCase):
+
+    def linear_filter(self, params, kaonavi_users):
+        '''
+        転置インデックスを使わずに、全社員を走査して部分一致で絞り込む
+        '''
+        min_months, max_months = years_of_service_range(params)
+        departments = [params.get(key) for key in ('headquarters', 'department', 'group') if params.get(key)]
+
+        def matches(user):
+            months = parse_years_of_service(user.get('years_of_service'))
+            return (
+                (not params.get('name') or params['name'] in user['name'])
+                and all(department in user['department']['name'] for department in departments)
+                and (not params.get('gender') or params['gender'] in user['gender'])
+                and (min_months is None or (months is not None and months >= min_months))
+                and (max_months is None or (months is not None and months <= max_months))
+            )
+        return [user for user in kaonavi_users if matches(user)]
+
+    def test_matches_linear_filter(self):
+        members = synthetic_members(500)
+        queries = [
+            dict(name=LAST_NAMES[0]), dict(name=FIRST_NAMES[1][:1]), dict(name='1'), dict(name='12'),
+            dict(name=f'{LAST_NAMES[2]} {FIRST_NAMES[3]}'), dict(name='藤藤'), dict(name='存在しない'),
+            dict(headquarters=HEADQUARTERS[1]), dict(department=DEPARTMENTS[2][:2]), dict(group=GROUPS[0]),
+            dict(headquarters=HEADQUARTERS[0], department=DEPARTMENTS[0], group=GROUPS[1], gender='女性'),
+            dict(name=LAST_NAMES[4], years_of_service='10'),
+            dict(years_of_service='3', years_of_service_condition='band'),
+            dict(years_of_service='5', years_of_service_condition='or_less', department='部'),
+            dict(gender='男性'), dict(name=''),
+        ]
+        for params in queries:
+            with self.subTest(**params):
+                expected = self.linear_filter(params, members)
+                self.assertEqual(UserFilter(params, members).call(), expected)
+                self.assertEqual(UserFilter(params, members, version='v1').call(), expected)
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    '''
+    FastJSONRenderer・dumps・iter_jsonの出力が、DRFのJSONRendererとバイト単位で同じであること
+    '''
+
+    def samples(self):
+        tz = datetime.timezone(datetime.timedelta(hours=9))
+        return [
+            synthetic_users_response(30),
+            dict(
+                records=[dict(
+                    user_id=uuid.uuid4(),
+                    joined_at=datetime.datetime(2026, 10, 18, 9, 30, 15, 123456, tzinfo=tz),
+                    synced_at=datetime.datetime(2026, 10, 18, 0, 0, tzinfo=datetime.timezone.utc),
+                    naive=datetime.datetime(2026, 10, 18, 9, 30),
+                    date=datetime.date(2026, 10, 18),
+                    time=datetime.time(9, 30, 15, 500000),
+                    amount=decimal.Decimal('1234.50'),
+                    ratio=0.1,
+                    count=2 ** 53,
+                    flags=[True, False, None],
+                    message='改行\n・タブ\t・"引用"・\\・\u2028\u2029・絵文字😀・\x00',
+                    nested={1: 'int key', 'empty': {}, 'list': []},
+                )],
+                meta=dict(per_page=30, next_page=None),
+            ),
+            dict(records=[], meta=dict(total_count=0)),
+        ]
+
+    def assert_same_as_drf(self, render):
+        for data in self.samples():
+            with self.subTest(size=len(data['records'])):
+                self.assertEqual(render(data), JSONRenderer().render(data))
+
+    def test_orjson(self):
+        self.assertIsNotNone(renderers.orjson)
+        self.assert_same_as_drf(FastJSONRenderer().render)
+
+    def test_stdlib_fallback(self):
+        # FastJSONRendererはorjsonが無い場合はJSONRendererに任せるので、iter_jsonやRawJSONで使うdumpsを確かめる
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assert_same_as_drf(dumps)
+
+    def test_streaming(self):
+        for chunk_size in (1, 7, 100):
+            with self.subTest(chunk_size=chunk_size):
+                self.assert_same_as_drf(lambda data: b''.join(iter_json(data, chunk_size=chunk_size)))
+
+    def test_raw_json(self):
+        for data in self.samples():
+            with self.subTest(size=len(data['records'])):
+                records = [RawJSON(JSONRenderer().render(record)) for record in data['records']]
+                self.assertEqual(dumps(dict(data, records=records)), JSONRenderer().render(data))
+                self.assertEqual(b''.join(iter_json(dict(data, records=records), chunk_size=7)), JSONRenderer().render(data))
+
+
+class BenchmarkSuiteTests(TestCase):
+    '''
+    manage.py benchmark_directory/benchmark_renderersの計測処理が少ない件数で最後まで動くこと
+    '''
+
+    def test_directory_benchmarks(self):
+        results = run_benchmarks(sizes=(20,), iterations=1)
+        self.assertEqual([result['scenario'] for result in results], [name for name, func, warm_up in scenarios([])])
+        # ローカルのDBから返す処理は、温まった後はカオナビAPIにもS3にも問い合わせない
+        for result in results:
+            if result['scenario'].startswith('local '):
+                with self.subTest(scenario=result['scenario']):
+                    self.assertEqual((result['kaonavi_calls'], result['s3_calls']), (0, 0))
+
+    def test_renderer_benchmarks(self):
+        results = run_renderer_benchmarks(sizes=(5,), iterations=1)
+        self.assertTrue(all(result['same_output'] for result in results))
@@ -1,8 +1,10 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path
+from django.conf import settings
 from django.conf.urls import include
 from .views import CreateUserView
-from .views import UsersView, UserView
+from .views import UsersView, UserView, UsersBatchView, UsersCacheStatsView, SelfIntroductionEditView
+from .views import async_users_view, async_user_view, async_users_batch_view
 from .views import ProfileViewSet
 from .views import MyProfileListView
 # from .views import ProfileListView
@@ -15,10 +17,19 @@ router = DefaultRouter()
 router.register('profiles', ProfileViewSet)
 router.register('lunch-requests', LunchRequestsViewSet)
 
+# ASGIで動かす場合は社員一覧/社員詳細に非同期ビューを使う
+if getattr(settings, 'ASYNC_DIRECTORY_VIEWS', False):
+    users_view, user_view, users_batch_view = async_users_view, async_user_view, async_users_batch_view
+else:
+    users_view, user_view, users_batch_view = UsersView.as_view(), UserView.as_view(), UsersBatchView.as_view()
+
 urlpatterns = [
     path('users/create/', CreateUserView.as_view(), name='users-create'),
-    path('users/', UsersView.as_view(), name='users'),
-    path('users/<uuid:pk>/', UserView.as_view(), name='user'),
+    path('users/', users_view, name='users'),
+    path('users/batch/', users_batch_view, name='users-batch'),
+    path('users/cache-stats/', UsersCacheStatsView.as_view(), name='users-cache-stats'),
+    path('users/<uuid:pk>/', user_view, name='user'),
+    path('users/<uuid:pk>/self-introduction-edits/<int:edit_id>/', SelfIntroductionEditView.as_view(), name='self-introduction-edit'),
     path('users/profile/<uuid:pk>/', MyProfileListView.as_view(), name='my-profile'),
     # path('users/profile/<uuid:pk>/', ProfileListView.as_view(), name='users-profile'),
     path('lunch-requests/<uuid:pk>/', MyLunchRequestsListView.as_view(), name='my-lunch-requests'),
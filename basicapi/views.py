@@ -1,54 +1,302 @@
-from django.http import HttpResponse
-from rest_framework.exceptions import ValidationError
-from rest_framework.generics import CreateAPIView, RetrieveUpdateAPIView
+import json
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.exceptions import ValidationError, APIException
+from rest_framework.generics import CreateAPIView, RetrieveAPIView, RetrieveUpdateAPIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework.views import APIView
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework import status
-from .models import User, Profile, LunchRequests
-from .serializers import UserSerializer, ProfileSerializer, LunchRequestsSerializer
+from .models import User, Profile, LunchRequests, SelfIntroductionEdit
+from .serializers import UserSerializer, ProfileSerializer, LunchRequestsSerializer, SelfIntroductionEditSerializer
 from django.db.models import Q
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
 from datetime import datetime
 from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from .lib.kaonavi.connector import KaonaviConnector
+from .lib.kaonavi.async_connector import AsyncKaonaviConnector, sync_to_worker
+from .lib.kaonavi.errors import KaonaviApiError
+from .lib.renderers import dumps, iter_json
+from .lib.response_cache import users_response_cache
+
+DEFAULT_STREAMING_THRESHOLD = 200
 
 
 class CreateUserView(CreateAPIView):
     serializer_class = UserSerializer
     permission_classes = (AllowAny,)
 
+def not_modified(request, etag):
+    '''
+    リクエストのIf-None-MatchがETagと一致する場合は304のレスポンスを返す(200の場合と同じくETagを含める)
+    一致しない場合はNoneを返す
+    '''
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        with_etag(response, etag)
+    return response
+
+def with_etag(response, etag):
+    # ブラウザには毎回ETagで再検証させる
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def users_response(data, status_code, response_class=Response):
+    '''
+    社員一覧のレスポンスを返す
+    recordsの件数が多い場合は、JSONを全件分まとめて作らずに少しずつ書き出す
+    '''
+    threshold = getattr(settings, 'USERS_STREAMING_THRESHOLD', DEFAULT_STREAMING_THRESHOLD)
+    if isinstance(data, dict) and len(data.get('records', [])) >= threshold:
+        return StreamingHttpResponse(iter_json(data), status=status_code, content_type='application/json')
+    return response_class(data, status=status_code)
+
+def with_stale_warning(response, connector):
+    # カオナビAPIに障害があり、最後に取得できたデータを返した場合はその旨をヘッダーで知らせる
+    if connector.stale:
+        response['Warning'] = '110 - "Response is Stale"'
+    return response
+
+def kaonavi_unavailable(error):
+    '''
+    カオナビAPIから取得できず、返せるデータも無い場合のレスポンスの中身を返す
+    '''
+    return dict(detail='カオナビAPIから社員情報を取得できませんでした', errors=list(map(str, error.errors)))
+
 class UsersView(APIView):
     def get(self, request):
-        response = KaonaviConnector().get_users(request.query_params)
+        # 同じ絞り込み条件のレスポンスはキャッシュから返す
+        cached = users_response_cache.get(request.query_params)
+        if cached is not None:
+            response = not_modified(request, cached['etag'])
+            if response is not None:
+                return response
+            return with_etag(users_response(cached['data'], status.HTTP_200_OK), cached['etag'])
+
+        connector = KaonaviConnector()
+        try:
+            etag = connector.users_etag(request.query_params)
+            response = not_modified(request, etag)
+            if response is not None:
+                return with_stale_warning(response, connector)
+
+            response = connector.get_users(request.query_params)
+        except KaonaviApiError as e:
+            return Response(kaonavi_unavailable(e), status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
         if response.is_success():
-            return Response(response.data, status=status.HTTP_200_OK)
+            # 古いデータはキャッシュしない
+            if not connector.stale:
+                users_response_cache.set(request.query_params, etag, response.data)
+            return with_stale_warning(with_etag(users_response(response.data, status.HTTP_200_OK), etag), connector)
         else:
-            return Response(response.error_messages(), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            # 失敗するのはパラメータ(sort・cursor・pageなど)が不正な場合
+            return Response(response.error_messages(), status=status.HTTP_400_BAD_REQUEST)
+
+class UsersCacheStatsView(APIView):
+    '''
+    社員一覧のレスポンスのキャッシュのヒット・ミス・stale(無効化後の古いキャッシュ)の回数を返す
+    '''
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(users_response_cache.stats(), status=status.HTTP_200_OK)
 
 class UserView(APIView):
     def get(self, request, pk):
         user = User.objects.get(pk=pk)
         kaonavi_code = user.kaonavi_code
-        response = KaonaviConnector().get_user(user.id, kaonavi_code)
+        connector = KaonaviConnector()
+        fields = request.query_params.get('fields')
+        try:
+            etag = connector.user_etag(user, fields)
+            response = not_modified(request, etag)
+            if response is not None:
+                return with_stale_warning(response, connector)
+
+            response = connector.get_user(user.id, kaonavi_code, fields)
+        except KaonaviApiError as e:
+            return Response(kaonavi_unavailable(e), status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
         if response.is_success():
-            return Response(response.data, status=status.HTTP_200_OK)
+            return with_stale_warning(with_etag(Response(response.data, status=status.HTTP_200_OK), etag), connector)
         else:
             return Response(response.error_messages(), status=status.HTTP_400_BAD_REQUEST)
 
     def patch(self, request, pk):
+        # カオナビへの送信はflush_self_introduction_editsでまとめて行うため、受け付けた時点で202を返す
         user = User.objects.get(pk=pk)
-        params = request.data
-        response = KaonaviConnector().create_or_update_self_introduction_info(user, params['contents'])
+        contents = edit_contents(request.data)
+        if contents is None:
+            return Response(INVALID_EDIT_BODY, status=status.HTTP_400_BAD_REQUEST)
+        response = KaonaviConnector().enqueue_self_introduction_info(user, contents)
+        return Response(accepted_edit(user, response.data), status=status.HTTP_202_ACCEPTED)
+
+class UsersBatchView(APIView):
+    '''
+    複数の社員詳細をまとめて返す(/users/batch/?ids=...)
+    '''
+    def get(self, request):
+        connector = KaonaviConnector()
+        try:
+            etag = connector.users_etag(request.query_params)
+            response = not_modified(request, etag)
+            if response is not None:
+                return with_stale_warning(response, connector)
+
+            response = connector.get_users_by_ids(request.query_params.get('ids'), request.query_params.get('fields'))
+        except KaonaviApiError as e:
+            return Response(kaonavi_unavailable(e), status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        if response.is_success():
+            return with_stale_warning(with_etag(Response(response.data, status=status.HTTP_200_OK), etag), connector)
+        else:
+            return Response(response.error_messages(), status=status.HTTP_400_BAD_REQUEST)
+
+INVALID_EDIT_BODY = dict(detail='contentsを含むJSONのオブジェクトを送信してください')
+
+def edit_contents(data):
+    '''
+    [PATCH] /users/:user_id の本文から自己紹介シートの編集内容(contents)を返す
+    本文がcontentsを含むオブジェクトでない場合はNoneを返す
+    '''
+    if not isinstance(data, dict) or 'contents' not in data:
+        return None
+    return data['contents']
+
+def accepted_edit(user, edit):
+    '''
+    自己紹介シートの編集を受け付けた際のレスポンスを返す
+    カオナビへの反映状況はedit_idで[GET] /users/:user_id/self-introduction-edits/:edit_id から確認できる
+    '''
+    return dict(user_id=user.id, success=True, edit_id=edit.id, status=edit.status)
+
+class SelfIntroductionEditView(RetrieveAPIView):
+    '''
+    自己紹介シートの編集のカオナビへの反映状況を返す
+    '''
+    queryset = SelfIntroductionEdit.objects.all()
+    serializer_class = SelfIntroductionEditSerializer
+    lookup_url_kwarg = 'edit_id'
+
+    def get_queryset(self):
+        return self.queryset.filter(user=self.kwargs['pk'])
+
+# ↓ ASGIで動かす場合(ASYNC_DIRECTORY_VIEWS=True)に使う、UsersView/UserView/UsersBatchViewの非同期版
+# Django4.0ではクラスベースビューを非同期にできないため関数ベースで書いている
+
+async def authenticate(request):
+    '''
+    DRFのJWT認証を非同期ビューで行う
+    認証できた場合はTrueを返す
+    '''
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except APIException:
+        return False
+    return result is not None
+
+def json_response(data, status):
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+async def async_users_view(request):
+    if request.method != 'GET':
+        return json_response(dict(detail=f'Method "{request.method}" not allowed.'), status.HTTP_405_METHOD_NOT_ALLOWED)
+    if not await authenticate(request):
+        return json_response(dict(detail='認証情報が含まれていません。'), status.HTTP_401_UNAUTHORIZED)
+
+    cached = await sync_to_async(users_response_cache.get)(request.GET)
+    if cached is not None:
+        response = not_modified(request, cached['etag'])
+        if response is not None:
+            return response
+        return with_etag(users_response(cached['data'], status.HTTP_200_OK, json_response), cached['etag'])
+
+    connector = AsyncKaonaviConnector()
+    try:
+        etag = await connector.ausers_etag(request.GET)
+        response = not_modified(request, etag)
+        if response is not None:
+            return with_stale_warning(response, connector)
+
+        response = await connector.aget_users(request.GET)
+    except KaonaviApiError as e:
+        return json_response(kaonavi_unavailable(e), status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if response.is_success():
+        if not connector.stale:
+            await sync_to_async(users_response_cache.set)(request.GET, etag, response.data)
+        return with_stale_warning(with_etag(users_response(response.data, status.HTTP_200_OK, json_response), etag), connector)
+    else:
+        return json_response(response.error_messages(), status.HTTP_400_BAD_REQUEST)
+
+async def async_user_view(request, pk):
+    if request.method not in ('GET', 'PATCH'):
+        return json_response(dict(detail=f'Method "{request.method}" not allowed.'), status.HTTP_405_METHOD_NOT_ALLOWED)
+    if not await authenticate(request):
+        return json_response(dict(detail='認証情報が含まれていません。'), status.HTTP_401_UNAUTHORIZED)
+
+    user = await sync_to_worker(User.objects.get)(pk=pk)
+    connector = AsyncKaonaviConnector()
+
+    if request.method == 'GET':
+        try:
+            etag = await connector.auser_etag(user, request.GET.get('fields'))
+            response = not_modified(request, etag)
+            if response is not None:
+                return with_stale_warning(response, connector)
+
+            response = await connector.aget_user(user.id, user.kaonavi_code, request.GET.get('fields'))
+        except KaonaviApiError as e:
+            return json_response(kaonavi_unavailable(e), status.HTTP_503_SERVICE_UNAVAILABLE)
 
         if response.is_success():
-            data = dict(user_id=user.id, success=True)
-            return Response(data, status=status.HTTP_200_OK)
+            return with_stale_warning(with_etag(json_response(response.data, status.HTTP_200_OK), etag), connector)
         else:
-            data = dict(user_id=user.id, success=False, errors=response.errors)
-            return Response(data, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return json_response(response.error_messages(), status.HTTP_400_BAD_REQUEST)
+
+    # UserViewと同じく、JSONとして読めない本文はDRFのParseErrorと同じ400にする
+    try:
+        contents = edit_contents(json.loads(request.body))
+    except ValueError as e:
+        # JSONとして不正な場合(JSONDecodeError)・文字コードが不正な場合(UnicodeDecodeError)
+        return json_response(dict(detail=f'JSON parse error - {e}'), status.HTTP_400_BAD_REQUEST)
+    if contents is None:
+        return json_response(INVALID_EDIT_BODY, status.HTTP_400_BAD_REQUEST)
+    response = await connector.aenqueue_self_introduction_info(user, contents)
+    return json_response(accepted_edit(user, response.data), status.HTTP_202_ACCEPTED)
+
+async def async_users_batch_view(request):
+    if request.method != 'GET':
+        return json_response(dict(detail=f'Method "{request.method}" not allowed.'), status.HTTP_405_METHOD_NOT_ALLOWED)
+    if not await authenticate(request):
+        return json_response(dict(detail='認証情報が含まれていません。'), status.HTTP_401_UNAUTHORIZED)
+
+    connector = AsyncKaonaviConnector()
+    try:
+        etag = await connector.ausers_etag(request.GET)
+        response = not_modified(request, etag)
+        if response is not None:
+            return with_stale_warning(response, connector)
+
+        response = await connector.aget_users_by_ids(request.GET.get('ids'), request.GET.get('fields'))
+    except KaonaviApiError as e:
+        return json_response(kaonavi_unavailable(e), status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if response.is_success():
+        return with_stale_warning(with_etag(json_response(response.data, status.HTTP_200_OK), etag), connector)
+    else:
+        return json_response(response.error_messages(), status.HTTP_400_BAD_REQUEST)
+
+# JWT認証なのでCSRFのチェックは不要(csrf_exemptデコレータは非同期ビューに使えない)
+async_users_view.csrf_exempt = True
+async_user_view.csrf_exempt = True
+async_users_batch_view.csrf_exempt = True
 
 class ProfileViewSet(ModelViewSet):
     queryset = Profile.objects.all()
@@ -14,12 +14,44 @@ SECRET_KEY = env.str('SECRET_KEY')
 
 KAONAVI_API_KEY = env.str('KAONAVI_API_KEY')
 KAONAVI_API_SECRET = env.str('KAONAVI_API_SECRET')
+# カオナビAPIのアクセストークンを有効期限の何秒前に取り直すか
+KAONAVI_TOKEN_REFRESH_MARGIN = env.int('KAONAVI_TOKEN_REFRESH_MARGIN', default=300)
+# 社員一覧/社員詳細の読み込み元
+# local: manage.py sync_kaonaviで同期したDBから読む、live: リクエストの度にカオナビAPIから取得する
+KAONAVI_DIRECTORY_SOURCE = env.str('KAONAVI_DIRECTORY_SOURCE', default='local')
+# カオナビAPIへ並行してリクエストする際のスレッド数の上限
+KAONAVI_FETCH_WORKERS = env.int('KAONAVI_FETCH_WORKERS', default=8)
+# カオナビAPIへのHTTP接続の設定(コネクションプールのサイズ、タイムアウト秒、429/5xx時の再試行)
+KAONAVI_HTTP_POOL_SIZE = env.int('KAONAVI_HTTP_POOL_SIZE', default=10)
+KAONAVI_HTTP_CONNECT_TIMEOUT = env.float('KAONAVI_HTTP_CONNECT_TIMEOUT', default=3.05)
+KAONAVI_HTTP_READ_TIMEOUT = env.float('KAONAVI_HTTP_READ_TIMEOUT', default=30)
+KAONAVI_HTTP_MAX_RETRIES = env.int('KAONAVI_HTTP_MAX_RETRIES', default=3)
+KAONAVI_HTTP_BACKOFF_FACTOR = env.float('KAONAVI_HTTP_BACKOFF_FACTOR', default=0.5)
+# カオナビAPIへのリクエストのレート制限(1秒あたりのリクエスト数、まとめて送れる数、待つ秒数の上限)。0で制限しない
+KAONAVI_RATE_LIMIT_PER_SECOND = env.float('KAONAVI_RATE_LIMIT_PER_SECOND', default=5)
+KAONAVI_RATE_LIMIT_BURST = env.int('KAONAVI_RATE_LIMIT_BURST', default=10)
+KAONAVI_RATE_LIMIT_MAX_WAIT = env.float('KAONAVI_RATE_LIMIT_MAX_WAIT', default=10)
+# カオナビAPIへのリクエストが何回続けて失敗したらサーキットブレーカーを開くか、何秒後に再度試すか
+KAONAVI_CIRCUIT_FAILURE_THRESHOLD = env.int('KAONAVI_CIRCUIT_FAILURE_THRESHOLD', default=5)
+KAONAVI_CIRCUIT_RESET_TIMEOUT = env.float('KAONAVI_CIRCUIT_RESET_TIMEOUT', default=30)
+# カオナビAPIから取得できない間、最後に取得できたデータを返しつつバックグラウンドで取り直す間隔(秒)
+KAONAVI_STALE_REFRESH_INTERVAL = env.int('KAONAVI_STALE_REFRESH_INTERVAL', default=30)
+# 自己紹介シートの編集をカオナビに送信する際に、1リクエストにまとめる社員数の上限と、送信を試みる回数の上限
+KAONAVI_SHEET_WRITE_BATCH_SIZE = env.int('KAONAVI_SHEET_WRITE_BATCH_SIZE', default=100)
+KAONAVI_SHEET_WRITE_MAX_ATTEMPTS = env.int('KAONAVI_SHEET_WRITE_MAX_ATTEMPTS', default=3)
+# manage.py flush_self_introduction_edits --loop で送信待ちの編集を確認する間隔(秒)
+KAONAVI_SHEET_WRITE_INTERVAL = env.float('KAONAVI_SHEET_WRITE_INTERVAL', default=5)
 
 AWS_ACCESS_KEY_ID = env.str('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = env.str('AWS_SECRET_ACCESS_KEY')
 AWS_S3_BUCKET_NAME = env.str('AWS_S3_BUCKET_NAME')
 AWS_S3_REGION_NAME = env.str('AWS_S3_REGION_NAME')
 AWS_S3_EXPIRES_IN = env.int('AWS_S3_EXPIRES_IN')
+# プロフィール画像の一覧(all-profile-images/配下のキー)をS3から取り直す間隔(秒)
+AWS_S3_PROFILE_IMAGE_INDEX_TTL = env.int('AWS_S3_PROFILE_IMAGE_INDEX_TTL', default=300)
+# 署名付きURLを有効期限(AWS_S3_EXPIRES_IN)の何秒前まで使い回すか
+# 社員一覧のレスポンスのキャッシュ(USERS_RESPONSE_CACHE_TTL)より長くすること
+AWS_S3_PRESIGNED_URL_MARGIN = env.int('AWS_S3_PRESIGNED_URL_MARGIN', default=300)
 
 STORAGE_CLIENT = boto3.client('s3',
             aws_access_key_id=AWS_ACCESS_KEY_ID,
@@ -85,6 +117,9 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'unityapi.wsgi.application'
+ASGI_APPLICATION = 'unityapi.asgi.application'
+# ASGI(unityapi.asgi)で動かす場合はTrueにし、社員一覧/社員詳細(/api/users/)を非同期ビューで処理する
+ASYNC_DIRECTORY_VIEWS = env.bool('ASYNC_DIRECTORY_VIEWS', default=False)
 
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -93,8 +128,18 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
+    # JSONの書き出しはorjsonで行う(orjsonが無い場合はDRFのJSONRendererと同じ処理になる)
+    'DEFAULT_RENDERER_CLASSES': [
+        'basicapi.lib.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
+# 社員一覧のレスポンスのrecordsがこの件数以上の場合は、JSONを少しずつ書き出す(StreamingHttpResponse)
+USERS_STREAMING_THRESHOLD = env.int('USERS_STREAMING_THRESHOLD', default=200)
+# 社員詳細のまとめて取得(/users/batch/)で一度に指定できるidの数
+USERS_BATCH_MAX_IDS = env.int('USERS_BATCH_MAX_IDS', default=50)
+
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT',),
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=1440)
@@ -130,6 +175,14 @@ DATABASES = {
     }
 }
 
+# カオナビAPIのアクセストークンなどを複数ワーカーで共有するためのキャッシュ
+# 例) CACHE_URL=rediscache://127.0.0.1:6379/1
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+# 社員一覧(/api/users/)のレスポンスをキャッシュする秒数
+USERS_RESPONSE_CACHE_TTL = env.int('USERS_RESPONSE_CACHE_TTL', default=60)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',